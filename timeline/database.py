@@ -1,41 +1,106 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
 from datetime import date, datetime, time, timedelta, timezone
+from functools import cached_property
+from itertools import groupby, islice
 from pathlib import Path
-from timeline.filesystem import get_checksum
+from timeline.filesystem import (
+    get_checksum,
+    get_fingerprint,
+    FINGERPRINT_BLOCK_SIZE,
+    FINGERPRINT_PREFIX,
+    TREE_CHECKSUM_PREFIX,
+)
 from timeline.models import TimelineFile, TimelineEntry, EntryType
+from timeline.stats import RunStats
+from hashlib import blake2b
 from typing import Iterable
 import json
 import sqlite3
 
 
-sqlite3.register_adapter(datetime, lambda val: val.isoformat())
-sqlite3.register_converter(
-    "timestamp", lambda val: datetime.fromisoformat(val.decode())
-)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
-def get_connection(db_path: Path):
-    connection = sqlite3.connect(
-        db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-    )
+@dataclass
+class ConnectionProfile:
+    """
+    Sqlite settings for the timeline database. They are faster than the
+    defaults for large databases and bulk updates. With synchronous=NORMAL in
+    WAL mode, a power loss can lose the last transactions, but it can't
+    corrupt the database.
+    """
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    cache_size_mb: int = 64
+    mmap_size_mb: int = 256
+    temp_store: str = "MEMORY"
+
+
+def get_connection(db_path: Path, profile: ConnectionProfile | None = None):
+    connection = sqlite3.connect(db_path)
     connection.execute("PRAGMA foreign_keys = ON")
+    if profile:
+        # Only applies to new databases. optimize_database converts existing ones.
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+        connection.execute(f"PRAGMA synchronous = {profile.synchronous}")
+        connection.execute(f"PRAGMA cache_size = {-profile.cache_size_mb * 1024}")  # Negative values are in KiB
+        connection.execute(f"PRAGMA mmap_size = {profile.mmap_size_mb * 1024 * 1024}")
+        connection.execute(f"PRAGMA temp_store = {profile.temp_store}")
     return connection
 
 
-def to_db_datetime(python_date: datetime | date) -> datetime:
+def get_database_size(db_path: Path) -> int:
     """
-    Converts a timezone-aware datetime to UTC and removes timezone information.
-    Sqlite does not support timezones properly.
+    Returns the size of the database file and its write-ahead log, in bytes.
+    """
+    wal_path = db_path.with_name(db_path.name + "-wal")
+    return sum(path.stat().st_size for path in (db_path, wal_path) if path.exists())
+
+
+def optimize_database(db_path: Path) -> int:
+    """
+    Update the query planner statistics, reclaim unused space and checkpoint
+    the write-ahead log. Returns the number of bytes reclaimed.
+    """
+    size_before = get_database_size(db_path)
+    connection = get_connection(db_path)
+    try:
+        connection.execute("ANALYZE")
+        connection.execute("PRAGMA optimize")
+        connection.commit()
+
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:  # Incremental
+            # executescript runs the pragma until the end. execute only frees one page.
+            connection.executescript("PRAGMA incremental_vacuum")
+        else:
+            # Databases created before incremental vacuum need a full vacuum once
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
+
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    finally:
+        connection.close()
+    return size_before - get_database_size(db_path)
+
+
+def to_db_timestamp(python_date: datetime | date) -> int:
+    """
+    Converts a datetime to the number of microseconds since the epoch, in UTC.
+    Naive datetimes and dates are in the local timezone.
     """
     if not isinstance(python_date, datetime):
         python_date = datetime.combine(python_date, time.min)
-    return python_date.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = python_date.astimezone(timezone.utc) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
 
 
-def datetime_from_db(date: datetime) -> datetime:
+def datetime_from_db(timestamp: int) -> datetime:
     """
-    Converts a date from the database into a timezone-aware datetime object.
+    Converts a timestamp from the database into a timezone-aware datetime object.
     """
-    return date.replace(tzinfo=timezone.utc).astimezone()  # Local timezone
+    return (EPOCH + timedelta(microseconds=timestamp)).astimezone()  # Local timezone
 
 
 def days_in_range(start: datetime, end: datetime) -> Iterable[date]:
@@ -44,10 +109,50 @@ def days_in_range(start: datetime, end: datetime) -> Iterable[date]:
     return [date_start + timedelta(days=x) for x in range(days_count)]
 
 
+def get_entry_days(date_start: int, date_end: int | None) -> list[str]:
+    """
+    Returns the local days covered by an entry, as YYYY-MM-DD strings. The
+    dates are in the database format.
+    """
+    entry_start = datetime_from_db(date_start)
+    entry_end = datetime_from_db(date_end) if date_end else entry_start
+    return [day.isoformat() for day in days_in_range(entry_start, entry_end)]
+
+
+def to_db_integer(value: int | None) -> int | None:
+    """
+    Converts an unsigned 64-bit integer (like an inode number) to the signed
+    integer that Sqlite can store.
+    """
+    if value is not None and value >= 2**63:
+        return value - 2**64
+    return value
+
+
 def clear_table(cursor, table_name):
     cursor.execute(f"DELETE FROM {table_name}")
 
 
+def add_missing_columns(
+    cursor, table_name: str, columns: dict[str, str]
+) -> list[str]:
+    """
+    Add columns that were added to a table after it was created. Returns the
+    names of the columns that were added.
+    """
+    existing_columns = {
+        row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})").fetchall()
+    }
+    added_columns = []
+    for column_name, column_definition in columns.items():
+        if column_name not in existing_columns:
+            cursor.execute(
+                f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}"
+            )
+            added_columns.append(column_name)
+    return added_columns
+
+
 def create_found_files_table(cursor):
     # All files currently found on the filesystem
     cursor.execute("""
@@ -56,9 +161,17 @@ def create_found_files_table(cursor):
             size INTEGER,
             date_added TIMESTAMP NOT NULL,
             file_mtime TIMESTAMP,
-            checksum TEXT
+            checksum TEXT,
+            full_checksum TEXT,
+            device INTEGER,
+            inode INTEGER
         );
     """)
+    add_missing_columns(
+        cursor,
+        "found_files",
+        {"full_checksum": "TEXT", "device": "INTEGER", "inode": "INTEGER"},
+    )
 
 
 def create_timeline_files_table(cursor):
@@ -70,9 +183,38 @@ def create_timeline_files_table(cursor):
             date_added TIMESTAMP NOT NULL,
             date_processed TIMESTAMP,
             file_mtime TIMESTAMP,
-            checksum TEXT
+            checksum TEXT,
+            full_checksum TEXT,
+            device INTEGER,
+            inode INTEGER,
+            duplicate_of TEXT
         );
     """)
+    add_missing_columns(
+        cursor,
+        "timeline_files",
+        {"device": "INTEGER", "inode": "INTEGER", "duplicate_of": "TEXT"},
+    )
+    # Used to find the checksum of moved files
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS timeline_files_inode
+        ON timeline_files (device, inode)
+    """)
+    # Duplicates have no entries. They use the entries of the file they duplicate.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS timeline_files_duplicate_of
+        ON timeline_files (duplicate_of)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS timeline_files_checksum
+        ON timeline_files (checksum)
+    """)
+
+    # The checksum identifies the file. It's either the full_checksum, or a
+    # fingerprint if the full checksum was not calculated yet.
+    if add_missing_columns(cursor, "timeline_files", {"full_checksum": "TEXT"}):
+        # Before fingerprints, all checksums were full checksums
+        cursor.execute("UPDATE timeline_files SET full_checksum = checksum")
 
 
 def create_timeline_entries_table(cursor):
@@ -88,20 +230,299 @@ def create_timeline_entries_table(cursor):
     """)
 
 
-def create_dates_with_changes_table(cursor):
-    # All days where a timeline entry was created or updated
+def create_scanned_directories_table(cursor):
+    # The content of each directory the last time it was scanned
     cursor.execute("""
-        CREATE TEMP TABLE IF NOT EXISTS dates_with_changes (
-            timeline_date TIMESTAMP PRIMARY KEY NOT NULL
-        )
+        CREATE TABLE IF NOT EXISTS scanned_directories (
+            directory_path TEXT PRIMARY KEY NOT NULL,
+            directory_mtime INTEGER NOT NULL,
+            subdirectories TEXT NOT NULL,
+            files TEXT NOT NULL
+        );
     """)
 
 
-def create_database(cursor):
+def migrate_initial_schema(cursor):
+    # Databases from before schema versioning can have some tables and columns missing
     create_found_files_table(cursor)
     create_timeline_files_table(cursor)
     create_timeline_entries_table(cursor)
-    create_dates_with_changes_table(cursor)
+    create_scanned_directories_table(cursor)
+
+
+def migrate_timeline_entries_primary_key(cursor):
+    # Add a primary key and indexes to timeline_entries. Sqlite can't add a
+    # primary key to an existing table, so the table is rebuilt.
+    cursor.execute("""
+        CREATE TABLE timeline_entries_new (
+            entry_id INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL REFERENCES timeline_files (file_path) ON DELETE CASCADE,
+            entry_type TEXT NOT NULL,
+            date_start TIMESTAMP NOT NULL,
+            date_end TIMESTAMP,
+            entry_data TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO timeline_entries_new (file_path, entry_type, date_start, date_end, entry_data)
+        SELECT file_path, entry_type, date_start, date_end, entry_data FROM timeline_entries
+    """)
+    cursor.execute("DROP TABLE timeline_entries")
+    cursor.execute("ALTER TABLE timeline_entries_new RENAME TO timeline_entries")
+    cursor.execute("CREATE INDEX timeline_entries_file_path ON timeline_entries (file_path)")
+    cursor.execute("CREATE INDEX timeline_entries_type ON timeline_entries (entry_type, date_start)")
+    cursor.execute("CREATE INDEX timeline_entries_date_start ON timeline_entries (date_start)")
+    cursor.execute("CREATE INDEX timeline_entries_date_end ON timeline_entries (date_end)")
+
+
+def migrate_entry_days(cursor):
+    # The local days covered by each entry, so that the entries of a day can
+    # be found with an index.
+    cursor.execute("""
+        CREATE TABLE entry_days (
+            day TEXT NOT NULL,
+            entry_id INTEGER NOT NULL REFERENCES timeline_entries (entry_id) ON DELETE CASCADE,
+            PRIMARY KEY (day, entry_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX entry_days_entry_id ON entry_days (entry_id)")
+
+    last_entry_id = 0
+    while entries := cursor.execute(
+        """
+        SELECT entry_id, date_start, date_end FROM timeline_entries
+        WHERE entry_id > ? ORDER BY entry_id LIMIT 10000
+        """,
+        [last_entry_id],
+    ).fetchall():
+        add_entry_days(
+            cursor,
+            [
+                (entry_id, timestamp_from_iso(date_start), timestamp_from_iso(date_end))
+                for entry_id, date_start, date_end in entries
+            ],
+        )
+        last_entry_id = entries[-1][0]
+
+
+def migrate_entry_hash(cursor):
+    # A hash of each entry's content, to compare entries without comparing their
+    # data. Existing entries are hashed by migrate_integer_timestamps.
+    cursor.execute("ALTER TABLE timeline_entries ADD COLUMN entry_hash BLOB")
+    cursor.execute("DROP INDEX timeline_entries_file_path")
+    cursor.execute("CREATE INDEX timeline_entries_file_path ON timeline_entries (file_path, entry_hash)")
+
+
+def timestamp_from_iso(value: str | None) -> int | None:
+    # Before migrate_integer_timestamps, timestamps were stored as ISO strings, in UTC
+    if value is None:
+        return None
+    return to_db_timestamp(datetime.fromisoformat(value).replace(tzinfo=timezone.utc))
+
+
+def migrate_integer_timestamps(cursor):
+    # Store timestamps as microseconds since the epoch instead of ISO strings.
+    # They are faster to compare and to convert.
+    clear_table(cursor, "found_files")
+
+    last_rowid = 0
+    while files := cursor.execute(
+        """
+        SELECT rowid, date_added, date_processed, file_mtime FROM timeline_files
+        WHERE rowid > ? ORDER BY rowid LIMIT 10000
+        """,
+        [last_rowid],
+    ).fetchall():
+        cursor.executemany(
+            "UPDATE timeline_files SET date_added = ?, date_processed = ?, file_mtime = ? WHERE rowid = ?",
+            [
+                (*[timestamp_from_iso(value) for value in timestamps], rowid)
+                for rowid, *timestamps in files
+            ],
+        )
+        last_rowid = files[-1][0]
+
+    last_entry_id = 0
+    while entries := cursor.execute(
+        """
+        SELECT entry_id, entry_type, date_start, date_end, entry_data FROM timeline_entries
+        WHERE entry_id > ? ORDER BY entry_id LIMIT 10000
+        """,
+        [last_entry_id],
+    ).fetchall():
+        updated_entries = []
+        for entry_id, entry_type, date_start, date_end, entry_data in entries:
+            date_start = timestamp_from_iso(date_start)
+            date_end = timestamp_from_iso(date_end)
+            entry_hash = get_entry_hash(entry_type, date_start, date_end, entry_data)
+            updated_entries.append((date_start, date_end, entry_hash, entry_id))
+        cursor.executemany(
+            "UPDATE timeline_entries SET date_start = ?, date_end = ?, entry_hash = ? WHERE entry_id = ?",
+            updated_entries,
+        )
+        last_entry_id = entries[-1][0]
+
+
+def migrate_persistent_dates_with_changes(cursor):
+    # All days where a timeline entry was created or updated since the entry
+    # lists were last generated. It's committed with the entries, so that the
+    # changes of an interrupted run are not lost. It used to be a temporary table.
+    cursor.execute("""
+        CREATE TABLE dates_with_changes (
+            day TEXT PRIMARY KEY NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def migrate_change_journal(cursor):
+    # Days changed again after the entry lists were generated get a higher
+    # change_id, so they are not removed from dates_with_changes by mistake.
+    cursor.execute("ALTER TABLE dates_with_changes ADD COLUMN change_id INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX dates_with_changes_change_id ON dates_with_changes (change_id)")
+
+
+def migrate_runs(cursor):
+    # The run report of each run, to compare runs over time
+    cursor.execute("""
+        CREATE TABLE runs (
+            run_id INTEGER PRIMARY KEY,
+            date_started TIMESTAMP NOT NULL,
+            report TEXT NOT NULL
+        )
+    """)
+
+
+def migrate_processor_versions(cursor):
+    # The versions of the file processors that created each file's entries, as
+    # a {processor_name: version} JSON object. It's NULL for files processed
+    # before processor versions were saved.
+    cursor.execute("ALTER TABLE timeline_files ADD COLUMN processor_versions TEXT")
+
+    # The processor versions of the last run, to find the processors that changed
+    cursor.execute("""
+        CREATE TABLE processor_versions (
+            processor_name TEXT PRIMARY KEY NOT NULL,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def migrate_file_failures(cursor):
+    # Files that could not be processed. They are processed again after
+    # date_retry, or when their checksum changes.
+    cursor.execute("""
+        CREATE TABLE file_failures (
+            file_path TEXT PRIMARY KEY NOT NULL REFERENCES timeline_files (file_path) ON DELETE CASCADE,
+            checksum TEXT,
+            error TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            date_failed TIMESTAMP NOT NULL,
+            date_retry TIMESTAMP NOT NULL
+        )
+    """)
+
+
+def migrate_staged_entries(cursor):
+    # The hashes of a file's new entries, to find its obsolete entries. It's
+    # in the database file instead of the temp store, which is in memory, so
+    # that large files don't use more memory. It's empty between transactions.
+    cursor.execute("""
+        CREATE TABLE staged_entries (
+            entry_hash BLOB PRIMARY KEY NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+# Each migration upgrades the database schema to the next version. The schema
+# version is stored in PRAGMA user_version. Only add new migrations at the end.
+migrations = [
+    migrate_initial_schema,
+    migrate_timeline_entries_primary_key,
+    migrate_entry_days,
+    migrate_entry_hash,
+    migrate_integer_timestamps,
+    migrate_persistent_dates_with_changes,
+    migrate_change_journal,
+    migrate_runs,
+    migrate_processor_versions,
+    migrate_file_failures,
+    migrate_staged_entries,
+]
+
+
+def get_schema_version(cursor) -> int:
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_database(cursor):
+    """
+    Apply the migrations that were not applied yet. Each migration is applied
+    in its own transaction.
+    """
+    schema_version = get_schema_version(cursor)
+    if schema_version > len(migrations):
+        raise ValueError(
+            f"The database schema (version {schema_version}) is newer than this version of timeline"
+        )
+
+    for version, migration in enumerate(migrations[schema_version:], start=schema_version + 1):
+        cursor.execute("SAVEPOINT migration")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            cursor.execute("ROLLBACK TO migration")
+            cursor.execute("RELEASE migration")
+            raise
+        cursor.execute("RELEASE migration")
+
+
+def create_database(cursor):
+    migrate_database(cursor)
+
+
+def get_directory_cache(cursor) -> dict:
+    """
+    Returns the directory listings saved by save_directory_cache, in the format used by walk_files.
+    """
+    cursor.execute(
+        "SELECT directory_path, directory_mtime, subdirectories, files FROM scanned_directories"
+    )
+    directory_cache = {}
+    for directory_path, directory_mtime, subdirectories, files in cursor.fetchall():
+        files = [tuple(f) for f in json.loads(files)]
+        # Older listings don't have the device and inode. Those directories are listed again.
+        if all(len(f) == 5 for f in files):
+            directory_cache[directory_path] = (directory_mtime, json.loads(subdirectories), files)
+    return directory_cache
+
+
+def save_directory_cache(cursor, directory_cache: dict, saved_directory_cache: dict | None = None):
+    """
+    Replace the saved directory listings with the ones from the last walk_files call.
+
+    If saved_directory_cache is set, it's the cache returned by get_directory_cache before the walk. Only the
+    directories whose listing changed are written, and the directories that were not visited are deleted.
+    """
+    if saved_directory_cache is None:
+        clear_table(cursor, "scanned_directories")
+        saved_directory_cache = {}
+    else:
+        cursor.executemany(
+            "DELETE FROM scanned_directories WHERE directory_path = ?",
+            [[directory_path] for directory_path in saved_directory_cache.keys() - directory_cache.keys()],
+        )
+    cursor.executemany(
+        """
+        INSERT OR REPLACE INTO scanned_directories (directory_path, directory_mtime, subdirectories, files)
+        VALUES (?, ?, ?, ?)
+        """,
+        [
+            (directory_path, directory_mtime, json.dumps(subdirectories), json.dumps(files))
+            for directory_path, (directory_mtime, subdirectories, files) in directory_cache.items()
+            if saved_directory_cache.get(directory_path) != (directory_mtime, subdirectories, files)
+        ],
+    )
 
 
 def add_found_files(cursor, files: Iterable[TimelineFile]):
@@ -117,17 +538,21 @@ def add_found_files(cursor, files: Iterable[TimelineFile]):
             checksum,
             date_added,
             file_mtime,
-            size
+            size,
+            device,
+            inode
         )
-        VALUES (?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
         [
             (
                 str(file.file_path),
                 file.checksum,
-                to_db_datetime(file.date_added),
-                to_db_datetime(file.file_mtime),
+                to_db_timestamp(file.date_added),
+                to_db_timestamp(file.file_mtime),
                 file.size,
+                to_db_integer(file.device),
+                to_db_integer(file.inode),
             )
             for file in files
         ],
@@ -139,12 +564,15 @@ def apply_cached_checksums_to_found_files(cursor):
     Copy the checksums from the timeline_files table to the found_files table.
     It avoids recalculating the checksum for files that have not changed since
     the last pass.
+
+    Files that were moved or renamed keep their device and inode. They get the
+    checksum of the file with the same inode, size and mtime.
     """
     cursor.execute("""
         UPDATE found_files
-        SET checksum = timeline.checksum
+        SET checksum = timeline.checksum, full_checksum = timeline.full_checksum
         FROM (
-            SELECT checksum, file_path, size, file_mtime
+            SELECT checksum, full_checksum, file_path, size, file_mtime
             FROM timeline_files
         ) AS timeline
         WHERE
@@ -154,73 +582,308 @@ def apply_cached_checksums_to_found_files(cursor):
             AND found_files.size=timeline.size
             AND found_files.file_mtime=timeline.file_mtime
     """)
+    cursor.execute("""
+        UPDATE found_files
+        SET checksum = timeline.checksum, full_checksum = timeline.full_checksum
+        FROM (
+            SELECT checksum, full_checksum, device, inode, size, file_mtime
+            FROM timeline_files
+        ) AS timeline
+        WHERE
+            found_files.checksum IS NULL
+            AND timeline.checksum IS NOT NULL
+            AND found_files.device=timeline.device
+            AND found_files.inode=timeline.inode
+            AND found_files.size=timeline.size
+            AND found_files.file_mtime=timeline.file_mtime
+    """)
 
 
-def fill_missing_found_file_checksums(cursor):
+def hash_file(
+    file_path: Path,
+    size: int,
+    previous_checksum: str | None = None,
+    tree_hash: bool = False,
+    fingerprint_min_size: int | None = None,
+) -> tuple[str, str | None]:
+    """
+    Returns the checksum and the full checksum of a file. Files larger than
+    fingerprint_min_size get a fingerprint instead, and no full checksum.
+
+    If the file had a previous_checksum, it is hashed the same way as before,
+    so that its checksum stays the same if the file content did not change.
+    """
+    if previous_checksum:
+        use_fingerprint = previous_checksum.startswith(FINGERPRINT_PREFIX)
+        tree_hash = previous_checksum.startswith(TREE_CHECKSUM_PREFIX)
+    else:
+        use_fingerprint = fingerprint_min_size is not None and size >= fingerprint_min_size
+
+    if use_fingerprint:
+        return get_fingerprint(file_path, size), None
+
+    checksum = get_checksum(file_path, tree_hash)
+    return checksum, checksum
+
+
+def fill_missing_found_file_checksums(
+    cursor,
+    hash_workers: int = 4,
+    batch_size: int = 1000,
+    tree_hash: bool = False,
+    fingerprint_min_size: int | None = None,
+) -> tuple[int, int]:
     """
     Calculate the checksum for all files in the found_files table that don't
-    have a checksum.
+    have a checksum. Returns the number of files hashed and the number of bytes
+    read.
+
+    The checksums are calculated by a pool of hash_workers threads, and saved
+    in batches of batch_size as they are calculated. At most batch_size files
+    are read from the database and submitted to the pool at a time.
+
+    Files that can't be read are removed from found_files. They are found
+    again on the next scan.
+
+    Large files are hashed with tree hashing if tree_hash is True. Files larger
+    than fingerprint_min_size get a fingerprint instead of a checksum. Their
+    full checksum is calculated later by fill_missing_full_checksums.
     """
-    cursor.execute("""
-        SELECT file_path FROM found_files WHERE checksum IS NULL
-    """)
+    def iter_files_to_hash():
+        # The files are read in pages, so that they are never all in memory
+        last_file_path = ""
+        while True:
+            cursor.execute(
+                """
+                SELECT found_files.file_path, found_files.size, timeline_files.checksum
+                FROM found_files
+                LEFT JOIN timeline_files ON found_files.file_path = timeline_files.file_path
+                WHERE found_files.checksum IS NULL AND found_files.file_path > ?
+                ORDER BY found_files.file_path
+                LIMIT ?
+                """,
+                [last_file_path, batch_size],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_file_path = rows[-1][0]
+
+    def save_checksums(checksums):
+        cursor.executemany(
+            """
+            UPDATE found_files
+            SET checksum = :checksum, full_checksum = :full_checksum
+            WHERE file_path = :file_path
+            """,
+            checksums,
+        )
 
-    cursor.executemany(
-        """
-        UPDATE found_files
-        SET checksum = :checksum
-        WHERE file_path = :file_path
-        """,
-        [
+    checksums = []
+    file_count = 0
+    bytes_read = 0
+
+    def add_checksum(future):
+        nonlocal checksums, file_count, bytes_read
+        file_path, size = futures.pop(future)
+        try:
+            checksum, full_checksum = future.result()
+        except OSError:  # The file was removed or can't be read since it was found
+            cursor.execute("DELETE FROM found_files WHERE file_path = ?", [file_path])
+            file_count -= 1
+            return
+        checksums.append(
             {
-                "checksum": get_checksum(Path(row[0])),
-                "file_path": row[0],
+                "checksum": checksum,
+                "full_checksum": full_checksum,
+                "file_path": file_path,
             }
-            for row in cursor.fetchall()
-        ],
+        )
+        # Fingerprints only read a few blocks
+        bytes_read += size if full_checksum else min(size, 3 * FINGERPRINT_BLOCK_SIZE)
+        if len(checksums) >= batch_size:
+            save_checksums(checksums)
+            checksums = []
+
+    # At most batch_size files are submitted at a time
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(hash_workers, 1)) as executor:
+        for file_path, size, previous_checksum in iter_files_to_hash():
+            if len(futures) >= batch_size:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    add_checksum(future)
+            future = executor.submit(
+                hash_file,
+                Path(file_path),
+                size,
+                previous_checksum,
+                tree_hash,
+                fingerprint_min_size,
+            )
+            futures[future] = (file_path, size)
+            file_count += 1
+        for future in as_completed(list(futures)):
+            add_checksum(future)
+    save_checksums(checksums)
+    return file_count, bytes_read
+
+
+def fill_missing_full_checksums(
+    cursor, hash_workers: int = 4, batch_size: int = 100, tree_hash: bool = False
+) -> int:
+    """
+    Calculate the full checksum of the files that were identified by a
+    fingerprint. Returns the number of files that were hashed.
+    """
+    cursor.execute(
+        """
+        SELECT file_path FROM timeline_files
+        WHERE full_checksum IS NULL AND substr(checksum, 1, 1) = ?
+        """,
+        [FINGERPRINT_PREFIX],
     )
+    file_paths = [row[0] for row in cursor.fetchall()]
 
+    def save_full_checksums(full_checksums):
+        cursor.executemany(
+            """
+            UPDATE timeline_files
+            SET full_checksum = :full_checksum
+            WHERE file_path = :file_path
+            """,
+            full_checksums,
+        )
 
-def commit_found_files(cursor):
+    full_checksums = []
+    with ThreadPoolExecutor(max_workers=max(hash_workers, 1)) as executor:
+        futures = {
+            executor.submit(get_checksum, Path(file_path), tree_hash): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
+            try:
+                full_checksum = future.result()
+            except OSError:  # The file was removed since the last scan
+                continue
+            full_checksums.append(
+                {"full_checksum": full_checksum, "file_path": futures[future]}
+            )
+            if len(full_checksums) >= batch_size:
+                save_full_checksums(full_checksums)
+                full_checksums = []
+    save_full_checksums(full_checksums)
+    return len(file_paths)
+
+
+def commit_found_files(cursor, scope: Iterable[Path] | None = None):
     """
     Sync the found_files and timeline_files tables.
 
-    Delete entries related to missing files.
+    Delete entries related to missing files. If scope is set, only the files
+    in the scope paths can be missing. The other files are left untouched.
 
-    Update dates_with_changes with the dates of the deleted entries.
-    """
+    If a missing file was moved or renamed, its entries are moved to the new
+    path instead, and the file is not processed again. A missing file was moved
+    if a new file has the same checksum and the same file name.
+
+    Duplicates of deleted or modified files are processed again.
 
+    Update dates_with_changes with the dates of the deleted or moved entries.
+    """
     cursor.executescript("""
+        CREATE TEMP TABLE IF NOT EXISTS scanned_paths (
+            path TEXT PRIMARY KEY NOT NULL
+        );
+        DELETE FROM scanned_paths;
+    """)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO scanned_paths (path) VALUES (?)",
+        [[str(path)] for path in scope or []],
+    )
+
+    scope_filter = ""
+    if scope is not None:
+        scope_filter = """
+            AND EXISTS (
+                SELECT 1 FROM scanned_paths
+                WHERE timeline_files.file_path = path
+                OR substr(timeline_files.file_path, 1, length(path) + 1) = path || '/'
+            )
+        """
+
+    cursor.executescript(f"""
         DROP VIEW IF EXISTS deleted_timeline_files;
-        CREATE VIEW deleted_timeline_files AS
+        CREATE TEMP VIEW deleted_timeline_files AS
             SELECT file_path FROM timeline_files
             WHERE file_path NOT IN (SELECT file_path FROM found_files)
+            {scope_filter}
     """)
 
-    deleted_timeline_entries = cursor.execute("""
-        SELECT date_start, date_end FROM timeline_entries WHERE file_path IN deleted_timeline_files
-    """).fetchall()
+    # Mark the dates with deleted entries as modified. Deleted duplicates also
+    # change the timeline if duplicates are shown once per path.
+    add_changed_days(cursor, """
+        SELECT DISTINCT day FROM entry_days
+        INNER JOIN timeline_entries ON entry_days.entry_id = timeline_entries.entry_id
+        WHERE
+            file_path IN deleted_timeline_files
+            OR file_path IN (
+                SELECT duplicate_of FROM timeline_files
+                WHERE file_path IN deleted_timeline_files
+            )
+    """)
 
-    dates_with_deleted_entries = set()
-    for date_start, date_end in deleted_timeline_entries:
-        date_start = datetime_from_db(date_start)
-        date_end = datetime_from_db(date_end) if date_end else date_start
-        for day in days_in_range(date_start, date_end):
-            dates_with_deleted_entries.add(day)
+    # Move the entries of moved files to their new path
+    moved_files = cursor.execute("""
+        SELECT found_files.file_path, timeline_files.file_path
+        FROM found_files
+        INNER JOIN timeline_files ON found_files.checksum = timeline_files.checksum
+        WHERE
+            timeline_files.date_processed IS NOT NULL
+            AND timeline_files.file_path IN deleted_timeline_files
+            AND found_files.file_path NOT IN (SELECT file_path FROM timeline_files)
+    """).fetchall()
+    moved_from_paths = set()
+    moved_to_paths = set()
+    for new_path, old_path in moved_files:
+        if (
+            new_path in moved_to_paths
+            or old_path in moved_from_paths
+            or Path(new_path).name != Path(old_path).name
+        ):
+            continue
+        moved_to_paths.add(new_path)
+        moved_from_paths.add(old_path)
 
-    # Mark the dates with deleted entries as modified
-    cursor.executemany(
-        """
-        INSERT INTO dates_with_changes (timeline_date) VALUES (?)
-        ON CONFLICT DO NOTHING;
-        """,
-        [
-            [
-                to_db_datetime(datetime.combine(d, datetime.min.time())),
-            ]
-            for d in dates_with_deleted_entries
-        ],
-    )
+        cursor.execute(
+            """
+            INSERT INTO timeline_files (file_path, checksum, full_checksum, date_added, file_mtime, size, device, inode, date_processed, duplicate_of, processor_versions)
+            SELECT
+                found_files.file_path,
+                found_files.checksum,
+                coalesce(found_files.full_checksum, timeline_files.full_checksum),
+                found_files.date_added,
+                found_files.file_mtime,
+                found_files.size,
+                found_files.device,
+                found_files.inode,
+                timeline_files.date_processed,
+                timeline_files.duplicate_of,
+                timeline_files.processor_versions
+            FROM found_files, timeline_files
+            WHERE found_files.file_path = ? AND timeline_files.file_path = ?
+            """,
+            [new_path, old_path],
+        )
+        cursor.execute(
+            "UPDATE timeline_entries SET file_path = ? WHERE file_path = ?",
+            [new_path, old_path],
+        )
+        cursor.execute(
+            "UPDATE timeline_files SET duplicate_of = ? WHERE duplicate_of = ?",
+            [new_path, old_path],
+        )
 
     # Delete timeline_files that are not in found_files
     cursor.executescript("""
@@ -231,41 +894,171 @@ def commit_found_files(cursor):
     # Insert found_files into timeline_files, update existing timeline_files.
     # New/changed files have their date_processed set to NULL.
     cursor.execute("""
-        INSERT INTO timeline_files (file_path, checksum, date_added, file_mtime, size, date_processed)
-        SELECT file_path, checksum, date_added, file_mtime, size, NULL FROM found_files WHERE true
+        INSERT INTO timeline_files (file_path, checksum, full_checksum, date_added, file_mtime, size, device, inode, date_processed)
+        SELECT file_path, checksum, full_checksum, date_added, file_mtime, size, device, inode, NULL FROM found_files WHERE true
         ON CONFLICT (file_path) DO UPDATE
             SET
                 checksum = excluded.checksum,
+                full_checksum = excluded.full_checksum,
                 date_added = excluded.date_added,
                 file_mtime = excluded.file_mtime,
                 size = excluded.size,
+                device = excluded.device,
+                inode = excluded.inode,
                 date_processed = CASE
                     WHEN timeline_files.checksum != excluded.checksum THEN NULL
                     ELSE timeline_files.date_processed
                 END
+            -- Unchanged files are not written again
+            WHERE
+                timeline_files.checksum IS NOT excluded.checksum
+                OR timeline_files.full_checksum IS NOT excluded.full_checksum
+                OR timeline_files.file_mtime IS NOT excluded.file_mtime
+                OR timeline_files.size IS NOT excluded.size
+                OR timeline_files.device IS NOT excluded.device
+                OR timeline_files.inode IS NOT excluded.inode
+    """)
+
+    # Duplicates of files that were deleted or modified are no longer duplicates
+    cursor.execute("""
+        UPDATE timeline_files
+        SET date_processed = NULL, duplicate_of = NULL
+        WHERE
+            duplicate_of IS NOT NULL
+            AND checksum IS NOT (
+                SELECT original.checksum FROM timeline_files AS original
+                WHERE original.file_path = timeline_files.duplicate_of
+            )
     """)
 
     clear_table(cursor, "found_files")
 
 
-def update_file_database(cursor, timeline_files: Iterable[TimelineFile]):
+def update_file_database(
+    cursor,
+    timeline_files: Iterable[TimelineFile],
+    scope: Iterable[Path] | None = None,
+    hash_workers: int = 4,
+    tree_hash: bool = False,
+    fingerprint_min_size: int | None = None,
+    run_stats: RunStats | None = None,
+):
     """
     Syncs the list of files in the database with the actual list of files on the
     filesystem. The result is an up-to-date timeline_files table.
+
+    If scope is set, only the files in those paths are synced. If run_stats is
+    set, the scan, hash and sync phases are measured.
     """
-    clear_table(cursor, "found_files")
-    add_found_files(cursor, timeline_files)
-    apply_cached_checksums_to_found_files(cursor)
-    fill_missing_found_file_checksums(cursor)
-    commit_found_files(cursor)
+    run_stats = run_stats or RunStats()
+    with run_stats.measure("scan") as measurement:
+        clear_table(cursor, "found_files")
+        add_found_files(cursor, timeline_files)
+        apply_cached_checksums_to_found_files(cursor)
+        measurement.files += cursor.execute("SELECT count(*) FROM found_files").fetchone()[0]
+
+    with run_stats.measure("hash") as measurement:
+        file_count, bytes_read = fill_missing_found_file_checksums(
+            cursor,
+            hash_workers,
+            tree_hash=tree_hash,
+            fingerprint_min_size=fingerprint_min_size,
+        )
+        measurement.files += file_count
+        measurement.bytes_read += bytes_read
+
+    with run_stats.measure("sync_file_list"):
+        commit_found_files(cursor, scope)
+
+
+def add_run(cursor, run_stats: RunStats):
+    cursor.execute(
+        "INSERT INTO runs (date_started, report) VALUES (?, ?)",
+        [to_db_timestamp(run_stats.date_started), json.dumps(run_stats.to_json_dict())],
+    )
+
+
+def get_run_reports(cursor, limit: int = 20) -> list[dict]:
+    """
+    Returns the reports of the last runs, oldest first.
+    """
+    rows = cursor.execute(
+        "SELECT report FROM runs ORDER BY run_id DESC LIMIT ?", [limit]
+    ).fetchall()
+    return [json.loads(row[0]) for row in reversed(rows)]
+
+
+@dataclass
+class FileFailure:
+    file_path: Path
+    error: str
+    attempts: int
+    date_failed: datetime
+    date_retry: datetime
+
+
+def add_file_failure(
+    cursor,
+    file_path: Path,
+    checksum: str | None,
+    error: str,
+    retry_delay: timedelta = timedelta(hours=1),
+    max_retry_delay: timedelta = timedelta(days=7),
+):
+    """
+    Record that a file could not be processed. It's retried after retry_delay.
+    The delay doubles after each failed attempt, up to max_retry_delay.
+    """
+    previous_attempts = cursor.execute(
+        "SELECT attempts FROM file_failures WHERE file_path = ? AND checksum IS ?",
+        [str(file_path), checksum],
+    ).fetchone()
+    attempts = previous_attempts[0] + 1 if previous_attempts else 1
+    date_failed = datetime.now().astimezone()
+    date_retry = date_failed + min(retry_delay * 2 ** (attempts - 1), max_retry_delay)
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO file_failures (file_path, checksum, error, attempts, date_failed, date_retry)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [str(file_path), checksum, error, attempts, to_db_timestamp(date_failed), to_db_timestamp(date_retry)],
+    )
+
+
+def clear_file_failure(cursor, file_path: Path):
+    cursor.execute("DELETE FROM file_failures WHERE file_path = ?", [str(file_path)])
+
+
+def get_file_failures(cursor) -> list[FileFailure]:
+    """
+    Returns the files that could not be processed, the most recent failures first.
+    """
+    rows = cursor.execute("""
+        SELECT file_path, error, attempts, date_failed, date_retry FROM file_failures
+        ORDER BY date_failed DESC
+    """).fetchall()
+    return [
+        FileFailure(
+            file_path=Path(row[0]),
+            error=row[1],
+            attempts=row[2],
+            date_failed=datetime_from_db(row[3]),
+            date_retry=datetime_from_db(row[4]),
+        )
+        for row in rows
+    ]
 
 
-def get_unprocessed_timeline_files(cursor) -> Iterable[TimelineFile]:
+def get_unprocessed_timeline_files(cursor, now: datetime | None = None) -> Iterable[TimelineFile]:
     """
     Returns a list of unprocessed files. These are files for which entries,
     thumbnails, previews and other metadata was not yet generated.
+
+    Files that failed are not returned until their retry date, unless their
+    checksum changed.
     """
-    cursor.execute("""
+    cursor.execute(
+        """
         SELECT
             file_path,
             checksum,
@@ -273,8 +1066,19 @@ def get_unprocessed_timeline_files(cursor) -> Iterable[TimelineFile]:
             file_mtime,
             size,
             date_processed
-        FROM timeline_files WHERE date_processed IS NULL
-    """)
+        FROM timeline_files
+        WHERE
+            date_processed IS NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM file_failures
+                WHERE
+                    file_failures.file_path = timeline_files.file_path
+                    AND file_failures.checksum IS timeline_files.checksum
+                    AND file_failures.date_retry > ?
+            )
+        """,
+        [to_db_timestamp(now or datetime.now())],
+    )
     for row in cursor.fetchall():
         yield TimelineFile(
             file_path=Path(row[0]),
@@ -285,142 +1089,360 @@ def get_unprocessed_timeline_files(cursor) -> Iterable[TimelineFile]:
         )
 
 
-def add_timeline_entries(cursor, entries: Iterable[TimelineEntry]):
+def add_entry_days(cursor, entries: Iterable[tuple[int, int, int | None]]) -> set[str]:
+    """
+    Fill entry_days for the given (entry_id, date_start, date_end) tuples.
+    Returns the days covered by those entries.
+    """
+    entry_days = [
+        (day, entry_id)
+        for entry_id, date_start, date_end in entries
+        for day in get_entry_days(date_start, date_end)
+    ]
     cursor.executemany(
-        """
-        INSERT INTO timeline_entries (
-            file_path,
+        "INSERT OR IGNORE INTO entry_days (day, entry_id) VALUES (?, ?)", entry_days
+    )
+    return {day for day, entry_id in entry_days}
+
+
+def add_changed_days(cursor, days_query: str, parameters: dict | list = ()):
+    """
+    Add the days returned by days_query to dates_with_changes. They get a
+    higher change_id than the days already in dates_with_changes.
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO dates_with_changes (day, change_id)
+        SELECT day, (SELECT coalesce(max(change_id), 0) + 1 FROM dates_with_changes)
+        FROM ({days_query}) WHERE true
+        ON CONFLICT (day) DO UPDATE SET change_id = excluded.change_id
+        """,
+        parameters,
+    )
+
+
+def mark_days_as_changed(cursor, days: Iterable[str]):
+    add_changed_days(
+        cursor, "SELECT value AS day FROM json_each(?)", [json.dumps(list(days))]
+    )
+
+
+def get_entry_hash(
+    entry_type: str, date_start: int, date_end: int | None, entry_data: str
+) -> bytes:
+    """
+    Returns a hash of an entry's content, in the database format. Entries with
+    the same hash are identical.
+    """
+    content = f"{entry_type}\0{date_start}\0{'' if date_end is None else date_end}\0{entry_data}"
+    return blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+def get_entry_rows(entries: Iterable[TimelineEntry], file_path: Path | None = None) -> dict[bytes, tuple]:
+    """
+    Returns the entries as timeline_entries rows, by entry hash. Identical
+    entries are only returned once. If file_path is set, the rows are for that
+    file.
+    """
+    entry_rows = {}
+    for entry in entries:
+        entry_type = entry.entry_type.value
+        date_start = to_db_timestamp(entry.date_start)
+        date_end = to_db_timestamp(entry.date_end) if entry.date_end else None
+        entry_data = json.dumps(entry.data)
+        entry_hash = get_entry_hash(entry_type, date_start, date_end, entry_data)
+        entry_rows[entry_hash] = (
+            str(file_path or entry.file_path),
+            entry_hash,
             entry_type,
             date_start,
             date_end,
-            entry_data
+            entry_data,
         )
-        VALUES (?, ?, ?, ?, ?)
+    return entry_rows
+
+
+def add_days_of_new_entries(cursor, last_entry_id: int, batch_size: int = 10000) -> set[str]:
+    """
+    Fill entry_days for the entries with an entry_id larger than last_entry_id,
+    in batches. Returns the days covered by those entries.
+    """
+    days = set()
+    while entries := cursor.execute(
+        """
+        SELECT entry_id, date_start, date_end FROM timeline_entries
+        WHERE entry_id > ? ORDER BY entry_id LIMIT ?
         """,
-        [
-            (
-                str(entry.file_path),
-                entry.entry_type.value,
-                to_db_datetime(entry.date_start),
-                to_db_datetime(entry.date_end) if entry.date_end else None,
-                json.dumps(entry.data),
-            )
-            for entry in entries
-        ],
-    )
+        [last_entry_id, batch_size],
+    ).fetchall():
+        days.update(add_entry_days(cursor, entries))
+        last_entry_id = entries[-1][0]
+    return days
 
 
-def update_timeline_entries_for_file(
-    cursor, timeline_file: Path, new_entries: Iterable[TimelineEntry]
-) -> None:
+def get_last_entry_id(cursor) -> int:
+    # New rows get a larger entry_id than all existing rows
+    return cursor.execute("SELECT coalesce(max(entry_id), 0) FROM timeline_entries").fetchone()[0]
+
+
+def insert_timeline_entries(cursor, entry_rows: Iterable[tuple]) -> set[str]:
     """
-    Update a file's entries in the timeline. Create/update entries that changed and delete obsolete ones.
+    Insert rows from get_entry_rows. Returns the days covered by the new entries.
     """
-    cursor.execute(
-        "SELECT entry_type, date_start, date_end, entry_data FROM timeline_entries WHERE file_path=?",
-        [str(timeline_file)],
+    last_entry_id = get_last_entry_id(cursor)
+    cursor.executemany(
+        """
+        INSERT INTO timeline_entries (file_path, entry_hash, entry_type, date_start, date_end, entry_data)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        entry_rows,
     )
-    previous_entries = {row for row in cursor.fetchall()}
+    return add_days_of_new_entries(cursor, last_entry_id)
 
-    current_entries = {
-        (
-            entry.entry_type.value,
-            to_db_datetime(entry.date_start),
-            to_db_datetime(entry.date_end) if entry.date_end else None,
-            json.dumps(entry.data),
-        )
-        for entry in new_entries
-    }
 
-    entries_to_remove = previous_entries - current_entries
-    entries_to_add = current_entries - previous_entries
+def add_timeline_entries(cursor, entries: Iterable[TimelineEntry]):
+    insert_timeline_entries(cursor, get_entry_rows(entries).values())
 
-    dates_with_changes: set[date] = set()
 
-    # Delete obsolete entries
-    for entry_type, date_start, date_end, entry_data in entries_to_remove:
-        cursor.execute(
-            """
-            DELETE FROM timeline_entries
-            WHERE file_path=? AND entry_type=? AND date_start=? AND entry_data=?
-            """,
-            [str(timeline_file), entry_type, date_start, entry_data],
-        )
-        entry_start = datetime_from_db(date_start)
-        entry_end = datetime_from_db(date_end) if date_end else entry_start
-        dates_with_changes.update(days_in_range(entry_start, entry_end))
+def update_timeline_entries_for_file(
+    cursor, timeline_file: Path, new_entries: Iterable[TimelineEntry], batch_size: int = 10000
+) -> int:
+    """
+    Update a file's entries in the timeline. Create/update entries that changed and delete obsolete ones. Returns the
+    number of entries in new_entries.
 
-    # Add/update new entries
-    for entry_type, date_start, date_end, entry_data in entries_to_add:
-        cursor.execute(
+    The new entries are read in batches, so that new_entries can be a generator of any size. The entries that don't
+    exist yet are inserted, and their hashes are staged. Afterwards, the file's entries that were not staged are
+    deleted.
+    """
+    file_path = str(timeline_file)
+    last_entry_id = get_last_entry_id(cursor)
+    entry_count = 0
+    clear_table(cursor, "staged_entries")
+
+    new_entries = iter(new_entries)
+    while batch := list(islice(new_entries, batch_size)):
+        entry_count += len(batch)
+        entry_rows = get_entry_rows(batch, timeline_file)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO staged_entries (entry_hash) VALUES (?)",
+            [[entry_hash] for entry_hash in sorted(entry_rows.keys())],  # Sorted inserts are faster
+        )
+        # Add the entries that don't exist yet
+        cursor.executemany(
             """
-            INSERT INTO timeline_entries (file_path, entry_type, date_start, date_end, entry_data)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO timeline_entries (file_path, entry_hash, entry_type, date_start, date_end, entry_data)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6
+            WHERE NOT EXISTS (SELECT 1 FROM timeline_entries WHERE file_path = ?1 AND entry_hash = ?2)
             """,
-            [str(timeline_file), entry_type, date_start, date_end, entry_data],
+            entry_rows.values(),
         )
-        entry_start = datetime_from_db(date_start)
-        entry_end = datetime_from_db(date_end) if date_end else entry_start
-        dates_with_changes.update(days_in_range(entry_start, entry_end))
 
-    # Log all dates that have entry changes
-    cursor.executemany(
-        "INSERT OR IGNORE INTO dates_with_changes (timeline_date) VALUES (?)",
-        [[to_db_datetime(d)] for d in dates_with_changes],
+    # Log the dates of the new entries
+    mark_days_as_changed(cursor, add_days_of_new_entries(cursor, last_entry_id))
+
+    # Delete obsolete entries, and log the dates where they were
+    obsolete_entries = """
+        SELECT entry_id FROM timeline_entries
+        WHERE file_path = :file_path AND entry_hash NOT IN staged_entries
+    """
+    add_changed_days(
+        cursor,
+        f"SELECT DISTINCT day FROM entry_days WHERE entry_id IN ({obsolete_entries})",
+        {"file_path": file_path},
     )
+    cursor.execute(
+        f"DELETE FROM timeline_entries WHERE entry_id IN ({obsolete_entries})",
+        {"file_path": file_path},
+    )
+    clear_table(cursor, "staged_entries")
+    return entry_count
 
 
-def dates_with_changes(cursor) -> dict[date, datetime]:
+def get_original_file(cursor, timeline_file: TimelineFile) -> Path | None:
     """
-    Returns a tuple with two values:
-        1. days_to_update (dict):
-            Keys: dates where entries changed this run.
-            Value: timestamp of the change.
-        2. days_to_delete (set):
-            Dates that have no entries left, because they were all deleted.
+    Returns the path of a processed file with the same checksum, if there is
+    one. Files that are duplicates themselves are not returned.
+    """
+    cursor.execute(
+        """
+        SELECT file_path FROM timeline_files
+        WHERE
+            checksum = ?
+            AND file_path != ?
+            AND date_processed IS NOT NULL
+            AND duplicate_of IS NULL
+        LIMIT 1
+        """,
+        [timeline_file.checksum, str(timeline_file.file_path)],
+    )
+    row = cursor.fetchone()
+    return Path(row[0]) if row else None
+
+
+def mark_timeline_file_as_duplicate(cursor, file_path: Path, original_path: Path):
+    """
+    Mark a file as a processed duplicate of original_path. It has no entries of
+    its own. Its original's entries are used instead.
+    """
+    # The days of its old entries are generated again without them
+    add_changed_days(
+        cursor,
+        """
+        SELECT DISTINCT day FROM entry_days
+        INNER JOIN timeline_entries ON entry_days.entry_id = timeline_entries.entry_id
+        WHERE file_path=?
+        """,
+        [str(file_path)],
+    )
+    delete_timeline_entries(cursor, file_path)
+    cursor.execute(
+        "UPDATE timeline_files SET duplicate_of=?, date_processed=? WHERE file_path=?",
+        [str(original_path), to_db_timestamp(datetime.now()), str(file_path)],
+    )
+
+    # The duplicate appears on the same days as its original
+    add_changed_days(
+        cursor,
+        """
+        SELECT DISTINCT day FROM entry_days
+        INNER JOIN timeline_entries ON entry_days.entry_id = timeline_entries.entry_id
+        WHERE file_path=?
+        """,
+        [str(original_path)],
+    )
+
+
+def reset_duplicate_files(cursor):
+    """
+    Process duplicate files again, so that they get their own entries.
+    """
+    cursor.execute("""
+        UPDATE timeline_files SET date_processed = NULL, duplicate_of = NULL
+        WHERE duplicate_of IS NOT NULL
+    """)
+
+
+def get_change_watermark(cursor) -> int:
+    """
+    Returns the change_id of the latest change in dates_with_changes.
+    """
+    return cursor.execute(
+        "SELECT coalesce(max(change_id), 0) FROM dates_with_changes"
+    ).fetchone()[0]
+
+
+def dates_with_changes(cursor, watermark: int | None = None) -> dict[date, datetime]:
+    """
+    Returns the days where entries changed since the entry lists were generated,
+    with the timestamp of the change. Days where all entries were deleted are
+    included. If watermark is set, only the changes up to that change_id are
+    returned.
     """
     return {
-        datetime_from_db(row[0]).date(): datetime.now().astimezone()
+        date.fromisoformat(row[0]): datetime.now().astimezone()
         for row in cursor.execute(
-            "SELECT timeline_date FROM dates_with_changes"
+            "SELECT day FROM dates_with_changes WHERE change_id <= ? ORDER BY day",
+            [get_change_watermark(cursor) if watermark is None else watermark],
         ).fetchall()
     }
 
 
-def get_entries_for_date(cursor, timeline_date: date):
-    tz_aware_timeline_date = datetime(
-        timeline_date.year, timeline_date.month, timeline_date.day
-    ).astimezone()
+def clear_dates_with_changes(cursor, days: Iterable[date], watermark: int):
+    """
+    Remove days from dates_with_changes, unless they changed again after the
+    watermark.
+    """
+    cursor.executemany(
+        "DELETE FROM dates_with_changes WHERE day = ? AND change_id <= ?",
+        [(day.isoformat(), watermark) for day in days],
+    )
+
+
+class StoredTimelineEntry(TimelineEntry):
+    """
+    A TimelineEntry read from the database. Its dates are converted from
+    timestamps when they are first used.
+    """
+    timestamp_start: int
+    timestamp_end: int | None
+
+    @cached_property
+    def date_start(self) -> datetime:
+        return datetime_from_db(self.timestamp_start)
+
+    @cached_property
+    def date_end(self) -> datetime | None:
+        return datetime_from_db(self.timestamp_end) if self.timestamp_end else None
+
+
+def timeline_entry_from_row(row) -> TimelineEntry:
+    entry = StoredTimelineEntry.__new__(StoredTimelineEntry)
+    entry.file_path = Path(row[0])
+    entry.checksum = row[1]
+    entry.entry_type = EntryType(row[2])
+    entry.timestamp_start = row[3]
+    entry.timestamp_end = row[4]
+    entry.data = json.loads(row[5])
+    return entry
+
+
+def select_entries_by_day(days_table: str, duplicates_per_path: bool) -> str:
+    """
+    Returns a query for the entries on the days in days_table, ordered by day.
+    If duplicates_per_path is True, the entries of a file are also returned
+    once for each of its duplicates.
+    """
+    files_filter = "entries.file_path = files.file_path"
+    if duplicates_per_path:
+        files_filter += " OR entries.file_path = files.duplicate_of"
+
+    return f"""
+        SELECT
+            files.file_path,
+            files.checksum,
+            entry_type,
+            date_start,
+            date_end,
+            entry_data,
+            entry_days.day
+        FROM {days_table} days
+        CROSS JOIN entry_days ON entry_days.day = days.day  -- Look up the days first
+        INNER JOIN timeline_entries entries ON entries.entry_id = entry_days.entry_id
+        INNER JOIN timeline_files files ON {files_filter}
+        ORDER BY days.day
+    """
+
+
+def get_entries_for_date(
+    cursor, timeline_date: date, duplicates_per_path: bool = False
+):
+    """
+    Returns the entries on a given day. If duplicates_per_path is True, the
+    entries of a file are also returned once for each of its duplicates.
+    """
     cursor.execute(
-        """
-            SELECT
-                entries.file_path,
-                files.checksum,
-                entry_type,
-                date_start,
-                date_end,
-                entry_data
-            FROM timeline_entries entries
-            INNER JOIN timeline_files files
-                ON entries.file_path = files.file_path
-            WHERE
-                (date_start>=:start AND date_start<:end)
-                OR (date_start<:start AND date_end>=:start)
-        """,
-        {
-            "start": to_db_datetime(tz_aware_timeline_date),
-            "end": to_db_datetime(tz_aware_timeline_date + timedelta(days=1)),
-        },
+        select_entries_by_day("(SELECT :day AS day)", duplicates_per_path),
+        {"day": timeline_date.isoformat()},
     )
     for row in cursor.fetchall():
-        yield TimelineEntry(
-            file_path=Path(row[0]),
-            checksum=row[1],
-            entry_type=EntryType(row[2]),
-            date_start=datetime_from_db(row[3]),
-            date_end=datetime_from_db(row[4]) if row[4] else None,
-            data=json.loads(row[5]),
-        )
+        yield timeline_entry_from_row(row)
+
+
+def get_entries_for_dates(
+    cursor, days: Iterable[date], duplicates_per_path: bool = False
+) -> Iterable[tuple[date, list[TimelineEntry]]]:
+    """
+    Returns the entries on each of the given days, with a single query. Days
+    without entries are not returned. The rows are read one day at a time, so
+    the cursor can't be used until all days are read.
+    """
+    cursor.execute(
+        select_entries_by_day("(SELECT value AS day FROM json_each(?))", duplicates_per_path),
+        [json.dumps([day.isoformat() for day in days])],
+    )
+    for day, rows in groupby(cursor, key=lambda row: row[6]):
+        yield date.fromisoformat(day), [timeline_entry_from_row(row) for row in rows]
 
 
 def get_entries_by_type(cursor, entry_type: EntryType):
@@ -438,18 +1460,12 @@ def get_entries_by_type(cursor, entry_type: EntryType):
                 ON entries.file_path = files.file_path
             WHERE
                 entry_type=:type
+            ORDER BY date_start
         """,
         {"type": entry_type.value},
     )
     for row in cursor.fetchall():
-        yield TimelineEntry(
-            file_path=Path(row[0]),
-            checksum=row[1],
-            entry_type=EntryType(row[2]),
-            date_start=datetime_from_db(row[3]),
-            date_end=datetime_from_db(row[4]) if row[4] else None,
-            data=json.loads(row[5]),
-        )
+        yield timeline_entry_from_row(row)
 
 
 def delete_timeline_entries(cursor, file_path: Path):
@@ -461,11 +1477,80 @@ def delete_timeline_entries(cursor, file_path: Path):
     )
 
 
-def mark_timeline_file_as_processed(cursor, file_path: Path):
+def mark_timeline_file_as_processed(
+    cursor, file_path: Path, processor_versions: dict[str, int] | None = None
+):
+    """
+    processor_versions are the versions of the processors that created the
+    file's entries.
+    """
     cursor.execute(
-        "UPDATE timeline_files SET date_processed=? WHERE file_path=?",
+        "UPDATE timeline_files SET date_processed=?, processor_versions=? WHERE file_path=?",
         [
-            to_db_datetime(datetime.now()),
+            to_db_timestamp(datetime.now()),
+            json.dumps(processor_versions, sort_keys=True) if processor_versions is not None else None,
             str(file_path),
         ],
     )
+
+
+def get_processed_files(cursor) -> Iterable[tuple[Path, dict[str, int] | None]]:
+    """
+    Returns the path and the processor versions of each processed file,
+    except duplicates. The processor versions are None for files processed
+    before processor versions were saved.
+    """
+    cursor.execute("""
+        SELECT file_path, processor_versions FROM timeline_files
+        WHERE date_processed IS NOT NULL AND duplicate_of IS NULL
+    """)
+    for file_path, processor_versions in cursor.fetchall():
+        yield Path(file_path), json.loads(processor_versions) if processor_versions else None
+
+
+def save_file_processor_versions(cursor, file_versions: Iterable[tuple[Path, dict[str, int]]]):
+    """
+    Save the processor versions of processed files, without processing them
+    again.
+    """
+    cursor.executemany(
+        "UPDATE timeline_files SET processor_versions=? WHERE file_path=?",
+        (
+            (json.dumps(processor_versions, sort_keys=True), str(file_path))
+            for file_path, processor_versions in file_versions
+        ),
+    )
+
+
+def mark_files_as_unprocessed(cursor, file_paths: Iterable[Path]):
+    """
+    Process the files again. Their existing entries are updated, not replaced.
+    """
+    cursor.execute(
+        """
+        UPDATE timeline_files SET date_processed = NULL
+        WHERE file_path IN (SELECT value FROM json_each(?))
+        """,
+        [json.dumps([str(file_path) for file_path in file_paths])],
+    )
+
+
+def get_processor_versions(cursor) -> dict[str, int]:
+    """
+    Returns the processor versions saved with save_processor_versions.
+    """
+    return dict(cursor.execute("SELECT processor_name, version FROM processor_versions").fetchall())
+
+
+def save_processor_versions(cursor, processor_versions: dict[str, int]):
+    """
+    Save the versions of the current processors. Processors that are no longer
+    used keep their last version.
+    """
+    cursor.executemany(
+        """
+        INSERT INTO processor_versions (processor_name, version) VALUES (?, ?)
+        ON CONFLICT (processor_name) DO UPDATE SET version = excluded.version
+        """,
+        processor_versions.items(),
+    )
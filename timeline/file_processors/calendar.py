@@ -19,7 +19,10 @@ def normalize_date(date_obj: date | datetime):
     return date_obj.astimezone()
 
 
-def date_from_db(date: datetime, timezone_string: str):
+def date_from_db(timestamp: float, timezone_string: str):
+    # A naive datetime, in UTC
+    date = datetime.fromtimestamp(int(timestamp), timezone.utc).replace(tzinfo=None)
+
     if timezone_string == '_float':
         # Floating timezone
         local_tz = datetime.now().astimezone().tzinfo
@@ -51,8 +54,8 @@ def process_calendar_db(file: TimelineFile, metadata_root: Path):
             CalendarItem.ROWID,
             summary,
             description,
-            DATETIME(start_date + 978307200, 'unixepoch') as "[timestamp]",
-            DATETIME(end_date + 978307200, 'unixepoch') as "[timestamp]",
+            start_date + 978307200,
+            end_date + 978307200,
             Location.title,
             Participant.email,
             start_tz,
@@ -0,0 +1,126 @@
+"""
+The file extensions of the image and video processors. They are here so that the processors can be registered
+without importing them.
+"""
+
+# The extensions Pillow can open with pillow_heif, except ".psd". Update it when Pillow is updated.
+image_extensions = set(
+    [
+        ".apng",
+        ".avif",
+        ".avifs",
+        ".blp",
+        ".bmp",
+        ".bufr",
+        ".bw",
+        ".cur",
+        ".dcx",
+        ".dds",
+        ".dib",
+        ".emf",
+        ".eps",
+        ".fit",
+        ".fits",
+        ".flc",
+        ".fli",
+        ".ftc",
+        ".ftu",
+        ".gbr",
+        ".gif",
+        ".grib",
+        ".h5",
+        ".hdf",
+        ".heic",
+        ".heics",
+        ".heif",
+        ".heifs",
+        ".hif",
+        ".icb",
+        ".icns",
+        ".ico",
+        ".iim",
+        ".im",
+        ".j2c",
+        ".j2k",
+        ".jfif",
+        ".jp2",
+        ".jpc",
+        ".jpe",
+        ".jpeg",
+        ".jpf",
+        ".jpg",
+        ".jpx",
+        ".mpeg",
+        ".mpg",
+        ".msp",
+        ".pbm",
+        ".pcd",
+        ".pcx",
+        ".pfm",
+        ".pgm",
+        ".png",
+        ".pnm",
+        ".ppm",
+        ".ps",
+        ".pxr",
+        ".qoi",
+        ".ras",
+        ".rgb",
+        ".rgba",
+        ".sgi",
+        ".tga",
+        ".tif",
+        ".tiff",
+        ".vda",
+        ".vst",
+        ".webp",
+        ".wmf",
+        ".xbm",
+        ".xpm",
+    ]
+)
+
+
+video_extensions = set(
+    [
+        ".3g2",
+        ".3gp",
+        ".amv",
+        ".asf",
+        ".avi",
+        ".f4a",
+        ".f4b",
+        ".f4p",
+        ".f4v",
+        ".flv",
+        ".flv",
+        ".gifv",
+        ".hevc",
+        ".m4p",
+        ".m4v",
+        ".m4v",
+        ".mkv",
+        ".mng",
+        ".mod",
+        ".mov",
+        ".mp2",
+        ".mp4",
+        ".mpe",
+        ".mpeg",
+        ".mpg",
+        ".mpv",
+        ".mxf",
+        ".nsv",
+        ".ogg",
+        ".ogv",
+        ".qt",
+        ".rm",
+        ".roq",
+        ".rrc",
+        ".svi",
+        ".vob",
+        ".webm",
+        ".wmv",
+        ".yuv",
+    ]
+)
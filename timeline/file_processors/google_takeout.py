@@ -5,7 +5,9 @@ from datetime import datetime, timezone
 from itertools import tee, islice, chain
 from pathlib import Path
 from timeline.models import TimelineEntry, TimelineFile, EntryType
+from typing import Iterator, TextIO
 import json
+import re
 
 
 def e7_to_decimal(e7_coordinate: int) -> float:
@@ -21,32 +23,71 @@ def microseconds_to_time(timestamp: int):
     return datetime.fromtimestamp(int(timestamp) / 1000000).replace(tzinfo=timezone.utc).astimezone()
 
 
+def iter_json_array(json_file: TextIO, key: str, chunk_size: int = 1024 * 1024) -> Iterator:
+    """
+    Yields the items of the array under a key of a JSON file, without reading the whole file into memory. The key
+    must be followed by an array the first time it appears in the file.
+    """
+    decoder = json.JSONDecoder()
+    array_start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    separator = re.compile(r'[\s,]*')
+
+    buffer = ''
+    while not (match := array_start.search(buffer)):
+        chunk = json_file.read(chunk_size)
+        if not chunk:
+            raise KeyError(key)
+        buffer = buffer[-len(key) - 100:] + chunk  # The key could be split between two chunks
+    position = match.end()
+
+    end_of_file = False
+    while True:
+        position = separator.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+
+        # An item is only complete if it's followed by something
+        try:
+            item, item_end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            item_end = len(buffer)
+        if item_end < len(buffer) or end_of_file:
+            if item_end == len(buffer):
+                raise ValueError(f'"{key}" is not a complete JSON array')
+            yield item
+            position = item_end
+        else:
+            chunk = json_file.read(chunk_size)
+            end_of_file = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
 def _process_google_location_history(file: TimelineFile, metadata_root: Path):
     if file.file_path.name != 'Location History.json':
         return
 
+    # This file can be several GB. The locations are read one by one.
     with file.file_path.open(encoding='utf-8') as json_file:
-        json_entries = json.load(json_file)['locations']
-
-    for json_entry in json_entries:
-        entry_data = {
-            'location': {
-                'latitude': e7_to_decimal(json_entry['latitudeE7']),
-                'longitude': e7_to_decimal(json_entry['longitudeE7']),
-            },
-        }
-
-        if altitude := json_entry.get('altitude'):
-            entry_data['location']['altitude'] = altitude
-
-        yield TimelineEntry(
-            file_path=file.file_path,
-            checksum=file.checksum,
-            entry_type=EntryType.GEOLOCATION,
-            date_start=millis_str_to_time(json_entry['timestampMs']),
-            date_end=None,
-            data=entry_data,
-        )
+        for json_entry in iter_json_array(json_file, 'locations'):
+            entry_data = {
+                'location': {
+                    'latitude': e7_to_decimal(json_entry['latitudeE7']),
+                    'longitude': e7_to_decimal(json_entry['longitudeE7']),
+                },
+            }
+
+            if altitude := json_entry.get('altitude'):
+                entry_data['location']['altitude'] = altitude
+
+            yield TimelineEntry(
+                file_path=file.file_path,
+                checksum=file.checksum,
+                entry_type=EntryType.GEOLOCATION,
+                date_start=millis_str_to_time(json_entry['timestampMs']),
+                date_end=None,
+                data=entry_data,
+            )
 
 
 def previous_and_next(iterable):
@@ -5,6 +5,7 @@ from PIL.ImageOps import exif_transpose
 from PIL.ExifTags import TAGS, GPSTAGS
 from pillow_heif import register_heif_opener
 from timeline.file_processors import dates_from_file
+from timeline.file_processors.extensions import image_extensions
 from timeline.models import TimelineFile, TimelineEntry, EntryType
 import logging
 import math
@@ -16,12 +17,6 @@ logger = logging.getLogger(__name__)
 register_heif_opener()
 
 
-image_extensions = {
-    ext
-    for ext, f in Image.registered_extensions().items()
-    if f in Image.OPEN and ext != ".psd"
-}
-
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
@@ -190,7 +185,7 @@ def process_image(file: TimelineFile, metadata_root: Path):
 
     try:
         image_data = get_image_metadata(file.file_path)
-    except:
+    except Exception:
         logger.exception(f"Could not process image metadata - {file.file_path}")
         return
 
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from importlib import import_module
+from importlib.metadata import entry_points
+from itertools import chain
+from pathlib import Path
+from timeline.models import TimelineEntry, TimelineFile
+from typing import Callable, Iterable
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Other packages can add file processors by registering a FileProcessor under this entry point group
+ENTRY_POINT_GROUP = 'timeline.file_processors'
+
+
+class LazyFunction:
+    """
+    A function that is imported when it's first called, so that the dependencies of a processor are only loaded
+    when a file needs it. The path is "module:function".
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.module_name, _, self.__name__ = path.partition(':')
+        self.function: Callable | None = None
+
+    def __call__(self, *args, **kwargs):
+        if self.function is None:
+            self.function = getattr(import_module(self.module_name), self.__name__)
+        return self.function(*args, **kwargs)
+
+    def __reduce__(self):
+        # Worker processes import the function themselves
+        return (LazyFunction, (self.path,))
+
+    def __repr__(self):
+        return f"LazyFunction({self.path!r})"
+
+
+@dataclass(frozen=True)
+class FileProcessor:
+    """
+    A function that returns the timeline entries of a file, and the files it applies to.
+
+    A file matches if its extension is in extensions (".pdf"), if its name ends with one of name_suffixes
+    (".n26.csv"), or if its name is in file_names ("Location History.json"). Extensions and name suffixes are not
+    case-sensitive.
+
+    Use a LazyFunction for process if its module has slow imports.
+
+    Set streams_entries if the processor can yield too many entries to send them back from a worker process as a
+    list. Its files are processed in the main process, and their entries are saved while they are processed.
+
+    Increase the version when the processor creates different entries for the same file. The files it processed
+    with an older version are processed again.
+    """
+    process: Callable[[TimelineFile, Path], Iterable[TimelineEntry]] | LazyFunction
+    extensions: Iterable[str] = ()
+    name_suffixes: Iterable[str] = ()
+    file_names: Iterable[str] = ()
+    version: int = 1
+    streams_entries: bool = False
+
+
+class FileProcessorRegistry:
+    """
+    Finds the processors that apply to a file with dictionary lookups, instead of calling every processor.
+    """
+
+    def __init__(self, file_processors: Iterable[FileProcessor]):
+        self.processors_by_name: dict[str, list[tuple[int, Callable]]] = {}
+
+        # Name suffixes are looked up by their last extension. ".n26.csv" is under ".csv".
+        self.processors_by_extension: dict[str, list[tuple[int, str, Callable]]] = {}
+
+        # The version of each processor, by processor name
+        self.versions: dict[str, int] = {}
+
+        # The names of the processors with streams_entries
+        self.streaming_processors: set[str] = set()
+
+        for index, file_processor in enumerate(file_processors):
+            self.versions[file_processor.process.__name__] = file_processor.version
+            if file_processor.streams_entries:
+                self.streaming_processors.add(file_processor.process.__name__)
+
+            for file_name in file_processor.file_names:
+                self.processors_by_name.setdefault(file_name, []).append((index, file_processor.process))
+
+            for name_suffix in chain(file_processor.extensions, file_processor.name_suffixes):
+                name_suffix = name_suffix.lower()
+                if not name_suffix.startswith('.'):
+                    raise ValueError(f'Extensions and name suffixes must start with ".": {name_suffix}')
+                extension = '.' + name_suffix.rpartition('.')[2]
+                self.processors_by_extension.setdefault(extension, []).append(
+                    (index, name_suffix, file_processor.process)
+                )
+
+    def get_processors(self, file_path: Path) -> list[Callable]:
+        """
+        Returns the processors that apply to a file, in the order they were registered.
+        """
+        lowercase_name = file_path.name.lower()
+        matches = dict(self.processors_by_name.get(file_path.name, []))
+        for index, name_suffix, process in self.processors_by_extension.get(Path(lowercase_name).suffix, []):
+            if lowercase_name.endswith(name_suffix):
+                matches[index] = process
+        return [matches[index] for index in sorted(matches)]
+
+    def get_processor_versions(self, file_path: Path) -> dict[str, int]:
+        """
+        Returns the version of each processor that applies to a file.
+        """
+        return {process.__name__: self.versions[process.__name__] for process in self.get_processors(file_path)}
+
+
+def get_plugin_file_processors() -> list[FileProcessor]:
+    """
+    Returns the file processors that other packages registered under the ENTRY_POINT_GROUP entry point group.
+    """
+    file_processors = []
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            file_processor = entry_point.load()
+        except Exception:
+            logger.exception(f"Could not load file processor {entry_point.name}")
+            continue
+
+        if not isinstance(file_processor, FileProcessor):
+            logger.warning(f"Ignoring file processor {entry_point.name}: it's not a FileProcessor")
+            continue
+
+        file_processors.append(file_processor)
+    return file_processors
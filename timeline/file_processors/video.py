@@ -1,9 +1,10 @@
 from datetime import datetime, timezone
 from decimal import Decimal
+from functools import cache
 from pathlib import Path
 from timeline.file_processors import dates_from_file
+from timeline.file_processors.extensions import video_extensions
 from timeline.models import TimelineFile, TimelineEntry, EntryType
-from timezonefinder import TimezoneFinder
 import json
 import logging
 import pytz
@@ -13,57 +14,20 @@ import subprocess
 
 
 logger = logging.getLogger(__name__)
-tz_finder = TimezoneFinder()
-
-
-video_extensions = set(
-    [
-        ".3g2",
-        ".3gp",
-        ".amv",
-        ".asf",
-        ".avi",
-        ".f4a",
-        ".f4b",
-        ".f4p",
-        ".f4v",
-        ".flv",
-        ".flv",
-        ".gifv",
-        ".hevc",
-        ".m4p",
-        ".m4v",
-        ".m4v",
-        ".mkv",
-        ".mng",
-        ".mod",
-        ".mov",
-        ".mp2",
-        ".mp4",
-        ".mpe",
-        ".mpeg",
-        ".mpg",
-        ".mpv",
-        ".mxf",
-        ".nsv",
-        ".ogg",
-        ".ogv",
-        ".qt",
-        ".rm",
-        ".roq",
-        ".rrc",
-        ".svi",
-        ".vob",
-        ".webm",
-        ".wmv",
-        ".yuv",
-    ]
-)
+
+
 video_geolocation_regex = re.compile(
     r"^(?P<lat>[+-]\d+\.\d+)(?P<lng>[+-]\d+\.\d+)(?P<alt>[+-]\d+\.\d+)?/.*$"
 )
 
 
+@cache
+def get_timezone_finder():
+    # Creating a TimezoneFinder is slow, and only videos with a location need it
+    from timezonefinder import TimezoneFinder
+    return TimezoneFinder()
+
+
 def can_process_videos():
     return bool(shutil.which("ffmpeg")) and bool(shutil.which("ffprobe"))
 
@@ -174,17 +138,19 @@ def process_video(file: TimelineFile, metadata_root: Path):
     )
 
     try:
+        if ffprobe_cmd.returncode != 0:
+            raise ValueError(ffprobe_cmd.stderr.decode("utf-8", "replace"))
         ffprobe_data = json.loads(ffprobe_cmd.stdout.decode("utf-8"))
-    except KeyError:
-        raise ValueError(f"Could not read metadata of {str(file.file_path)}")
+    except ValueError as exception:  # Includes JSON and unicode errors
+        raise ValueError(f"Could not read metadata of {str(file.file_path)}: {exception}")
 
     date_start, date_end = dates_from_file(file.file_path)
     entry_data = {
         "media": {},
     }
 
-    for stream in ffprobe_data["streams"]:
-        if stream["codec_type"] == "video":
+    for stream in ffprobe_data.get("streams", []):
+        if stream.get("codec_type") == "video" and "width" in stream and "height" in stream:
             entry_data["media"]["width"] = int(stream["width"])
             entry_data["media"]["height"] = int(stream["height"])
         if "codec_name" in stream:
@@ -192,33 +158,36 @@ def process_video(file: TimelineFile, metadata_root: Path):
         if "rotate" in stream.get("tags", {}):
             entry_data["media"]["orientation"] = int(stream["tags"]["rotate"])
 
-    entry_data["media"]["duration"] = int(float(ffprobe_data["format"]["duration"]))
-
-    if ffprobe_data["format"].get("tags", {}).get("location"):
-        lat, lng, alt = parse_video_geolocation(
-            ffprobe_data["format"]["tags"]["location"]
-        )
-        entry_data["location"] = {
-            "latitude": float(lat),
-            "longitude": float(lng),
-        }
-        if alt:
-            entry_data["location"]["altitude"] = alt
-
-    if ffprobe_data["format"].get("tags", {}).get("creation_time"):
+    video_format = ffprobe_data.get("format", {})
+    if "duration" in video_format:
+        entry_data["media"]["duration"] = int(float(video_format["duration"]))
+    else:
+        entry_data["media"]["duration"] = None  # No preview can be generated
+
+    if video_format.get("tags", {}).get("location"):
+        if geolocation := parse_video_geolocation(video_format["tags"]["location"]):
+            lat, lng, alt = geolocation
+            entry_data["location"] = {
+                "latitude": float(lat),
+                "longitude": float(lng),
+            }
+            if alt:
+                entry_data["location"]["altitude"] = alt
+
+    if video_format.get("tags", {}).get("creation_time"):
         # The dates are stored as UTC. EXIF metadata might contain timezone-aware dates, but accessing them would
         # require exiftool, which is a non-Python external dependency. It's easier to just get the timezone from the
         # GPS coordinates.
-        date_start = datetime.strptime(
-            ffprobe_data["format"]["tags"]["creation_time"], "%Y-%m-%dT%H:%M:%S.%fZ"
-        ).replace(tzinfo=timezone.utc)
+        date_start = datetime.fromisoformat(video_format["tags"]["creation_time"])
+        if date_start.tzinfo is None:
+            date_start = date_start.replace(tzinfo=timezone.utc)
 
         if entry_data.get("location"):
-            timezone_string = tz_finder.timezone_at(
+            if timezone_string := get_timezone_finder().timezone_at(
                 lat=entry_data["location"]["latitude"],
                 lng=entry_data["location"]["longitude"],
-            )
-            date_start = date_start.astimezone(pytz.timezone(timezone_string))
+            ):
+                date_start = date_start.astimezone(pytz.timezone(timezone_string))
 
     output_path = metadata_root / file.checksum / "thumbnail.webm"
     if not output_path.exists():
@@ -226,7 +195,7 @@ def process_video(file: TimelineFile, metadata_root: Path):
             make_preview(
                 file.file_path, output_path, entry_data["media"]["duration"], 800, 600
             )
-        except:
+        except Exception:
             logger.exception(f"Could not process video - {file.file_path}")
             return
 
@@ -1,11 +1,141 @@
-from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
 from pathlib import Path
+from typing import Iterable, Iterator
 import base64
 import hashlib
+import os
+import re
+import threading
+import time
 
 
-def get_files_in_paths(paths: list[Path], includerules: set = {'*'}, ignorerules: set = set()) -> list[Path]:
-    files = set()
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a pathlib-style glob pattern to a regex. Unlike fnmatch, wildcards do not match "/".
+    """
+    regex = ''
+    parts = pattern.split('/')
+    for index, part in enumerate(parts):
+        if part == '**':
+            regex += '(?:[^/]+/)*'
+            continue
+
+        i = 0
+        while i < len(part):
+            char = part[i]
+            i += 1
+            if char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[':
+                end = i
+                if end < len(part) and part[end] == '!':
+                    end += 1
+                if end < len(part) and part[end] == ']':
+                    end += 1
+                end = part.find(']', end)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    charset = part[i:end].replace('\\', '\\\\')
+                    if charset.startswith('!'):
+                        charset = '^' + charset[1:]
+                    elif charset.startswith('^'):
+                        charset = '\\' + charset
+                    regex += f'(?!/)[{charset}]'
+                    i = end + 1
+            else:
+                regex += re.escape(char)
+
+        if index < len(parts) - 1:
+            regex += '/'
+    return regex
+
+
+def compile_include_rules(includerules: Iterable[str]) -> re.Pattern:
+    """
+    Compiles include rules into a single regex that matches a path relative to the input path.
+    A rule matches if it matches the end of the relative path, like Path.rglob(rule).
+    """
+    return re.compile('|'.join(f'(?:^|/){glob_to_regex(rule)}$' for rule in includerules) or '(?!)')
+
+
+def compile_ignore_rules(ignorerules: Iterable[str]) -> re.Pattern | None:
+    """
+    Compiles ignore rules into a single regex that matches absolute paths. Wildcards match "/".
+    """
+    if not ignorerules:
+        return None
+    return re.compile('|'.join(translate('*/' + rule) for rule in ignorerules))
+
+
+def compile_ignored_directory_rules(ignorerules: Iterable[str]) -> re.Pattern | None:
+    """
+    Compiles the ignore rules that match everything inside a directory (for example .git/*) into a single regex that
+    matches a directory path followed by "/". Those directories can be skipped entirely.
+    """
+    # If "rule*" matches "dir/", it also matches "dir/anything"
+    return compile_ignore_rules([rule for rule in ignorerules if rule.endswith('*')])
+
+
+# Directories modified this close to the start of a scan could change again without changing their mtime
+RACY_DIRECTORY_MTIME_NS = 2_000_000_000
+
+
+def list_directory(directory_path: str) -> tuple[list[str], list[tuple[str, int, float, int, int]]]:
+    """
+    Returns the subdirectories and the files in a directory, with the size, mtime, device and inode of each file.
+    """
+    subdirectories = []
+    files = []
+    with os.scandir(directory_path) as directory_entries:
+        for entry in directory_entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.name)
+                elif entry.is_file():
+                    file_stats = entry.stat()
+                    files.append(
+                        (entry.name, file_stats.st_size, file_stats.st_mtime, file_stats.st_dev, file_stats.st_ino)
+                    )
+            except OSError:  # The file was removed during the scan
+                continue
+    return subdirectories, files
+
+
+def walk_files(
+    paths: list[Path],
+    includerules: set = {'*'},
+    ignorerules: set = set(),
+    directory_cache: dict | None = None,
+    changed_paths: Iterable[Path] | None = None,
+) -> Iterator[tuple[Path, int, float, int, int]]:
+    """
+    Walks through the paths once, and yields a (file_path, size, mtime, device, inode) tuple for each file that matches
+    the rules.
+
+    directory_cache maps directory paths to a (mtime_ns, subdirectories, files) tuple. If a directory's mtime did not
+    change, its cached listing is used instead of listing and stat'ing its files again. Once the walk is done,
+    directory_cache only contains the directories that were visited.
+
+    If changed_paths is set, only the files and directories in changed_paths are walked. The rules still apply to
+    their path relative to the input paths. directory_cache is not used.
+    """
+    include_regex = compile_include_rules(includerules)
+    ignore_regex = compile_ignore_rules(ignorerules)
+    ignored_directory_regex = compile_ignored_directory_rules(ignorerules)
+
+    cached_directories = {}
+    if changed_paths is not None:
+        directory_cache = None
+    elif directory_cache is not None:
+        cached_directories = directory_cache.copy()
+        directory_cache.clear()
+    scan_start_ns = time.time_ns()
+
+    found_files = set()
 
     for path in paths:
         if not path.is_absolute():
@@ -14,19 +144,159 @@ def get_files_in_paths(paths: list[Path], includerules: set = {'*'}, ignorerules
             # Similar files can also be included as one: test/logs/hello.log and test/hello.log
             raise ValueError('Paths must be absolute')
 
-        for includerule in includerules:
-            files.update(
-                f for f in path.rglob(includerule)
-                if f.is_file()
-                and not any(fnmatch(str(f), str('*/' + ignorerule)) for ignorerule in ignorerules)
-            )
+        if changed_paths is None:
+            directories = [(str(path), '')]
+        else:
+            directories = []
+            for changed_path in changed_paths:
+                if changed_path == path:
+                    directories.append((str(path), ''))
+                elif changed_path.is_relative_to(path):
+                    relative_path = changed_path.relative_to(path).as_posix()
+                    if changed_path.is_dir() and not changed_path.is_symlink():
+                        directories.append((str(changed_path), relative_path + '/'))
+                    elif (
+                        str(changed_path) not in found_files
+                        and changed_path.is_file()
+                        and include_regex.search(relative_path)
+                        and not (ignore_regex and ignore_regex.match(str(changed_path)))
+                    ):
+                        try:
+                            file_stats = changed_path.stat()
+                        except OSError:  # The file was removed during the scan
+                            continue
+                        found_files.add(str(changed_path))
+                        yield changed_path, file_stats.st_size, file_stats.st_mtime, file_stats.st_dev, file_stats.st_ino
+
+        while directories:
+            directory_path, relative_directory_path = directories.pop()
+            try:
+                if directory_cache is None:
+                    subdirectories, files = list_directory(directory_path)
+                else:
+                    directory_mtime = os.stat(directory_path).st_mtime_ns
+                    cached_directory = cached_directories.get(directory_path)
+                    if cached_directory and cached_directory[0] == directory_mtime:
+                        subdirectories, files = cached_directory[1], cached_directory[2]
+                    else:
+                        subdirectories, files = list_directory(directory_path)
+                    if directory_mtime < scan_start_ns - RACY_DIRECTORY_MTIME_NS:
+                        directory_cache[directory_path] = (directory_mtime, subdirectories, files)
+            except OSError:
+                continue
+
+            for subdirectory in subdirectories:
+                subdirectory_path = os.path.join(directory_path, subdirectory)
+                if not (ignored_directory_regex and ignored_directory_regex.match(subdirectory_path + '/')):
+                    directories.append((subdirectory_path, relative_directory_path + subdirectory + '/'))
+
+            for file_name, size, mtime, device, inode in files:
+                file_path = os.path.join(directory_path, file_name)
+                if (
+                    file_path in found_files
+                    or not include_regex.search(relative_directory_path + file_name)
+                    or (ignore_regex and ignore_regex.match(file_path))
+                ):
+                    continue
+
+                found_files.add(file_path)
+                yield Path(file_path), size, mtime, device, inode
+
+
+def get_files_in_paths(paths: list[Path], includerules: set = {'*'}, ignorerules: set = set()) -> list[Path]:
+    return [file_path for file_path, *file_stats in walk_files(paths, includerules, ignorerules)]
+
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Files larger than this are split into chunks that are hashed in parallel
+TREE_HASH_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Tree hash checksums start with a lowercase letter. Sequential hash checksums are uppercase.
+TREE_CHECKSUM_PREFIX = 't'
+
+# Fingerprints start with this prefix
+FINGERPRINT_PREFIX = 'f'
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+hash_buffers = threading.local()
+
+
+def get_hash_buffer() -> memoryview:
+    # Each thread reuses the same buffer for all the files it hashes
+    if not hasattr(hash_buffers, 'buffer'):
+        hash_buffers.buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+    return hash_buffers.buffer
+
+
+def advise_file_access(file, advice_name: str):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(file.fileno(), 0, 0, getattr(os, advice_name))
+
+
+def hash_file_chunk(file_path: Path, file_hash, offset: int = 0, length: int | None = None):
+    buffer = get_hash_buffer()
+    with open(file_path, 'rb', buffering=0) as file:
+        advise_file_access(file, 'POSIX_FADV_SEQUENTIAL')
+        file.seek(offset)
+        while length is None or length > 0:
+            bytes_read = file.readinto(buffer if length is None else buffer[:length])
+            if not bytes_read:
+                break
+            file_hash.update(buffer[:bytes_read])
+            if length is not None:
+                length -= bytes_read
+
+        # The file is not read again soon. Don't fill the page cache with it.
+        advise_file_access(file, 'POSIX_FADV_DONTNEED')
+    return file_hash
+
+
+def get_tree_hash(file_path: Path, file_size: int, workers: int) -> bytes:
+    """
+    Hash the file's chunks in parallel with BLAKE2b's tree hashing mode, then hash the chunk hashes together.
+    """
+    chunk_count = (file_size + TREE_HASH_CHUNK_SIZE - 1) // TREE_HASH_CHUNK_SIZE
+    tree_parameters = {'digest_size': 32, 'fanout': 0, 'depth': 2, 'leaf_size': TREE_HASH_CHUNK_SIZE, 'inner_size': 32}
+
+    def hash_chunk(chunk_index: int) -> bytes:
+        chunk_hash = hashlib.blake2b(
+            node_offset=chunk_index, node_depth=0, last_node=chunk_index == chunk_count - 1, **tree_parameters
+        )
+        return hash_file_chunk(
+            file_path, chunk_hash, chunk_index * TREE_HASH_CHUNK_SIZE, TREE_HASH_CHUNK_SIZE
+        ).digest()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        chunk_hashes = list(executor.map(hash_chunk, range(chunk_count)))
+
+    root_hash = hashlib.blake2b(node_offset=0, node_depth=1, last_node=True, **tree_parameters)
+    for chunk_hash in chunk_hashes:
+        root_hash.update(chunk_hash)
+    return root_hash.digest()
+
+
+def get_checksum(file_path: Path, tree_hash: bool = False, tree_hash_workers: int = 4) -> str:
+    """
+    Returns the BLAKE2b hash of the file.
+
+    If tree_hash is True, files larger than TREE_HASH_CHUNK_SIZE are hashed in chunks, in parallel. This returns a
+    different checksum. It starts with TREE_CHECKSUM_PREFIX.
+    """
+    if tree_hash and (file_size := file_path.stat().st_size) > TREE_HASH_CHUNK_SIZE:
+        digest = get_tree_hash(file_path, file_size, tree_hash_workers)
+        return TREE_CHECKSUM_PREFIX + base64.b32hexencode(digest).decode('utf-8').strip('=')
 
-    return list(files)
+    digest = hash_file_chunk(file_path, hashlib.blake2b(digest_size=32)).digest()
+    return base64.b32hexencode(digest).decode('utf-8').strip('=')
 
 
-def get_checksum(file_path: Path) -> str:
-    with open(file_path, "rb") as f:
-        file_hash = hashlib.blake2b(digest_size=32)
-        while chunk := f.read(8192):
-            file_hash.update(chunk)
-    return base64.b32hexencode(file_hash.digest()).decode('utf-8').strip('=')
+def get_fingerprint(file_path: Path, file_size: int) -> str:
+    """
+    Returns a hash of the file's size and of its first, middle and last blocks. It's much faster than get_checksum
+    for large files, but it can miss changes in the rest of the file.
+    """
+    file_hash = hashlib.blake2b(file_size.to_bytes(8, 'little'), digest_size=32)
+    for offset in (0, file_size // 2 - FINGERPRINT_BLOCK_SIZE // 2, file_size - FINGERPRINT_BLOCK_SIZE):
+        hash_file_chunk(file_path, file_hash, max(offset, 0), FINGERPRINT_BLOCK_SIZE)
+    return FINGERPRINT_PREFIX + base64.b32hexencode(file_hash.digest()).decode('utf-8').strip('=')
@@ -1,30 +1,39 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from decimal import Decimal
 from importlib.resources import as_file, files
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 from timeline.file_processors.balance import process_balance_list
-from timeline.file_processors.calendar import process_icalendar, process_calendar_db
 from timeline.file_processors.degiro import process_degiro_transactions
-from timeline.post_processors.geo import add_reverse_geolocation
+from timeline.file_processors.extensions import image_extensions, video_extensions
 from timeline.file_processors.google_takeout import (
     process_google_browser_history,
     process_google_location_history,
 )
-from timeline.file_processors.gpx import process_gpx
-from timeline.file_processors.image import process_image
 from timeline.file_processors.kontist import process_kontist_transactions
 from timeline.file_processors.n26 import process_n26_transactions
-from timeline.file_processors.pdf import process_pdf
+from timeline.file_processors.registry import (
+    FileProcessor,
+    FileProcessorRegistry,
+    LazyFunction,
+    get_plugin_file_processors,
+)
 from timeline.file_processors.search import process_search_logs
-from timeline.file_processors.text import process_text, process_markdown
-from timeline.file_processors.video import process_video, can_process_videos
-from timeline.filesystem import get_files_in_paths
-from timeline.models import TimelineFile, EntryType
-from typing import Iterable
+from timeline.file_processors.video import can_process_videos
+from timeline.filesystem import get_checksum, get_files_in_paths, walk_files
+from timeline.models import TimelineEntry, TimelineFile, EntryType
+from timeline.progress import ProgressReporter
+from timeline.scheduling import schedule_files
+from timeline.stats import Measurement, RunStats, measure
+from timeline.watch import get_watcher
+from timeline.workers import ProcessingError, ProcessingTimeout, WorkerPool, deadline
+from typing import Callable, Iterable, Iterator
 import json
 import logging
 import shutil
+import sqlite3
+import time
+import traceback
 import timeline.database as db
 
 
@@ -32,106 +41,532 @@ logger = logging.getLogger(__name__)
 
 
 def get_timeline_files_in_paths(
-    paths, includerules, ignorerules
+    paths,
+    includerules,
+    ignorerules,
+    directory_cache: dict | None = None,
+    changed_paths: Iterable[Path] | None = None,
 ) -> Iterable[TimelineFile]:
     now = datetime.now().astimezone()
-    for file_path in get_files_in_paths(paths, includerules, ignorerules):
-        file_stats = file_path.stat()
+    for file_path, size, mtime, device, inode in walk_files(
+        paths, includerules, ignorerules, directory_cache, changed_paths
+    ):
         yield TimelineFile(
             file_path=file_path,
             checksum=None,
             date_added=now,
-            file_mtime=datetime.fromtimestamp(file_stats.st_mtime).astimezone(),
-            size=file_stats.st_size,
+            # Converting every mtime to the local timezone is slow. It's the same time in UTC.
+            file_mtime=datetime.fromtimestamp(mtime, timezone.utc),
+            size=size,
+            device=device,
+            inode=inode,
         )
 
 
-def process_timeline_files(
-    cursor, input_paths, includerules, ignorerules, metadata_root: Path
-):
-    logger.info("Updating file list")
-    db.create_database(cursor)
-    db.update_file_database(
-        cursor, get_timeline_files_in_paths(input_paths, includerules, ignorerules)
-    )
-
-    timeline_file_processors = [
-        process_balance_list,
-        process_calendar_db,
-        process_degiro_transactions,
-        process_google_browser_history,
-        process_google_location_history,
-        process_gpx,
-        process_icalendar,
-        process_image,
-        process_kontist_transactions,
-        process_markdown,
-        process_n26_transactions,
-        process_pdf,
-        process_search_logs,
-        process_text,
+def get_file_processors() -> tuple[FileProcessorRegistry, list[Callable]]:
+    """
+    Returns the file processors and the post processors that apply to the timeline files. The processors with slow
+    imports are only imported when they are first called.
+    """
+    file_processors = [
+        FileProcessor(process_balance_list, name_suffixes=[".balances.csv"]),
+        FileProcessor(LazyFunction("timeline.file_processors.calendar:process_calendar_db"), extensions=[".sqlitedb"]),
+        FileProcessor(process_degiro_transactions, name_suffixes=[".degiro.csv"]),
+        FileProcessor(process_google_browser_history, file_names=["BrowserHistory.json"]),
+        FileProcessor(process_google_location_history, file_names=["Location History.json"], streams_entries=True),
+        FileProcessor(LazyFunction("timeline.file_processors.gpx:process_gpx"), extensions=[".gpx"]),
+        FileProcessor(
+            LazyFunction("timeline.file_processors.calendar:process_icalendar"),
+            extensions=[".ical", ".ics", ".ifb", ".icalendar"],
+        ),
+        FileProcessor(LazyFunction("timeline.file_processors.image:process_image"), extensions=image_extensions),
+        FileProcessor(process_kontist_transactions, name_suffixes=[".kontist.csv"]),
+        FileProcessor(LazyFunction("timeline.file_processors.text:process_markdown"), extensions=[".md"]),
+        FileProcessor(process_n26_transactions, name_suffixes=[".n26.csv"]),
+        FileProcessor(LazyFunction("timeline.file_processors.pdf:process_pdf"), extensions=[".pdf"]),
+        FileProcessor(process_search_logs, name_suffixes=[".searches.csv"]),
+        FileProcessor(LazyFunction("timeline.file_processors.text:process_text"), extensions=[".txt"]),
     ]
 
     timeline_post_processors = [
-        add_reverse_geolocation,
+        LazyFunction("timeline.post_processors.geo:add_reverse_geolocation"),
     ]
 
     if can_process_videos():
-        timeline_file_processors.append(process_video)
+        file_processors.append(
+            FileProcessor(LazyFunction("timeline.file_processors.video:process_video"), extensions=video_extensions)
+        )
     else:
         logging.warning("ffmpeg is not installed. Videos will not be processed.")
 
-    new_file_count = 0
-    for file in db.get_unprocessed_timeline_files(cursor):
-        new_file_count += 1
-        logger.info(f"Processing {file.file_path}")
-
-        # Chain all the file processors together
-        entry_generator = chain(
-            *[
-                process_function(file, metadata_root)
-                for process_function in timeline_file_processors
-            ]
+    file_processors.extend(get_plugin_file_processors())
+
+    return FileProcessorRegistry(file_processors), timeline_post_processors
+
+
+def iter_file_entries(
+    file: TimelineFile,
+    metadata_root: Path,
+    timeline_file_processors: list[Callable],
+    timeline_post_processors: list[Callable],
+    measurements: dict[str, Measurement],
+    batch_size: int = 10000,
+) -> Iterator[TimelineEntry]:
+    """
+    Yields the timeline entries of a file, from the processors that apply to
+    it. The entries are processed in batches, so that a large file is never
+    entirely in memory. The time spent in each processor is added to
+    measurements.
+    """
+    for post_process_function in timeline_post_processors:
+        measurements[post_process_function.__name__] = Measurement(files=1)
+
+    for process_function in timeline_file_processors:
+        measurement = Measurement(files=1, bytes_read=file.size)
+        measurements[process_function.__name__] = measurement
+        entries = iter(process_function(file, metadata_root))
+        while True:
+            with measure(measurement):
+                batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            measurement.entries += len(batch)
+
+            # Apply each post processor to the entries
+            for post_process_function in timeline_post_processors:
+                post_process_measurement = measurements[post_process_function.__name__]
+                with measure(post_process_measurement):
+                    batch = [post_process_function(entry) for entry in batch]
+                post_process_measurement.entries += len(batch)
+
+            yield from batch
+
+
+class FileProcessorError(Exception):
+    """
+    Raised when a file processor fails while its entries are saved. Its
+    exception is the cause. Database errors stop the run, but processor errors
+    only mark the file as failed, even if they are sqlite3 errors.
+    """
+    pass
+
+
+def raise_processor_errors(entries: Iterable[TimelineEntry]) -> Iterator[TimelineEntry]:
+    try:
+        yield from entries
+    except Exception as exception:
+        raise FileProcessorError(str(exception)) from exception
+
+
+def process_file(
+    file: TimelineFile,
+    metadata_root: Path,
+    timeline_file_processors: list[Callable],
+    timeline_post_processors: list[Callable],
+) -> tuple[list[TimelineEntry], dict[str, Measurement]]:
+    """
+    Returns the timeline entries of a file, from the processors that apply to
+    it, and the measurements of each processor. It runs in the worker processes.
+    """
+    measurements = {}
+    entries = list(
+        iter_file_entries(file, metadata_root, timeline_file_processors, timeline_post_processors, measurements)
+    )
+    return entries, measurements
+
+
+def process_single_file(
+    file_path: Path, metadata_root: Path, run_stats: RunStats | None = None
+) -> list[TimelineEntry]:
+    """
+    Returns the timeline entries of a single file, without adding it to the
+    database. Used to find out why a file is slow to process.
+    """
+    run_stats = run_stats or RunStats()
+    file_processor_registry, timeline_post_processors = get_file_processors()
+    file_stats = file_path.stat()
+    file = TimelineFile(
+        file_path=file_path,
+        checksum=get_checksum(file_path),
+        date_added=datetime.now().astimezone(),
+        file_mtime=datetime.fromtimestamp(file_stats.st_mtime).astimezone(),
+        size=file_stats.st_size,
+        device=file_stats.st_dev,
+        inode=file_stats.st_ino,
+    )
+    with run_stats.measure("process_files") as measurement:
+        entries, processor_measurements = process_file(
+            file,
+            metadata_root,
+            file_processor_registry.get_processors(file_path),
+            timeline_post_processors,
         )
+        measurement.files += 1
+        measurement.entries += len(entries)
+    run_stats.add_processor_measurements(processor_measurements)
+    return entries
+
+
+def reset_outdated_files(cursor, file_processor_registry: FileProcessorRegistry, reprocess: Iterable[str] = ()) -> int:
+    """
+    Mark the files processed by an older version of their processors as
+    unprocessed. Files that a new processor applies to are also marked as
+    unprocessed, and so are the files of the processors in reprocess. Returns
+    the number of files to process again.
+
+    The first time this runs, the files that were processed before processor
+    versions were saved get the versions of the current processors.
+    """
+    reprocess = set(reprocess)
+    for processor_name in reprocess - file_processor_registry.versions.keys():
+        logger.warning(f"Can't reprocess files: there is no file processor called {processor_name}")
+
+    saved_versions = db.get_processor_versions(cursor)
+    if not saved_versions:
+        legacy_files = [
+            (file_path, file_processor_registry.get_processor_versions(file_path))
+            for file_path, processor_versions in db.get_processed_files(cursor)
+            if processor_versions is None
+        ]
+        db.save_file_processor_versions(cursor, legacy_files)
+        db.save_processor_versions(cursor, file_processor_registry.versions)
+        saved_versions = file_processor_registry.versions
+
+    # Processors that were removed don't cause files to be processed again.
+    # Otherwise, a missing dependency like ffmpeg would remove the entries.
+    changed_processors = {
+        processor_name
+        for processor_name, version in file_processor_registry.versions.items()
+        if saved_versions.get(processor_name) != version or processor_name in reprocess
+    }
+    if not changed_processors:
+        return 0
+
+    outdated_files = []
+    for file_path, processor_versions in db.get_processed_files(cursor):
+        current_versions = file_processor_registry.get_processor_versions(file_path)
+        processor_versions = processor_versions or {}
+        for processor_name in changed_processors:
+            if processor_name not in current_versions and processor_name not in processor_versions:
+                continue
+            if (
+                processor_name in reprocess
+                or current_versions.get(processor_name) != processor_versions.get(processor_name)
+            ):
+                outdated_files.append(file_path)
+                break
+
+    db.mark_files_as_unprocessed(cursor, outdated_files)
+    db.save_processor_versions(cursor, file_processor_registry.versions)
+    return len(outdated_files)
+
+
+def process_timeline_files(
+    cursor,
+    input_paths,
+    includerules,
+    ignorerules,
+    metadata_root: Path,
+    full_rescan: bool = False,
+    changed_paths: set[Path] | None = None,
+    hash_workers: int = 4,
+    tree_hash: bool = False,
+    fingerprint_min_size: int | None = None,
+    dedupe: bool = False,
+    commit_every: int = 100,
+    commit_interval: float = 60,
+    workers: int = 1,
+    run_stats: RunStats | None = None,
+    progress: str = "none",
+    progress_interval: float = 10,
+    schedule: Iterable[str] = ("table",),
+    reprocess: Iterable[str] = (),
+    file_timeout: float | None = None,
+):
+    """
+    Processing is committed every commit_every files, or every commit_interval
+    seconds, whichever comes first. If the run is interrupted, the next run
+    continues with the files that were not committed.
+
+    If workers is more than 1, the files are processed by that many processes.
+
+    If run_stats is set, each phase and each file processor is measured.
+
+    progress is the ProgressReporter mode: "tty", "log" or "none".
+
+    The files are processed in the order given by the schedule policies. See
+    schedule_files.
 
-        # Apply each post processor to the entries from entry_generator
-        for post_process_function in timeline_post_processors:
-            entry_generator = map(post_process_function, entry_generator)
+    The entries are saved in batches while the file is processed, so that a
+    large file does not need to fit in memory. With workers, only the files of
+    processors with streams_entries are processed that way.
 
-        db.update_timeline_entries_for_file(
-            cursor, file.file_path, list(entry_generator)
+    Files processed by an older version of a processor, or by a processor in
+    reprocess, are processed again. See reset_outdated_files.
+
+    If file_timeout is set, the files are processed by worker processes, even
+    if workers is 1, and each file must be processed within that many seconds.
+    Files that fail or time out are processed again on a later run. See
+    db.add_file_failure.
+    """
+    run_stats = run_stats or RunStats()
+    logger.info("Updating file list")
+    db.create_database(cursor)
+
+    if changed_paths is None:
+        # Directories that did not change since the last run are not scanned again
+        directory_cache = {} if full_rescan else db.get_directory_cache(cursor)
+        saved_directory_cache = None if full_rescan else directory_cache.copy()
+        db.update_file_database(
+            cursor,
+            get_timeline_files_in_paths(
+                input_paths, includerules, ignorerules, directory_cache
+            ),
+            hash_workers=hash_workers,
+            tree_hash=tree_hash,
+            fingerprint_min_size=fingerprint_min_size,
+            run_stats=run_stats,
+        )
+        db.save_directory_cache(cursor, directory_cache, saved_directory_cache)
+    else:
+        # Only scan the paths that changed
+        db.update_file_database(
+            cursor,
+            get_timeline_files_in_paths(
+                input_paths, includerules, ignorerules, changed_paths=changed_paths
+            ),
+            scope=changed_paths,
+            hash_workers=hash_workers,
+            tree_hash=tree_hash,
+            fingerprint_min_size=fingerprint_min_size,
+            run_stats=run_stats,
         )
-        db.mark_timeline_file_as_processed(cursor, file.file_path)
 
-    logger.info(f"Processed {new_file_count} new files")
+    file_processor_registry, timeline_post_processors = get_file_processors()
 
+    if not dedupe:
+        db.reset_duplicate_files(cursor)
 
-def generate_daily_entry_lists(cursor, output_path: Path):
-    # Generate entries .json for each day
-    # Only generate missing days or days that have changes to speed things up
-    logger.info("Generating entry lists by day")
+    if outdated_file_count := reset_outdated_files(cursor, file_processor_registry, reprocess):
+        logger.info(f"{outdated_file_count} files will be processed again because their file processors changed")
 
-    output_path.mkdir(parents=True, exist_ok=True)
+    # The file list is committed before the files are processed
+    cursor.connection.commit()
 
-    days_to_update = db.dates_with_changes(cursor)
+    new_file_count = 0
+    duplicate_count = 0
+    uncommitted_file_count = 0
+    last_commit_time = time.monotonic()
 
-    days_updated = 0
-    days_deleted = 0
+    unprocessed_files = schedule_files(
+        list(db.get_unprocessed_timeline_files(cursor)), schedule, file_processor_registry
+    )
+    progress_reporter = ProgressReporter(
+        len(unprocessed_files),
+        sum(file.size for file in unprocessed_files),
+        mode=progress,
+        interval=progress_interval,
+    )
 
-    for day, date_last_changed in days_to_update.items():
-        day_json_path = output_path / f"{day.strftime('%Y-%m-%d')}.json"
+    def save_file_entries(
+        file: TimelineFile,
+        file_type: str,
+        entries: Iterable[TimelineEntry],
+        processor_measurements: dict[str, Measurement],
+        streamed: bool = False,
+    ):
+        """
+        If streamed is True, entries is a generator. The file is processed
+        while its entries are saved, within file_timeout seconds, and
+        processor_measurements is filled. If processing fails, the file's
+        changes are rolled back.
+        """
+        nonlocal uncommitted_file_count, last_commit_time
+        if streamed:
+            entries = raise_processor_errors(entries)
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN")  # Otherwise, releasing the savepoint commits
+        cursor.execute("SAVEPOINT save_file_entries")
+        try:
+            with deadline(file_timeout if streamed else None), run_stats.measure("save_entries") as measurement:
+                measurement.entries += db.update_timeline_entries_for_file(cursor, file.file_path, entries)
+                db.mark_timeline_file_as_processed(
+                    cursor, file.file_path, file_processor_registry.get_processor_versions(file.file_path)
+                )
+                db.clear_file_failure(cursor, file.file_path)
+                measurement.files += 1
+                if streamed:
+                    # The processors were measured separately
+                    measurement.wall_time -= sum(m.wall_time for m in processor_measurements.values())
+                    measurement.cpu_time -= sum(m.cpu_time for m in processor_measurements.values())
+        except BaseException as exception:
+            if cursor.connection.in_transaction:  # Some errors roll back the whole transaction
+                cursor.execute("ROLLBACK TO save_file_entries")
+                cursor.execute("RELEASE save_file_entries")
+            if isinstance(exception, FileProcessorError):
+                add_file_failure(file, exception.__cause__)
+            elif isinstance(exception, (Exception, ProcessingTimeout)) and not isinstance(exception, sqlite3.Error):
+                add_file_failure(file, exception)
+            else:
+                raise
+            return
+        cursor.execute("RELEASE save_file_entries")
+
+        uncommitted_file_count += 1
+        if uncommitted_file_count >= commit_every or time.monotonic() - last_commit_time >= commit_interval:
+            cursor.connection.commit()
+            uncommitted_file_count = 0
+            last_commit_time = time.monotonic()
+
+        run_stats.add_processor_measurements(processor_measurements)
+        progress_reporter.file_done(
+            file.file_path,
+            file.size,
+            file_type,
+            sum(measurement.wall_time for measurement in processor_measurements.values()),
+        )
+
+    failed_count = 0
 
-        entries = list(e.to_json_dict() for e in db.get_entries_for_date(cursor, day))
-        if entries:
-            day_json_path.write_text(json.dumps({"entries": entries}))
-            days_updated += 1
+    def add_file_failure(file: TimelineFile, exception: BaseException):
+        nonlocal failed_count
+        failed_count += 1
+        logger.error(f"Could not process {str(file.file_path)}", exc_info=exception)
+        if isinstance(exception, ProcessingError):
+            error = str(exception)
+        else:
+            error = "".join(traceback.format_exception_only(exception)).strip()
+        db.add_file_failure(cursor, file.file_path, file.checksum, error)
+        progress_reporter.file_skipped(file.size)
+
+    # Files are processed by the worker processes, but only this process
+    # writes to the database. The results are saved in the same order as the
+    # files, so that the result is the same as without workers.
+    #
+    # The entries of the worker processes are sent back as a list. The files
+    # of processors with streams_entries are processed in this process
+    # instead, so that their entries are saved as they are processed. They
+    # have the same deadline, but a C extension that never returns can't be
+    # stopped.
+    worker_pool = WorkerPool(workers, file_timeout) if workers > 1 or file_timeout else None
+    file_types = {}
+
+    def save_next_pending_file():
+        file, result, exception = worker_pool.get_next_result()
+        file_type = file_types.pop(file.file_path)
+        if exception:
+            add_file_failure(file, exception)
         else:
-            day_json_path.unlink(missing_ok=True)
-            days_deleted += 1
+            save_file_entries(file, file_type, *result)
+
+    # This includes the time spent saving the entries
+    with run_stats.measure("process_files") as measurement:
+        try:
+            for file in unprocessed_files:
+                # Files with the same content are only processed once
+                if dedupe:
+                    # The file could be a duplicate of a file that is being processed
+                    while worker_pool and any(f.checksum == file.checksum for f in worker_pool.keys()):
+                        save_next_pending_file()
+                    if original_path := db.get_original_file(cursor, file):
+                        duplicate_count += 1
+                        progress_reporter.file_skipped(file.size)
+                        db.mark_timeline_file_as_duplicate(cursor, file.file_path, original_path)
+                        continue
+
+                new_file_count += 1
+                logger.debug(f"Processing {file.file_path}")
+                timeline_file_processors = file_processor_registry.get_processors(file.file_path)
+                file_type = timeline_file_processors[0].__name__ if timeline_file_processors else "no processor"
+                process_args = (file, metadata_root, timeline_file_processors, timeline_post_processors)
+                streams_entries = any(
+                    process.__name__ in file_processor_registry.streaming_processors
+                    for process in timeline_file_processors
+                )
+                if not timeline_file_processors:
+                    # It has no entries, so it doesn't need to wait for the pending files
+                    save_file_entries(file, file_type, [], {})
+                elif worker_pool and not streams_entries:
+                    file_types[file.file_path] = file_type
+                    worker_pool.submit(file, process_file, *process_args)
+                    if worker_pool.is_full():
+                        save_next_pending_file()
+                else:
+                    while worker_pool and worker_pool.pending:
+                        save_next_pending_file()
+                    processor_measurements = {}
+                    entries = iter_file_entries(*process_args, processor_measurements)
+                    save_file_entries(file, file_type, entries, processor_measurements, streamed=True)
+
+            while worker_pool and worker_pool.pending:
+                save_next_pending_file()
+        finally:
+            if worker_pool is not None:
+                worker_pool.shutdown()
+        measurement.files += new_file_count
+    progress_reporter.finish()
+
+    cursor.connection.commit()
+    logger.info(f"Processed {new_file_count - failed_count} new files")
+    if duplicate_count:
+        logger.info(f"Skipped {duplicate_count} duplicate files")
+    if failed_count:
+        logger.warning(
+            f"Could not process {failed_count} files. They will be processed again later. "
+            "Call `timeline failures` to see why."
+        )
 
-    logger.info(
-        f"Generated entry lists for {len(days_to_update)} days: updated {days_updated}, removed {days_deleted}"
-    )
+
+def generate_daily_entry_lists(
+    cursor,
+    output_path: Path,
+    duplicates_per_path: bool = False,
+    batch_size: int = 100,
+    run_stats: RunStats | None = None,
+):
+    """
+    Generate the entries .json of each day in dates_with_changes. The days are
+    generated and removed from dates_with_changes in batches. If the process is
+    interrupted, the next run generates the remaining days.
+
+    Days that change again during the generation stay in dates_with_changes.
+    """
+    logger.info("Generating entry lists by day")
+    run_stats = run_stats or RunStats()
+    with run_stats.measure("generate_entry_lists") as measurement:
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        watermark = db.get_change_watermark(cursor)
+        days_to_update = list(db.dates_with_changes(cursor, watermark).keys())
+
+        days_updated = 0
+        days_deleted = 0
+
+        for batch_start in range(0, len(days_to_update), batch_size):
+            days = days_to_update[batch_start:batch_start + batch_size]
+            # Only one day's entries are in memory at a time
+            days_with_entries = set()
+            for day, entries in db.get_entries_for_dates(cursor, days, duplicates_per_path):
+                day_json_path = output_path / f"{day.strftime('%Y-%m-%d')}.json"
+                day_json_path.write_text(json.dumps({"entries": [e.to_json_dict() for e in entries]}))
+                days_with_entries.add(day)
+                days_updated += 1
+                measurement.entries += len(entries)
+
+            for day in days:
+                day_json_path = output_path / f"{day.strftime('%Y-%m-%d')}.json"
+                if day not in days_with_entries and day_json_path.exists():
+                    # All the entries on this day were deleted
+                    day_json_path.unlink()
+                    days_deleted += 1
+
+            db.clear_dates_with_changes(cursor, days, watermark)
+            cursor.connection.commit()
+
+        measurement.files += days_updated
+        logger.info(
+            f"Generated entry lists for {len(days_to_update)} days: updated {days_updated}, removed {days_deleted}"
+        )
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -191,28 +626,12 @@ def generate_financial_report(cursor, output_path: Path):
         json.dump(balances_by_date, json_file, cls=DecimalEncoder)
 
 
-def generate(
-    input_paths,
-    includerules,
-    ignorerules,
+def copy_templates(
     output_root: Path,
     site_url: str = "",
     google_maps_api_key: str = "",
     live_templates: bool = False,
 ):
-    logging.info(f"Building timeline, saving it to {str(output_root)}")
-
-    metadata_root = output_root / "metadata"
-    metadata_root.mkdir(parents=True, exist_ok=True)
-
-    connection = db.get_connection(metadata_root / "timeline.db")
-    cursor = connection.cursor()
-
-    process_timeline_files(
-        cursor, input_paths, includerules, ignorerules, metadata_root
-    )
-    connection.commit()
-
     with as_file(files("timeline")) as path:
         templates_root = path / "templates"
 
@@ -242,6 +661,205 @@ def generate(
     with js_config_path.open("w") as config_file:
         config_file.write(config)
 
-    generate_daily_entry_lists(cursor, output_root / "entries")
-    generate_financial_report(cursor, output_root / "entries" / "finances.json")
+
+def watch_input_paths(
+    watcher,
+    update_timeline: Callable[[set[Path] | None], None],
+    debounce_seconds: float = 5,
+    rescan_interval: float = 3600,
+):
+    """
+    Call update_timeline with the paths that changed whenever files change.
+
+    Every rescan_interval seconds, update_timeline is called with None, so
+    that all input paths are scanned again, in case some changes were missed.
+
+    If update_timeline fails, for example because a file was removed while it
+    was read, the error is logged, and the update is tried again with the
+    next change.
+    """
+    logger.info("Watching the input paths for changes")
+    next_rescan = time.monotonic() + rescan_interval
+
+    # The paths to update again, or None if the whole rescan must be done again
+    failed_paths: set[Path] | None = set()
+
+    def try_update_timeline(paths: set[Path] | None) -> bool:
+        try:
+            update_timeline(paths)
+            return True
+        except Exception:
+            logger.exception("Could not update the timeline. It will be updated again with the next change.")
+            return False
+
+    while True:
+        changed_paths = watcher.wait_for_changes(
+            max(next_rescan - time.monotonic(), 0)
+        )
+
+        if changed_paths:
+            # Wait until the files stop changing
+            while more_changed_paths := watcher.wait_for_changes(debounce_seconds):
+                changed_paths.update(more_changed_paths)
+            logger.info(f"{len(changed_paths)} paths changed")
+            paths = None if failed_paths is None else changed_paths | failed_paths
+            failed_paths = set() if try_update_timeline(paths) else paths
+        elif time.monotonic() >= next_rescan:
+            logger.info("Rescanning the input paths")
+            next_rescan = time.monotonic() + rescan_interval
+            failed_paths = set() if try_update_timeline(None) else None
+
+
+def generate(
+    input_paths,
+    includerules,
+    ignorerules,
+    output_root: Path,
+    site_url: str = "",
+    google_maps_api_key: str = "",
+    live_templates: bool = False,
+    full_rescan: bool = False,
+    watch: bool = False,
+    watch_debounce: float = 5,
+    watch_rescan_interval: float = 3600,
+    hash_workers: int = 4,
+    tree_hash: bool = False,
+    fingerprint_min_size: int | None = None,
+    dedupe: str | None = None,
+    connection_profile: db.ConnectionProfile | None = None,
+    commit_every: int = 100,
+    commit_interval: float = 60,
+    regenerate: tuple[date, date] | None = None,
+    workers: int = 1,
+    profile_path: Path | None = None,
+    trace_memory: bool = False,
+    progress: str = "log",
+    progress_interval: float = 10,
+    schedule: Iterable[str] = ("videos-last", "newest-first"),
+    reprocess: Iterable[str] = (),
+    file_timeout: float | None = 1800,
+):
+    """
+    dedupe is None, "once" or "per-path". If it's set, files with the same
+    content are only processed once. With "once", they appear once on the
+    timeline. With "per-path", they appear once for each path.
+
+    Processing is committed every commit_every files or commit_interval seconds.
+
+    regenerate is a (first_day, last_day) tuple. The entry lists of those days
+    are generated again, even if their entries did not change.
+
+    If workers is more than 1, the files are processed by that many processes.
+
+    If profile_path is set, each phase of each run is profiled. The profiles
+    are saved in a subdirectory of profile_path. See RunStats.
+
+    progress is the ProgressReporter mode: "tty", "log" or "none". In "log"
+    mode, the progress is logged every progress_interval seconds.
+
+    schedule is a list of policies that decide which files are processed
+    first. See schedule_files.
+
+    The files of the file processors in reprocess are processed again during
+    the first run. Existing thumbnails and previews are kept.
+
+    Each file must be processed within file_timeout seconds. Files that fail
+    or time out are processed again on a later run.
+    """
+    logging.info(f"Building timeline, saving it to {str(output_root)}")
+
+    metadata_root = output_root / "metadata"
+    metadata_root.mkdir(parents=True, exist_ok=True)
+
+    connection = db.get_connection(
+        metadata_root / "timeline.db", connection_profile or db.ConnectionProfile()
+    )
+    cursor = connection.cursor()
+
+    if profile_path and (workers > 1 or file_timeout):
+        logger.warning(
+            "The files are processed by worker processes. The profiles won't include the file processors. "
+            "Use --workers 1 --file-timeout 0 to include them."
+        )
+
+    if regenerate:
+        first_day, last_day = regenerate
+        db.create_database(cursor)
+        db.mark_days_as_changed(
+            cursor,
+            [
+                (first_day + timedelta(days=x)).isoformat()
+                for x in range((last_day - first_day).days + 1)
+            ],
+        )
+
+    def update_timeline(changed_paths: set[Path] | None = None):
+        try:
+            build_timeline(changed_paths)
+        except BaseException:
+            connection.rollback()  # The committed files are not processed again
+            raise
+
+    def build_timeline(changed_paths: set[Path] | None = None):
+        run_stats = RunStats(
+            profile_path / datetime.now().strftime("%Y-%m-%d_%H%M%S") if profile_path else None,
+            trace_memory=trace_memory,
+        )
+        process_timeline_files(
+            cursor,
+            input_paths,
+            includerules,
+            ignorerules,
+            metadata_root,
+            full_rescan=full_rescan,
+            changed_paths=changed_paths,
+            hash_workers=hash_workers,
+            tree_hash=tree_hash,
+            fingerprint_min_size=fingerprint_min_size,
+            dedupe=dedupe is not None,
+            commit_every=commit_every,
+            commit_interval=commit_interval,
+            workers=workers,
+            run_stats=run_stats,
+            progress=progress,
+            progress_interval=progress_interval,
+            schedule=schedule,
+            reprocess=reprocess,
+            file_timeout=file_timeout,
+        )
+        generate_daily_entry_lists(
+            cursor,
+            output_root / "entries",
+            duplicates_per_path=dedupe == "per-path",
+            run_stats=run_stats,
+        )
+        with run_stats.measure("financial_report"):
+            generate_financial_report(cursor, output_root / "entries" / "finances.json")
+
+        # Files identified by a fingerprint already appear on the timeline.
+        # Their full checksum can be calculated afterwards.
+        with run_stats.measure("full_checksums") as measurement:
+            if full_checksum_count := db.fill_missing_full_checksums(
+                cursor, hash_workers, tree_hash=tree_hash
+            ):
+                logger.info(f"Calculated the full checksum of {full_checksum_count} files")
+            measurement.files += full_checksum_count
+
+        run_stats.log_summary()
+        (metadata_root / "run_report.json").write_text(json.dumps(run_stats.to_json_dict(), indent=2))
+        db.add_run(cursor, run_stats)
+        connection.commit()
+
+    # Start watching before the first run, so that no changes are missed
+    watcher = get_watcher(input_paths, includerules, ignorerules) if watch else None
+
+    copy_templates(output_root, site_url, google_maps_api_key, live_templates)
+    update_timeline()
     logger.info("Timeline generation done.")
+
+    if watcher:
+        # The periodic rescans catch the changes the watcher missed. They don't use the directory cache, because
+        # editing a file does not change the mtime of its directory.
+        full_rescan = True
+        reprocess = ()
+        watch_input_paths(watcher, update_timeline, watch_debounce, watch_rescan_interval)
@@ -57,3 +57,5 @@ class TimelineFile:
     date_added: datetime
     file_mtime: datetime
     size: int
+    device: int | None = None
+    inode: int | None = None
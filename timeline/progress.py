@@ -0,0 +1,152 @@
+"""
+Reports the progress of file processing
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+import logging
+import sys
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TypeProgress:
+    files: int = 0
+    bytes: int = 0
+    wall_time: float = 0
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressReporter:
+    """
+    Reports how many of the unprocessed files were processed, the throughput of each processor type and the ETA.
+
+    With mode="tty", a progress line is redrawn on the stream. With mode="log", a log record is written every
+    interval seconds. Its "progress" attribute has the same information, for structured log handlers. With
+    mode="none", only slow files are reported.
+
+    A file is slow if it takes more than slow_file_seconds, and more than slow_file_factor times the average time
+    of its processor type.
+    """
+
+    def __init__(
+        self,
+        total_files: int,
+        total_bytes: int,
+        mode: str = "log",
+        interval: float = 10,
+        slow_file_seconds: float = 5,
+        slow_file_factor: float = 10,
+        stream: TextIO = sys.stderr,
+    ):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.mode = mode
+        self.interval = interval if mode == "log" else 0.5
+        self.slow_file_seconds = slow_file_seconds
+        self.slow_file_factor = slow_file_factor
+        self.stream = stream
+
+        self.files = 0
+        self.bytes = 0
+        self.types: dict[str, TypeProgress] = {}
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+
+    def file_done(self, file_path: Path, size: int, file_type: str, wall_time: float):
+        """
+        Count a processed file. file_type is the name of its processor.
+        """
+        self.files += 1
+        self.bytes += size
+
+        type_progress = self.types.setdefault(file_type, TypeProgress())
+        average_time = type_progress.wall_time / type_progress.files if type_progress.files else 0
+        if wall_time >= self.slow_file_seconds and wall_time >= average_time * self.slow_file_factor:
+            if self.mode == "tty":
+                self.stream.write("\r\033[K")  # Don't write the warning after the progress line
+            logger.warning(
+                f"Slow file: {str(file_path)} took {wall_time:.1f}s. "
+                f"The average for {file_type} is {average_time:.1f}s."
+            )
+        type_progress.files += 1
+        type_progress.bytes += size
+        type_progress.wall_time += wall_time
+
+        if time.monotonic() - self.last_report_time >= self.interval:
+            self.report()
+
+    def file_skipped(self, size: int):
+        """
+        Count a file that did not need to be processed
+        """
+        self.total_files -= 1
+        self.total_bytes -= size
+
+    def get_progress(self) -> dict:
+        elapsed_time = max(time.monotonic() - self.start_time, 1e-9)
+        files_per_second = self.files / elapsed_time
+        remaining_files = self.total_files - self.files
+        return {
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "elapsed_time": elapsed_time,
+            "files_per_second": files_per_second,
+            "bytes_per_second": self.bytes / elapsed_time,
+            "eta": remaining_files / files_per_second if files_per_second else None,
+            "types": {
+                file_type: {
+                    "files": type_progress.files,
+                    "files_per_second": type_progress.files / elapsed_time,
+                    "bytes_per_second": type_progress.bytes / elapsed_time,
+                    "average_time": type_progress.wall_time / type_progress.files,
+                }
+                for file_type, type_progress in self.types.items()
+            },
+        }
+
+    def format_progress(self, progress: dict) -> str:
+        percent = progress["files"] / progress["total_files"] * 100 if progress["total_files"] else 100
+        eta = format_duration(progress["eta"]) if progress["eta"] is not None else "unknown"
+        types = ", ".join(
+            f"{file_type} {type_progress['files_per_second']:.1f}/s "
+            f"{type_progress['bytes_per_second'] / 1024 / 1024:.1f} MB/s"
+            for file_type, type_progress in sorted(progress["types"].items(), key=lambda item: -item[1]["files"])
+        )
+        return (
+            f"Processed {progress['files']}/{progress['total_files']} files ({percent:.1f}%), "
+            f"{progress['files_per_second']:.1f} files/s, {progress['bytes_per_second'] / 1024 / 1024:.1f} MB/s, "
+            f"ETA {eta}" + (f" [{types}]" if types else "")
+        )
+
+    def report(self):
+        self.last_report_time = time.monotonic()
+        if self.mode == "none":
+            return
+        progress = self.get_progress()
+        if self.mode == "tty":
+            self.stream.write("\r\033[K" + self.format_progress(progress))
+            self.stream.flush()
+        else:
+            logger.info(self.format_progress(progress), extra={"progress": progress})
+
+    def finish(self):
+        if self.files:
+            self.report()
+        if self.mode == "tty" and self.files:
+            self.stream.write("\n")
+            self.stream.flush()
@@ -0,0 +1,71 @@
+"""
+Decides in which order the unprocessed files are processed
+"""
+from timeline.file_processors.registry import FileProcessorRegistry
+from timeline.models import TimelineFile
+from typing import Callable
+
+
+# Rough processing cost of each processor: (seconds per file, seconds per MB)
+processor_costs = {
+    "process_video": (2, 0.05),
+    "process_pdf": (0.2, 0.01),
+    "process_image": (0.05, 0.02),
+    "process_calendar_db": (0.1, 0.01),
+    "process_google_location_history": (0.1, 0.05),
+    "process_gpx": (0.01, 0.05),
+}
+default_processor_cost = (0.005, 0.01)
+
+# Files processed by these processors are processed last with the "videos-last" policy
+slow_processors = {"process_video"}
+
+SCHEDULING_POLICIES = ("table", "cheap-first", "newest-first", "videos-last")
+
+
+def get_file_cost(file: TimelineFile, processors: list[Callable]) -> float:
+    """
+    Returns the estimated time it takes to process a file, in seconds.
+    """
+    size_mb = file.size / 1024 / 1024
+    return sum(
+        seconds_per_file + seconds_per_mb * size_mb
+        for seconds_per_file, seconds_per_mb in (
+            processor_costs.get(processor.__name__, default_processor_cost) for processor in processors
+        )
+    )
+
+
+def schedule_files(
+    files: list[TimelineFile], policies: list[str], registry: FileProcessorRegistry
+) -> list[TimelineFile]:
+    """
+    Sorts the files by the given policies. The first policy has the highest priority. Files that are equal for all
+    policies keep their order.
+
+    - table: keep the database order
+    - cheap-first: process the files with the lowest estimated cost first
+    - newest-first: process the files with the latest mtime first
+    - videos-last: process the files of slow_processors after all other files
+    """
+    sort_keys = []
+    for policy in policies:
+        if policy == "cheap-first":
+            sort_keys.append(lambda file, processors: get_file_cost(file, processors))
+        elif policy == "newest-first":
+            sort_keys.append(lambda file, processors: -file.file_mtime.timestamp())
+        elif policy == "videos-last":
+            sort_keys.append(
+                lambda file, processors: any(processor.__name__ in slow_processors for processor in processors)
+            )
+        elif policy != "table":
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+
+    if not sort_keys:
+        return files
+
+    def get_sort_key(file: TimelineFile):
+        processors = registry.get_processors(file.file_path)
+        return tuple(sort_key(file, processors) for sort_key in sort_keys)
+
+    return sorted(files, key=get_sort_key)
@@ -0,0 +1,173 @@
+"""
+Measures how much time each part of a timeline run takes
+"""
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+import cProfile
+import logging
+import time
+import tracemalloc
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Measurement:
+    wall_time: float = 0
+    cpu_time: float = 0
+    files: int = 0
+    bytes_read: int = 0
+    entries: int = 0
+
+    def add(self, other: 'Measurement'):
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+@contextmanager
+def measure(measurement: Measurement) -> Iterator[Measurement]:
+    """
+    Adds the wall time and the CPU time of the current process to the measurement.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield measurement
+    finally:
+        measurement.wall_time += time.perf_counter() - wall_start
+        measurement.cpu_time += time.process_time() - cpu_start
+
+
+class RunStats:
+    """
+    The measurements of each phase of a run, and of each file processor.
+
+    The CPU time of a phase only includes the main process. The file processors are measured in the process that
+    runs them.
+
+    If profile_path is set, each phase is also profiled with cProfile, and the stats are saved to
+    profile_path/<phase>.pstats. If trace_memory is also set, a tracemalloc snapshot of each phase is saved to
+    profile_path/<phase>.tracemalloc, and the top allocators are logged. Phases inside another phase are part of
+    the outer phase's profile.
+    """
+
+    def __init__(self, profile_path: Path | None = None, trace_memory: bool = False):
+        self.date_started = datetime.now().astimezone()
+        self.wall_start = time.perf_counter()
+        self.phases: dict[str, Measurement] = {}
+        self.processors: dict[str, Measurement] = {}
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.profiling = False
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[Measurement]:
+        with measure(self.phases.setdefault(phase, Measurement())) as measurement:
+            if self.profile_path and not self.profiling:
+                with self.profile(phase):
+                    yield measurement
+            else:
+                yield measurement
+
+    @contextmanager
+    def profile(self, phase: str):
+        self.profiling = True
+        profile = self.profiles.setdefault(phase, cProfile.Profile())
+        if self.trace_memory:
+            tracemalloc.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.profiling = False
+            self.profile_path.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(self.profile_path / f"{phase}.pstats")
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)]
+                )
+                peak_size = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                snapshot.dump(str(self.profile_path / f"{phase}.tracemalloc"))
+                logger.info(f"Memory allocated by {phase}: {peak_size / 1024 / 1024:.1f} MB at the peak. Top allocators:")
+                for statistic in snapshot.statistics("lineno")[:10]:
+                    logger.info(f"  {statistic}")
+
+    def add_processor_measurements(self, measurements: dict[str, Measurement]):
+        for processor_name, measurement in measurements.items():
+            self.processors.setdefault(processor_name, Measurement()).add(measurement)
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.wall_start
+
+    def to_json_dict(self) -> dict:
+        return {
+            "date_started": self.date_started.isoformat(),
+            "duration": self.duration,
+            "phases": {name: asdict(measurement) for name, measurement in self.phases.items()},
+            "processors": {name: asdict(measurement) for name, measurement in self.processors.items()},
+        }
+
+    def log_summary(self):
+        phases = sorted(self.phases.items(), key=lambda item: -item[1].wall_time)
+        logger.info(
+            f"Run took {self.duration:.1f}s: "
+            + ", ".join(f"{name} {measurement.wall_time:.2f}s" for name, measurement in phases)
+        )
+        for name, measurement in sorted(self.processors.items(), key=lambda item: -item[1].wall_time):
+            logger.info(
+                f"{name}: {measurement.wall_time:.2f}s wall, {measurement.cpu_time:.2f}s CPU, "
+                f"{measurement.files} files, {measurement.bytes_read / 1024 / 1024:.1f} MB, "
+                f"{measurement.entries} entries"
+            )
+
+
+def format_run_history(reports: list[dict]) -> str:
+    """
+    Returns a table of the wall time of each phase, with one run per line, and a table of the time spent in each
+    file processor during those runs.
+    """
+    phase_names = list(dict.fromkeys(name for report in reports for name in report["phases"]))
+    rows = [["Date", "Duration", *phase_names]]
+    for report in reports:
+        rows.append([
+            datetime.fromisoformat(report["date_started"]).strftime("%Y-%m-%d %H:%M"),
+            f"{report['duration']:.1f}s",
+            *[
+                f"{report['phases'][name]['wall_time']:.1f}s" if name in report["phases"] else "-"
+                for name in phase_names
+            ],
+        ])
+
+    processors: dict[str, Measurement] = {}
+    for report in reports:
+        for name, measurement in report["processors"].items():
+            processors.setdefault(name, Measurement()).add(Measurement(**measurement))
+    processor_rows = [["Processor", "Files", "MB", "Entries", "Wall time", "CPU time", "Per file"]]
+    for name, measurement in sorted(processors.items(), key=lambda item: -item[1].wall_time):
+        processor_rows.append([
+            name,
+            str(measurement.files),
+            f"{measurement.bytes_read / 1024 / 1024:.1f}",
+            str(measurement.entries),
+            f"{measurement.wall_time:.1f}s",
+            f"{measurement.cpu_time:.1f}s",
+            f"{measurement.wall_time / measurement.files * 1000:.0f}ms" if measurement.files else "-",
+        ])
+
+    return format_table(rows) + "\n\n" + format_table(processor_rows)
+
+
+def format_table(rows: list[list[str]]) -> str:
+    column_widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(row, column_widths)).rstrip()
+        for row in rows
+    )
@@ -6,19 +6,52 @@ from timeline.database import (
     apply_cached_checksums_to_found_files,
     commit_found_files,
     fill_missing_found_file_checksums,
+    fill_missing_full_checksums,
     add_timeline_entries,
     update_timeline_entries_for_file,
     mark_timeline_file_as_processed,
     dates_with_changes,
+    clear_dates_with_changes,
+    get_change_watermark,
+    mark_days_as_changed,
     get_entries_for_date,
-    to_db_datetime,
+    get_entries_for_dates,
+    get_entry_days,
+    get_entry_hash,
+    get_original_file,
+    mark_timeline_file_as_duplicate,
+    reset_duplicate_files,
+    get_directory_cache,
+    save_directory_cache,
+    get_schema_version,
+    migrations,
+    ConnectionProfile,
+    get_database_size,
+    optimize_database,
+    to_db_timestamp,
+    datetime_from_db,
+    add_run,
+    get_run_reports,
+    get_processed_files,
+    mark_files_as_unprocessed,
+    get_processor_versions,
+    save_processor_versions,
+    add_file_failure,
+    clear_file_failure,
+    get_file_failures,
+    get_unprocessed_timeline_files,
 )
-from timeline.filesystem import get_checksum
+from timeline.filesystem import get_checksum, get_fingerprint
 from timeline.models import TimelineEntry, TimelineFile, EntryType
-from datetime import date, datetime, timedelta
+from timeline.stats import RunStats
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone
+import ctypes
+import ctypes.util
 import json
 import pytest
 import sqlite3
+import timeline.filesystem
 
 
 def fake_found_files(tmp_path):
@@ -121,9 +154,9 @@ def test_add_found_files(cursor, tmp_path):
         assert row == (
             str(found_files[index].file_path),
             found_files[index].checksum,
-            to_db_datetime(found_files[index].date_added),
+            to_db_timestamp(found_files[index].date_added),
             found_files[index].size,
-            to_db_datetime(found_files[index].file_mtime),
+            to_db_timestamp(found_files[index].file_mtime),
         )
 
 
@@ -194,6 +227,85 @@ def test_fill_missing_found_file_checksums(cursor, tmp_path):
     )
 
 
+def test_fill_missing_found_file_checksums_in_batches(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    cursor.execute("UPDATE found_files SET checksum=NULL")
+    file_count, bytes_read = fill_missing_found_file_checksums(cursor, hash_workers=3, batch_size=2)
+    assert file_count == len(found_files)
+
+    cursor.execute("SELECT file_path, checksum FROM found_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [(str(file.file_path), file.checksum) for file in found_files]
+    )
+
+
+def test_fill_missing_found_file_checksums_removed_file(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    cursor.execute("UPDATE found_files SET checksum=NULL")
+    found_files[1].file_path.unlink()
+
+    file_count, bytes_read = fill_missing_found_file_checksums(cursor)
+    assert file_count == 2
+    cursor.execute("SELECT file_path, checksum FROM found_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [(str(file.file_path), file.checksum) for file in [found_files[0], found_files[2]]]
+    )
+
+
+def test_fill_missing_found_file_checksums_tree_hash(cursor, tmp_path, monkeypatch):
+    monkeypatch.setattr(timeline.filesystem, "TREE_HASH_CHUNK_SIZE", 4)
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files[:1])
+    commit_found_files(cursor)
+
+    # Files that already have a checksum are hashed the same way as before
+    add_found_files(cursor, found_files)
+    cursor.execute("UPDATE found_files SET checksum=NULL")
+    fill_missing_found_file_checksums(cursor, tree_hash=True)
+
+    cursor.execute("SELECT file_path, checksum FROM found_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [
+            (str(found_files[0].file_path), found_files[0].checksum),
+            (str(found_files[1].file_path), get_checksum(found_files[1].file_path, tree_hash=True)),
+            (str(found_files[2].file_path), get_checksum(found_files[2].file_path, tree_hash=True)),
+        ]
+    )
+    assert get_checksum(found_files[1].file_path, tree_hash=True).startswith("t")
+
+
+def test_fill_missing_found_file_checksums_fingerprint(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    cursor.execute("UPDATE found_files SET checksum=NULL")
+
+    # Only the files with at least 20 bytes get a fingerprint
+    fill_missing_found_file_checksums(cursor, fingerprint_min_size=20)
+    cursor.execute("SELECT file_path, checksum, full_checksum FROM found_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [
+            (str(found_files[0].file_path), found_files[0].checksum, found_files[0].checksum),
+            (str(found_files[1].file_path), get_fingerprint(found_files[1].file_path, 22), None),
+            (str(found_files[2].file_path), get_fingerprint(found_files[2].file_path, 33), None),
+        ]
+    )
+
+    # The full checksums are calculated later
+    commit_found_files(cursor)
+    assert fill_missing_full_checksums(cursor) == 2
+    cursor.execute("SELECT file_path, checksum, full_checksum FROM timeline_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [
+            (str(found_files[0].file_path), found_files[0].checksum, found_files[0].checksum),
+            (str(found_files[1].file_path), get_fingerprint(found_files[1].file_path, 22), found_files[1].checksum),
+            (str(found_files[2].file_path), get_fingerprint(found_files[2].file_path, 33), found_files[2].checksum),
+        ]
+    )
+    assert fill_missing_full_checksums(cursor) == 0
+
+
 def test_commit_found_files(cursor, tmp_path):
     found_files = list(fake_found_files(tmp_path))
 
@@ -207,7 +319,7 @@ def test_commit_found_files(cursor, tmp_path):
             (
                 str(file.file_path),
                 file.size,
-                to_db_datetime(file.file_mtime),
+                to_db_timestamp(file.file_mtime),
                 file.checksum,
                 None,
             )
@@ -218,6 +330,26 @@ def test_commit_found_files(cursor, tmp_path):
     assert_result_count(cursor, "SELECT COUNT(*) FROM found_files", 0)
 
 
+def test_commit_found_files_unchanged(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+
+    # Unchanged files keep their date_added. Only the changed file is updated.
+    date_added = found_files[0].date_added + timedelta(hours=1)
+    new_found_files = [replace(file, date_added=date_added) for file in found_files]
+    new_found_files[1] = replace(new_found_files[1], file_mtime=date_added)
+    add_found_files(cursor, new_found_files)
+    commit_found_files(cursor)
+
+    cursor.execute("SELECT file_path, date_added, file_mtime FROM timeline_files")
+    assert sorted(cursor.fetchall()) == sorted([
+        (str(found_files[0].file_path), to_db_timestamp(found_files[0].date_added), to_db_timestamp(found_files[0].file_mtime)),
+        (str(found_files[1].file_path), to_db_timestamp(date_added), to_db_timestamp(date_added)),
+        (str(found_files[2].file_path), to_db_timestamp(found_files[2].date_added), to_db_timestamp(found_files[2].file_mtime)),
+    ])
+
+
 def test_commit_found_files_handle_removed(cursor, tmp_path):
     found_files = list(fake_found_files(tmp_path))
 
@@ -231,7 +363,7 @@ def test_commit_found_files_handle_removed(cursor, tmp_path):
             (
                 str(file.file_path),
                 file.size,
-                to_db_datetime(file.file_mtime),
+                to_db_timestamp(file.file_mtime),
                 file.checksum,
                 None,
             )
@@ -253,7 +385,7 @@ def test_commit_found_files_handle_removed(cursor, tmp_path):
             (
                 str(file.file_path),
                 file.size,
-                to_db_datetime(file.file_mtime),
+                to_db_timestamp(file.file_mtime),
                 file.checksum,
                 None,
             )
@@ -289,7 +421,7 @@ def test_commit_found_files_handle_existing_checksum(cursor, tmp_path):
             (
                 str(file.file_path),
                 file.size,
-                to_db_datetime(file.file_mtime) if file.file_mtime else None,
+                to_db_timestamp(file.file_mtime) if file.file_mtime else None,
                 file.checksum,
                 None,
             )
@@ -306,8 +438,8 @@ def test_commit_found_files_handle_existing_checksum(cursor, tmp_path):
             (
                 str(entry.file_path),
                 entry.entry_type.value,
-                to_db_datetime(entry.date_start),
-                to_db_datetime(entry.date_end) if entry.date_end else None,
+                to_db_timestamp(entry.date_start),
+                to_db_timestamp(entry.date_end) if entry.date_end else None,
                 json.dumps(entry.data),
             )
             for entry in timeline_entries
@@ -357,7 +489,7 @@ def test_commit_found_files_handle_new_checksum(cursor, tmp_path):
             (
                 str(file.file_path),
                 file.size,
-                to_db_datetime(file.file_mtime),
+                to_db_timestamp(file.file_mtime),
                 file.checksum,
                 None,
             )
@@ -382,7 +514,7 @@ def test_commit_found_files_reset_date_processed(cursor, tmp_path):
     commit_found_files(cursor)
 
     # Mark all as processed
-    date_processed = datetime.now() - timedelta(days=7)
+    date_processed = to_db_timestamp(datetime.now() - timedelta(days=7))
     cursor.execute("UPDATE timeline_files SET date_processed=?", [date_processed])
 
     # Pretend that found_files[0] was updated and has a new checksum
@@ -408,6 +540,25 @@ def test_commit_found_files_reset_date_processed(cursor, tmp_path):
     )
 
 
+def test_commit_found_files_scope(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+
+    # Only file_a and file_b were scanned. file_b is gone. file_c is out of scope.
+    add_found_files(cursor, found_files[:1])
+    commit_found_files(cursor, scope=[found_files[0].file_path, found_files[1].file_path])
+
+    cursor.execute("SELECT file_path FROM timeline_files")
+    assert sorted(cursor.fetchall()) == sorted(
+        [(str(found_files[0].file_path),), (str(found_files[2].file_path),)]
+    )
+
+    # Directories include the files inside them
+    commit_found_files(cursor, scope=[tmp_path])
+    assert_result_count(cursor, "SELECT COUNT(*) FROM timeline_files", 0)
+
+
 def test_add_timeline_entries(cursor, tmp_path):
     found_files = fake_found_files(tmp_path)
     timeline_entries = fake_timeline_entries(tmp_path)
@@ -423,8 +574,8 @@ def test_add_timeline_entries(cursor, tmp_path):
         assert row == (
             str(timeline_entries[index].file_path),
             timeline_entries[index].entry_type.value,
-            to_db_datetime(timeline_entries[index].date_start),
-            to_db_datetime(timeline_entries[index].date_end)
+            to_db_timestamp(timeline_entries[index].date_start),
+            to_db_timestamp(timeline_entries[index].date_end)
             if timeline_entries[index].date_end
             else None,
             json.dumps(timeline_entries[index].data),
@@ -473,6 +624,41 @@ def test_dates_with_changes(cursor, tmp_path):
         assert (now - ts).total_seconds() < 5
 
 
+def test_dates_with_changes_committed(tmp_path):
+    # Changes committed by an interrupted run are still there in the next run
+    connection = get_connection(tmp_path / "database.db")
+    create_database(connection)
+    add_found_files(connection, fake_found_files(tmp_path))
+    commit_found_files(connection)
+    update_timeline_entries_for_file(
+        connection.cursor(), tmp_path / "file_a.text", fake_timeline_entries(tmp_path)[:1]
+    )
+    connection.commit()
+    connection.close()
+
+    connection = get_connection(tmp_path / "database.db")
+    create_database(connection)
+    assert set(dates_with_changes(connection).keys()) == {
+        date(2023, 7, 1),
+        date(2023, 7, 2),
+        date(2023, 7, 3),
+        date(2023, 7, 4),
+    }
+    connection.close()
+
+
+def test_clear_dates_with_changes(cursor, tmp_path):
+    mark_days_as_changed(cursor, ["2023-07-01", "2023-07-02"])
+    watermark = get_change_watermark(cursor)
+    assert set(dates_with_changes(cursor, watermark).keys()) == {date(2023, 7, 1), date(2023, 7, 2)}
+
+    # A day that changed again after the watermark is not cleared
+    mark_days_as_changed(cursor, ["2023-07-02", "2023-07-03"])
+    assert set(dates_with_changes(cursor, watermark).keys()) == {date(2023, 7, 1)}
+    clear_dates_with_changes(cursor, [date(2023, 7, 1), date(2023, 7, 2)], watermark)
+    assert set(dates_with_changes(cursor).keys()) == {date(2023, 7, 2), date(2023, 7, 3)}
+
+
 def test_dates_with_changes_deleted_entries(cursor, tmp_path):
     found_files = list(fake_found_files(tmp_path))
     timeline_entries = fake_timeline_entries(tmp_path)
@@ -533,6 +719,7 @@ def test_get_entries_for_date(cursor, tmp_path):
 
     entries_2023_07_01 = list(get_entries_for_date(cursor, date(2023, 7, 1)))
     assert len(entries_2023_07_01) == 1
+    assert 'date_start' not in vars(entries_2023_07_01[0])  # The dates are converted when they are used
     assert entries_2023_07_01[0].date_start == timeline_entries[0].date_start
     assert entries_2023_07_01[0].date_end == timeline_entries[0].date_end
 
@@ -548,3 +735,519 @@ def test_get_entries_for_date(cursor, tmp_path):
     assert entries_2023_07_10[0].date_end == timeline_entries[2].date_end
 
     assert list(get_entries_for_date(cursor, date(2023, 7, 11))) == []
+
+
+def add_duplicate_files(cursor, tmp_path) -> list[TimelineFile]:
+    # file_d is a copy of file_a
+    found_files = list(fake_found_files(tmp_path))
+    duplicate_path = tmp_path / "file_d.text"
+    duplicate_path.write_bytes(found_files[0].file_path.read_bytes())
+    found_files.append(replace(found_files[0], file_path=duplicate_path))
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    add_timeline_entries(cursor, fake_timeline_entries(tmp_path))
+    mark_timeline_file_as_processed(cursor, found_files[0].file_path)
+    return found_files
+
+
+def test_mark_timeline_file_as_duplicate(cursor, tmp_path):
+    found_files = add_duplicate_files(cursor, tmp_path)
+    duplicate = found_files[3]
+
+    assert get_original_file(cursor, found_files[0]) is None  # A file is not its own duplicate
+    assert get_original_file(cursor, found_files[1]) is None
+    assert get_original_file(cursor, duplicate) == found_files[0].file_path
+
+    clear_table(cursor, "dates_with_changes")
+    mark_timeline_file_as_duplicate(cursor, duplicate.file_path, found_files[0].file_path)
+    assert_result_count(
+        cursor, "SELECT COUNT(*) FROM timeline_files WHERE date_processed IS NULL", 2
+    )
+    assert set(dates_with_changes(cursor).keys()) == {
+        date(2023, 7, day) for day in (1, 2, 3, 4)
+    }
+
+    # Duplicates are shown once, or once per path
+    assert [e.file_path for e in get_entries_for_date(cursor, date(2023, 7, 2))] == [
+        found_files[0].file_path
+    ]
+    assert sorted(
+        e.file_path for e in get_entries_for_date(cursor, date(2023, 7, 2), duplicates_per_path=True)
+    ) == [found_files[0].file_path, duplicate.file_path]
+
+    reset_duplicate_files(cursor)
+    assert_result_count(
+        cursor, "SELECT COUNT(*) FROM timeline_files WHERE date_processed IS NULL", 3
+    )
+
+
+def test_mark_timeline_file_as_duplicate_deletes_entries(cursor, tmp_path):
+    found_files = add_duplicate_files(cursor, tmp_path)
+    duplicate = found_files[3]
+
+    # The file had other entries before it became a duplicate
+    add_timeline_entries(cursor, [
+        TimelineEntry(
+            file_path=duplicate.file_path,
+            checksum="improperly mocked value",
+            entry_type=EntryType.TEXT,
+            date_start=datetime(2023, 8, 1).astimezone(),
+            date_end=None,
+            data={},
+        ),
+    ])
+    mark_timeline_file_as_processed(cursor, duplicate.file_path)
+
+    clear_table(cursor, "dates_with_changes")
+    mark_timeline_file_as_duplicate(cursor, duplicate.file_path, found_files[0].file_path)
+    assert set(dates_with_changes(cursor).keys()) == {
+        date(2023, 7, day) for day in (1, 2, 3, 4)
+    } | {date(2023, 8, 1)}
+    assert list(get_entries_for_date(cursor, date(2023, 8, 1))) == []
+
+
+def test_commit_found_files_original_deleted(cursor, tmp_path):
+    found_files = add_duplicate_files(cursor, tmp_path)
+    mark_timeline_file_as_duplicate(cursor, found_files[3].file_path, found_files[0].file_path)
+
+    # The duplicate of a deleted file is processed again
+    clear_table(cursor, "found_files")
+    add_found_files(cursor, found_files[1:])
+    commit_found_files(cursor)
+    cursor.execute(
+        "SELECT duplicate_of, date_processed FROM timeline_files WHERE file_path=?",
+        [str(found_files[3].file_path)],
+    )
+    assert cursor.fetchall() == [(None, None)]
+
+
+def test_entry_days(cursor, tmp_path):
+    found_files = fake_found_files(tmp_path)
+    timeline_entries = fake_timeline_entries(tmp_path)
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    add_timeline_entries(cursor, timeline_entries)
+
+    cursor.execute("SELECT day, COUNT(*) FROM entry_days GROUP BY day")
+    assert cursor.fetchall() == [
+        ("2023-07-01", 1),
+        ("2023-07-02", 1),
+        ("2023-07-03", 2),
+        ("2023-07-04", 1),
+        ("2023-07-07", 1),
+        ("2023-07-08", 1),
+        ("2023-07-09", 1),
+        ("2023-07-10", 1),
+    ]
+
+    # Replaced entries are removed from entry_days
+    update_timeline_entries_for_file(cursor, tmp_path / "file_b.text", timeline_entries[1:2])
+    cursor.execute("SELECT DISTINCT day FROM entry_days")
+    assert [row[0] for row in cursor.fetchall()] == [
+        "2023-07-01", "2023-07-02", "2023-07-03", "2023-07-04"
+    ]
+
+
+def test_update_timeline_entries_for_file_unchanged_entries(cursor, tmp_path):
+    found_files = fake_found_files(tmp_path)
+    timeline_entries = fake_timeline_entries(tmp_path)
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    file_b = tmp_path / "file_b.text"
+    update_timeline_entries_for_file(cursor, file_b, timeline_entries[1:])
+    entry_ids = cursor.execute("SELECT entry_id FROM timeline_entries").fetchall()
+    clear_table(cursor, "dates_with_changes")
+
+    # The same entries, twice. Nothing changes.
+    update_timeline_entries_for_file(cursor, file_b, timeline_entries[1:] * 2)
+    assert cursor.execute("SELECT entry_id FROM timeline_entries").fetchall() == entry_ids
+    assert dates_with_changes(cursor) == {}
+
+    # One entry changed. Only its days changed.
+    moved_entry = replace(timeline_entries[2], date_start=datetime(2023, 7, 11).astimezone(), date_end=None)
+    update_timeline_entries_for_file(cursor, file_b, [timeline_entries[1], moved_entry])
+    assert cursor.execute("SELECT entry_id FROM timeline_entries").fetchall()[0] == entry_ids[0]
+    assert set(dates_with_changes(cursor).keys()) == {
+        date(2023, 7, day) for day in (7, 8, 9, 10, 11)
+    }
+
+
+def test_update_timeline_entries_for_file_in_batches(cursor, tmp_path):
+    found_files = fake_found_files(tmp_path)
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    file_b = tmp_path / "file_b.text"
+
+    def entries(days):
+        for day in days:
+            yield TimelineEntry(
+                file_path=file_b,
+                checksum="improperly mocked value",
+                entry_type=EntryType.TEXT,
+                date_start=datetime(2023, 7, day).astimezone(),
+                date_end=None,
+                data={},
+            )
+
+    # The same entry in two batches is only added once
+    assert update_timeline_entries_for_file(cursor, file_b, entries([1, 2, 3, 1, 4]), batch_size=2) == 5
+    assert_result_count(cursor, "SELECT COUNT(*) FROM timeline_entries", 4)
+    assert_result_count(cursor, "SELECT COUNT(*) FROM entry_days", 4)
+    assert set(dates_with_changes(cursor).keys()) == {date(2023, 7, day) for day in (1, 2, 3, 4)}
+    clear_table(cursor, "dates_with_changes")
+
+    assert update_timeline_entries_for_file(cursor, file_b, entries([2, 3, 4, 5]), batch_size=3) == 4
+    assert_result_count(cursor, "SELECT COUNT(*) FROM timeline_entries", 4)
+    assert set(dates_with_changes(cursor).keys()) == {date(2023, 7, 1), date(2023, 7, 5)}
+    assert_result_count(cursor, "SELECT COUNT(*) FROM staged_entries", 0)
+
+
+def get_sqlite_memory_peak(tmp_path, entry_count: int) -> int:
+    """
+    Returns how much memory sqlite used at the peak while the entries of a file were updated, in bytes.
+    """
+    sqlite_library = ctypes.CDLL(ctypes.util.find_library("sqlite3"))
+    sqlite_library.sqlite3_memory_used.restype = ctypes.c_int64
+    sqlite_library.sqlite3_memory_highwater.restype = ctypes.c_int64
+    sqlite_library.sqlite3_memory_highwater.argtypes = [ctypes.c_int]
+
+    db_path = tmp_path / f"{entry_count}.db"
+    connection = get_connection(db_path, ConnectionProfile())
+    connection.execute("PRAGMA cache_size = -256")  # 256 KiB
+    cursor = connection.cursor()
+    create_database(cursor)
+    cursor.execute(
+        "INSERT INTO timeline_files (file_path, checksum, date_added, file_mtime, size) VALUES (?, '', 0, 0, 0)",
+        [str(db_path)],
+    )
+    date_start = datetime(2023, 7, 1).astimezone()
+    entries = (
+        TimelineEntry(
+            file_path=db_path,
+            checksum="improperly mocked value",
+            entry_type=EntryType.GEOLOCATION,
+            date_start=date_start + timedelta(seconds=index),
+            date_end=None,
+            data={},
+        )
+        for index in range(entry_count)
+    )
+
+    memory_before = sqlite_library.sqlite3_memory_used()
+    sqlite_library.sqlite3_memory_highwater(1)  # Reset the peak
+    update_timeline_entries_for_file(cursor, db_path, entries, batch_size=1000)
+    memory_peak = sqlite_library.sqlite3_memory_highwater(1) - memory_before
+    connection.close()
+    return memory_peak
+
+
+def test_update_timeline_entries_for_file_memory(tmp_path):
+    # The memory used by sqlite doesn't grow with the number of entries
+    if not ctypes.util.find_library("sqlite3"):
+        pytest.skip("The sqlite3 library can't be loaded with ctypes")
+    small_file_peak = get_sqlite_memory_peak(tmp_path, 10000)
+    large_file_peak = get_sqlite_memory_peak(tmp_path, 40000)
+    assert large_file_peak - small_file_peak < 200 * 1024  # Staging the hashes in memory would add 750 KB
+
+
+def test_get_entries_for_dates(cursor, tmp_path):
+    found_files = fake_found_files(tmp_path)
+    timeline_entries = fake_timeline_entries(tmp_path)
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    add_timeline_entries(cursor, timeline_entries)
+
+    entries_by_day = {
+        day: sorted(e.date_start for e in entries)
+        for day, entries in get_entries_for_dates(
+            cursor, [date(2023, 7, 3), date(2023, 7, 5), date(2023, 7, 10)]
+        )
+    }
+    assert entries_by_day == {
+        date(2023, 7, 3): [timeline_entries[0].date_start, timeline_entries[1].date_start],
+        date(2023, 7, 10): [timeline_entries[2].date_start],
+    }
+
+
+def test_create_database_old_schema(tmp_path):
+    connection = get_connection(tmp_path / "database.db")
+    connection.execute("""
+        CREATE TABLE timeline_files (
+            file_path TEXT PRIMARY KEY NOT NULL,
+            size INTEGER,
+            date_added TIMESTAMP NOT NULL,
+            date_processed TIMESTAMP,
+            file_mtime TIMESTAMP,
+            checksum TEXT
+        );
+    """)
+    connection.execute(
+        "INSERT INTO timeline_files (file_path, date_added, checksum) VALUES ('/test.txt', '2023-01-01', 'ABC')"
+    )
+    create_database(connection)
+    assert connection.execute("SELECT checksum, full_checksum FROM timeline_files").fetchall() == [("ABC", "ABC")]
+    connection.close()
+
+
+def test_create_database_migrations(tmp_path):
+    connection = get_connection(tmp_path / "database.db")
+    connection.execute("""
+        CREATE TABLE timeline_files (
+            file_path TEXT PRIMARY KEY NOT NULL,
+            size INTEGER,
+            date_added TIMESTAMP NOT NULL,
+            date_processed TIMESTAMP,
+            file_mtime TIMESTAMP,
+            checksum TEXT
+        );
+    """)
+    connection.execute("""
+        CREATE TABLE timeline_entries (
+            file_path TEXT NOT NULL REFERENCES timeline_files (file_path) ON DELETE CASCADE,
+            entry_type TEXT NOT NULL,
+            date_start TIMESTAMP NOT NULL,
+            date_end TIMESTAMP,
+            entry_data TEXT NOT NULL
+        );
+    """)
+    connection.execute(
+        "INSERT INTO timeline_files (file_path, date_added, checksum) VALUES ('/test.txt', '2023-01-01', 'ABC')"
+    )
+    connection.execute("""
+        INSERT INTO timeline_entries (file_path, entry_type, date_start, entry_data)
+        VALUES ('/test.txt', 'text', '2023-01-01', '{}')
+    """)
+    connection.commit()
+    assert get_schema_version(connection) == 0
+
+    create_database(connection)
+    assert get_schema_version(connection) == len(migrations)
+    assert connection.execute(
+        "SELECT entry_id, file_path, entry_type FROM timeline_entries"
+    ).fetchall() == [(1, "/test.txt", "text")]
+    # Timestamps are converted from ISO strings in UTC
+    date_start = to_db_timestamp(datetime(2023, 1, 1, tzinfo=timezone.utc))
+    assert connection.execute("SELECT date_start, entry_hash FROM timeline_entries").fetchall() == [
+        (date_start, get_entry_hash("text", date_start, None, "{}"))
+    ]
+    assert connection.execute("SELECT date_added FROM timeline_files").fetchall() == [(date_start,)]
+    assert connection.execute("SELECT day, entry_id FROM entry_days").fetchall() == [
+        (day, 1) for day in get_entry_days(date_start, None)
+    ]
+    query_plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM timeline_entries WHERE file_path='/test.txt'"
+    ).fetchall()
+    assert "USING INDEX timeline_entries_file_path" in query_plan[0][3]
+
+    # The migrations are only applied once
+    create_database(connection)
+    assert get_schema_version(connection) == len(migrations)
+    connection.close()
+
+
+def test_create_database_newer_schema(tmp_path):
+    connection = get_connection(tmp_path / "database.db")
+    connection.execute(f"PRAGMA user_version = {len(migrations) + 1}")
+    with pytest.raises(ValueError):
+        create_database(connection)
+    connection.close()
+
+
+def test_save_directory_cache(cursor, tmp_path):
+    directory_cache = {
+        str(tmp_path): (1234, ["logs"], [("hello.txt", 11, 1700000000.5, 2049, 2**63 + 1)]),
+        str(tmp_path / "logs"): (5678, [], []),
+    }
+    save_directory_cache(cursor, directory_cache)
+    assert get_directory_cache(cursor) == directory_cache
+
+    save_directory_cache(cursor, {str(tmp_path): (1234, [], [])})
+    assert get_directory_cache(cursor) == {str(tmp_path): (1234, [], [])}
+
+
+def test_save_directory_cache_changed_directories(cursor, tmp_path):
+    directory_cache = {
+        str(tmp_path): (1234, ["logs", "photos"], [("hello.txt", 11, 1700000000.5, 2049, 1)]),
+        str(tmp_path / "logs"): (5678, [], []),
+        str(tmp_path / "photos"): (9012, [], []),
+    }
+    save_directory_cache(cursor, directory_cache)
+
+    saved_directory_cache = get_directory_cache(cursor)
+    new_directory_cache = {
+        str(tmp_path): (4321, ["logs", "videos"], [("hello.txt", 11, 1700000000.5, 2049, 1)]),
+        str(tmp_path / "logs"): saved_directory_cache[str(tmp_path / "logs")],
+        str(tmp_path / "videos"): (3456, [], []),
+    }
+    changes_before = cursor.connection.total_changes
+    save_directory_cache(cursor, new_directory_cache, saved_directory_cache)
+
+    # The unchanged directory is not written again
+    assert cursor.connection.total_changes - changes_before == 3
+    assert get_directory_cache(cursor) == new_directory_cache
+
+
+def test_get_directory_cache_old_format(cursor, tmp_path):
+    # Listings without the device and inode are ignored
+    save_directory_cache(cursor, {
+        str(tmp_path): (1234, ["logs"], [("hello.txt", 11, 1700000000.5)]),
+        str(tmp_path / "logs"): (5678, [], []),
+    })
+    assert get_directory_cache(cursor) == {str(tmp_path / "logs"): (5678, [], [])}
+
+
+def moved_file(file: TimelineFile, new_path) -> TimelineFile:
+    file.file_path.rename(new_path)
+    return replace(file, file_path=new_path, checksum=None)
+
+
+def test_apply_cached_checksums_to_found_files_moved(cursor, tmp_path):
+    found_files = [
+        replace(file, device=1, inode=2**64 - index - 1)
+        for index, file in enumerate(fake_found_files(tmp_path))
+    ]
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+
+    (tmp_path / "moved").mkdir()
+    found_files = [moved_file(file, tmp_path / "moved" / file.file_path.name) for file in found_files]
+    found_files[1] = replace(found_files[1], inode=123)  # Not the same file
+    add_found_files(cursor, found_files)
+    apply_cached_checksums_to_found_files(cursor)
+
+    cursor.execute("SELECT file_path, checksum FROM found_files")
+    assert sorted(cursor.fetchall()) == [
+        (str(tmp_path / "moved/file_a.text"), get_checksum(found_files[0].file_path)),
+        (str(tmp_path / "moved/file_b.text"), None),
+        (str(tmp_path / "moved/file_c.text"), get_checksum(found_files[2].file_path)),
+    ]
+
+
+def test_commit_found_files_moved(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    add_timeline_entries(cursor, fake_timeline_entries(tmp_path))
+    mark_timeline_file_as_processed(cursor, found_files[0].file_path)
+    mark_timeline_file_as_processed(cursor, found_files[1].file_path)
+    clear_table(cursor, "dates_with_changes")
+
+    # file_a is moved, file_b is renamed
+    (tmp_path / "moved").mkdir()
+    found_files = [
+        moved_file(found_files[0], tmp_path / "moved/file_a.text"),
+        moved_file(found_files[1], tmp_path / "file_b_renamed.text"),
+        found_files[2],
+    ]
+    add_found_files(cursor, found_files)
+    fill_missing_found_file_checksums(cursor)
+    commit_found_files(cursor)
+
+    # The moved file keeps its entries, and does not need to be processed again
+    cursor.execute(
+        "SELECT file_path, date_processed IS NOT NULL FROM timeline_files ORDER BY file_path"
+    )
+    assert cursor.fetchall() == [
+        (str(tmp_path / "file_b_renamed.text"), False),
+        (str(tmp_path / "file_c.text"), False),
+        (str(tmp_path / "moved/file_a.text"), True),
+    ]
+    cursor.execute("SELECT file_path, entry_type FROM timeline_entries")
+    assert cursor.fetchall() == [(str(tmp_path / "moved/file_a.text"), "image")]
+
+    # The days of the moved and deleted entries changed
+    assert set(dates_with_changes(cursor).keys()) == {
+        date(2023, 7, day) for day in (1, 2, 3, 4, 7, 8, 9, 10)
+    }
+
+
+def test_get_connection_profile(tmp_path):
+    connection = get_connection(tmp_path / "database.db", ConnectionProfile(cache_size_mb=8, mmap_size_mb=16))
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert connection.execute("PRAGMA synchronous").fetchone() == (1,)  # NORMAL
+    assert connection.execute("PRAGMA cache_size").fetchone() == (-8 * 1024,)
+    assert connection.execute("PRAGMA mmap_size").fetchone() == (16 * 1024 * 1024,)
+    assert connection.execute("PRAGMA temp_store").fetchone() == (2,)  # MEMORY
+    connection.close()
+
+
+def test_optimize_database(tmp_path):
+    db_path = tmp_path / "database.db"
+    connection = get_connection(db_path, ConnectionProfile())
+    create_database(connection)
+    assert connection.execute("PRAGMA auto_vacuum").fetchone() == (2,)  # INCREMENTAL
+    connection.executemany(
+        "INSERT INTO scanned_directories VALUES (?, 0, '[]', ?)",
+        [(f"/directory/{i}", "x" * 1000) for i in range(1000)],
+    )
+    connection.commit()
+    clear_table(connection, "scanned_directories")
+    connection.commit()
+    connection.close()
+
+    size_before = get_database_size(db_path)
+    reclaimed_bytes = optimize_database(db_path)
+    assert reclaimed_bytes > 1000 * 1000
+    assert get_database_size(db_path) == size_before - reclaimed_bytes
+    assert optimize_database(db_path) >= 0
+
+
+def test_db_timestamps():
+    now = datetime.now().astimezone()
+    assert datetime_from_db(to_db_timestamp(now)) == now
+    assert to_db_timestamp(datetime(1970, 1, 1, 0, 0, 1, 5, tzinfo=timezone.utc)) == 1_000_005
+    assert to_db_timestamp(date(2023, 7, 1)) == to_db_timestamp(datetime(2023, 7, 1).astimezone())
+
+
+def test_run_reports(cursor):
+    for file_count in range(3):
+        run_stats = RunStats()
+        with run_stats.measure("scan") as measurement:
+            measurement.files = file_count
+        add_run(cursor, run_stats)
+
+    reports = get_run_reports(cursor, limit=2)
+    assert [report["phases"]["scan"]["files"] for report in reports] == [1, 2]
+
+
+def test_processor_versions(cursor, tmp_path):
+    found_files = fake_found_files(tmp_path)
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    file_a, file_b = tmp_path / "file_a.text", tmp_path / "file_b.text"
+    mark_timeline_file_as_processed(cursor, file_a, {"process_text": 2})
+    mark_timeline_file_as_processed(cursor, file_b)
+    assert dict(get_processed_files(cursor)) == {file_a: {"process_text": 2}, file_b: None}
+
+    mark_files_as_unprocessed(cursor, [file_a])
+    assert dict(get_processed_files(cursor)) == {file_b: None}
+
+    save_processor_versions(cursor, {"process_text": 1, "process_image": 1})
+    save_processor_versions(cursor, {"process_text": 2})
+    assert get_processor_versions(cursor) == {"process_text": 2, "process_image": 1}
+
+
+def test_file_failures(cursor, tmp_path):
+    found_files = list(fake_found_files(tmp_path))
+    add_found_files(cursor, found_files)
+    commit_found_files(cursor)
+    file_a = found_files[0]
+    add_file_failure(cursor, file_a.file_path, file_a.checksum, "ValueError: A", retry_delay=timedelta(hours=1))
+    add_file_failure(cursor, file_a.file_path, file_a.checksum, "ValueError: B", retry_delay=timedelta(hours=1))
+    failure = get_file_failures(cursor)[0]
+    assert (failure.file_path, failure.error, failure.attempts) == (file_a.file_path, "ValueError: B", 2)
+    assert failure.date_retry - failure.date_failed == timedelta(hours=2)
+
+    # The file is retried after date_retry
+    unprocessed_paths = {f.file_path for f in get_unprocessed_timeline_files(cursor)}
+    assert file_a.file_path not in unprocessed_paths
+    assert len(unprocessed_paths) == len(found_files) - 1
+    later = datetime.now() + timedelta(hours=3)
+    assert file_a.file_path in {f.file_path for f in get_unprocessed_timeline_files(cursor, later)}
+
+    # The file is retried when it changes
+    cursor.execute("UPDATE timeline_files SET checksum = 'changed' WHERE file_path = ?", [str(file_a.file_path)])
+    assert file_a.file_path in {f.file_path for f in get_unprocessed_timeline_files(cursor)}
+
+    clear_file_failure(cursor, file_a.file_path)
+    assert get_file_failures(cursor) == []
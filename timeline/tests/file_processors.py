@@ -1,8 +1,14 @@
 from datetime import datetime
 from pathlib import Path
 from timeline.file_processors import dates_from_filename, dates_from_file
+from timeline.file_processors.google_takeout import iter_json_array
+from timeline.file_processors.extensions import image_extensions
+from timeline.file_processors.registry import FileProcessor, FileProcessorRegistry, LazyFunction
 from timeline.file_processors.text import process_text
 from timeline.models import TimelineFile, EntryType
+import io
+import json
+import pickle
 import pytest
 
 september_10 = (
@@ -122,3 +128,95 @@ def test_process_text(tmp_path):
     assert output_path.exists()
     with output_path.open() as output_file:
         assert output_file.read() == 'Hello world'
+
+
+def test_file_processor_registry():
+    def process_a(file, metadata_root):
+        pass
+
+    def process_b(file, metadata_root):
+        pass
+
+    def process_c(file, metadata_root):
+        pass
+
+    registry = FileProcessorRegistry([
+        FileProcessor(process_a, extensions=['.csv', '.TXT']),
+        FileProcessor(process_b, name_suffixes=['.n26.csv'], file_names=['History.json']),
+        FileProcessor(process_c, file_names=['History.json'], extensions=['.json']),
+    ])
+    assert registry.get_processors(Path('/test/data.csv')) == [process_a]
+    assert registry.get_processors(Path('/test/data.N26.CSV')) == [process_a, process_b]
+    assert registry.get_processors(Path('/test/notes.txt')) == [process_a]
+    assert registry.get_processors(Path('/test/History.json')) == [process_b, process_c]
+    assert registry.get_processors(Path('/test/history.json')) == [process_c]
+    assert registry.get_processors(Path('/test/.csv')) == []
+    assert registry.get_processors(Path('/test/data.pdf')) == []
+
+
+def test_file_processor_registry_versions():
+    def process_a(file, metadata_root):
+        pass
+
+    def process_b(file, metadata_root):
+        pass
+
+    registry = FileProcessorRegistry([
+        FileProcessor(process_a, extensions=['.csv']),
+        FileProcessor(process_b, name_suffixes=['.n26.csv'], version=3, streams_entries=True),
+    ])
+    assert registry.versions == {'process_a': 1, 'process_b': 3}
+    assert registry.streaming_processors == {'process_b'}
+    assert registry.get_processor_versions(Path('/test/data.n26.csv')) == {'process_a': 1, 'process_b': 3}
+    assert registry.get_processor_versions(Path('/test/data.txt')) == {}
+
+
+def test_file_processor_registry_invalid_suffix():
+    with pytest.raises(ValueError):
+        FileProcessorRegistry([FileProcessor(process_text, extensions=['txt'])])
+
+
+def test_lazy_function(tmp_path):
+    lazy_process_text = pickle.loads(pickle.dumps(LazyFunction('timeline.file_processors.text:process_text')))
+    assert lazy_process_text.__name__ == 'process_text'
+    assert lazy_process_text.function is None
+
+    registry = FileProcessorRegistry([FileProcessor(lazy_process_text, extensions=['.txt'])])
+    assert registry.versions == {'process_text': 1}
+
+    file_path = tmp_path / 'test.txt'
+    file_path.write_text('Hello world')
+    timeline_file = TimelineFile(
+        file_path=file_path,
+        date_added=datetime.now().astimezone(),
+        file_mtime=datetime.now().astimezone(),
+        checksum='not important',
+        size=111,
+    )
+    entries = list(lazy_process_text(timeline_file, tmp_path))
+    assert lazy_process_text.function is process_text
+    assert entries[0].file_path == file_path
+
+
+def test_image_extensions():
+    # image_extensions is a copy of Pillow's list, so that Pillow is not imported when the processors are registered
+    from PIL import Image
+    import timeline.file_processors.image  # noqa: Registers the HEIF opener
+    assert image_extensions == {
+        extension
+        for extension, image_format in Image.registered_extensions().items()
+        if image_format in Image.OPEN and extension != '.psd'
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_iter_json_array(chunk_size):
+    locations = [{'timestampMs': str(i), 'latitudeE7': i * 1000, 'tags': ['a', {'b': ']'}]} for i in range(20)]
+    json_file = io.StringIO(json.dumps({'other': {'locations': 1}, 'locations': locations}, indent=2))
+    assert list(iter_json_array(json_file, 'locations', chunk_size)) == locations
+
+    assert list(iter_json_array(io.StringIO('{"locations":[]}'), 'locations', chunk_size)) == []
+    with pytest.raises(KeyError):
+        list(iter_json_array(io.StringIO('{"points": []}'), 'locations', chunk_size))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"locations": [{"a": 1}, {"b"'), 'locations', chunk_size))
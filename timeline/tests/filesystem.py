@@ -1,6 +1,14 @@
 from datetime import datetime
 from pathlib import Path
-from timeline.filesystem import get_files_in_paths, get_checksum
+from timeline.filesystem import (
+    get_files_in_paths,
+    get_checksum,
+    get_fingerprint,
+    walk_files,
+    FINGERPRINT_PREFIX,
+    TREE_CHECKSUM_PREFIX,
+)
+import timeline.filesystem
 import os
 import pytest
 
@@ -116,6 +124,107 @@ def test_get_files_in_paths_ignorerules_beat_includerules(tmp_path):
         assert path.suffix != '.log'
 
 
+def test_get_files_in_paths_ignored_directories(tmp_path):
+    fill_directory(tmp_path, sample_files)
+    fill_directory(tmp_path / '.git', sample_files)
+    fill_directory(tmp_path / 'logs' / '.trashed-123', sample_files)
+
+    paths = get_files_in_paths([tmp_path,], ignorerules=['.git/*', '.trashed*'])
+    assert sorted(paths) == sorted(tmp_path / file_path for file_path, file_date in sample_files)
+
+
+def test_get_files_in_paths_includerules_wildcards_stay_in_directory(tmp_path):
+    fill_directory(tmp_path, sample_files)
+    fill_directory(tmp_path / 'other', sample_files)
+
+    paths = get_files_in_paths([tmp_path,], includerules=['hello_*.txt', 'logs/*-1?-01.log'])
+    assert sorted(paths) == sorted([
+        tmp_path / 'hello_world.txt',
+        tmp_path / 'logs/2023-10-01.log',
+        tmp_path / 'logs/2023-11-01.log',
+        tmp_path / 'other/hello_world.txt',
+        tmp_path / 'other/logs/2023-10-01.log',
+        tmp_path / 'other/logs/2023-11-01.log',
+    ])
+
+    paths = get_files_in_paths([tmp_path,], includerules=['other*2023-10-01.log'])
+    assert paths == []
+
+
+def test_walk_files_stats(tmp_path):
+    fill_directory(tmp_path, sample_files)
+    (tmp_path / 'hello_world.txt').write_text('Hello world')
+
+    files = {
+        file_path: (size, mtime, device, inode)
+        for file_path, size, mtime, device, inode in walk_files([tmp_path,])
+    }
+    assert len(files) == len(sample_files)
+    for file_path, (size, mtime, device, inode) in files.items():
+        file_stats = file_path.stat()
+        assert (size, mtime, device, inode) == (
+            file_stats.st_size, file_stats.st_mtime, file_stats.st_dev, file_stats.st_ino
+        )
+
+
+def age_directories(dir_path):
+    # Recently modified directories are not cached
+    an_hour_ago = datetime.now().timestamp() - 3600
+    for directory in [dir_path, *(p for p in dir_path.rglob('*') if p.is_dir())]:
+        os.utime(directory, (an_hour_ago, an_hour_ago))
+
+
+def test_walk_files_directory_cache(tmp_path):
+    fill_directory(tmp_path, sample_files)
+    age_directories(tmp_path)
+
+    directory_cache = {}
+    files = list(walk_files([tmp_path,], directory_cache=directory_cache))
+    assert set(directory_cache.keys()) == {str(tmp_path), str(tmp_path / 'logs')}
+
+    # Unchanged directories are not listed again
+    (tmp_path / 'logs/2023-01-01.log').write_text('Modified in place')
+    assert list(walk_files([tmp_path,], directory_cache=directory_cache)) == files
+
+    # Changed directories are listed again
+    (tmp_path / 'logs/2023-12-01.log').touch()
+    (tmp_path / 'hello_world.txt').unlink()
+    paths = [file_path for file_path, size, mtime, device, inode in walk_files([tmp_path,], directory_cache=directory_cache)]
+    assert tmp_path / 'logs/2023-12-01.log' in paths
+    assert tmp_path / 'hello_world.txt' not in paths
+
+
+def test_walk_files_directory_cache_removed_directories(tmp_path):
+    fill_directory(tmp_path, sample_files)
+    age_directories(tmp_path)
+
+    directory_cache = {}
+    list(walk_files([tmp_path,], directory_cache=directory_cache))
+    for file_path in (tmp_path / 'logs').iterdir():
+        file_path.unlink()
+    (tmp_path / 'logs').rmdir()
+    age_directories(tmp_path)
+
+    paths = [file_path for file_path, size, mtime, device, inode in walk_files([tmp_path,], directory_cache=directory_cache)]
+    assert sorted(paths) == [tmp_path / 'hello_world.html', tmp_path / 'hello_world.txt']
+    assert set(directory_cache.keys()) == {str(tmp_path)}
+
+
+def test_walk_files_changed_paths(tmp_path):
+    fill_directory(tmp_path, sample_files)
+
+    changed_paths = [tmp_path / 'hello_world.txt', tmp_path / 'logs', tmp_path / 'missing.txt']
+    paths = [file_path for file_path, size, mtime, device, inode in walk_files([tmp_path,], changed_paths=changed_paths)]
+    assert sorted(paths) == sorted(tmp_path / file_path for file_path, file_date in sample_files[:1] + sample_files[2:])
+
+    # Rules still apply to the path relative to the input path
+    paths = [
+        file_path for file_path, size, mtime, device, inode
+        in walk_files([tmp_path,], includerules=['logs/2023-1*'], changed_paths=changed_paths)
+    ]
+    assert sorted(paths) == [tmp_path / 'logs/2023-10-01.log', tmp_path / 'logs/2023-11-01.log']
+
+
 def test_get_checksum(tmp_path):
     file_path = tmp_path / 'test.txt'
     with file_path.open('w') as file:
@@ -125,3 +234,51 @@ def test_get_checksum(tmp_path):
     with file_path.open('w') as file:
         file.write('goodbye_world')
     assert get_checksum(file_path) == 'OHFPSH9B8RMMENQQQMLEJ9F2HHFUIBAEEEABFVVE2OT6BKTUINQG'
+
+
+def test_get_checksum_large_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeline.filesystem, 'HASH_BUFFER_SIZE', 7)
+    monkeypatch.setattr(timeline.filesystem, 'hash_buffers', timeline.filesystem.threading.local())
+    file_path = tmp_path / 'test.txt'
+    with file_path.open('w') as file:
+        file.write('hello_world')
+    assert get_checksum(file_path) == '5FI7E739THTU8R4SI7EG6QMGA6IL0CAKBI2FAPKFSA4BR8DTMQPG'
+
+
+def test_get_checksum_tree_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeline.filesystem, 'TREE_HASH_CHUNK_SIZE', 4)
+    file_path = tmp_path / 'test.txt'
+
+    # Small files have the same checksum
+    with file_path.open('w') as file:
+        file.write('hell')
+    assert get_checksum(file_path, tree_hash=True) == get_checksum(file_path)
+
+    # Large files have a different checksum
+    with file_path.open('w') as file:
+        file.write('hello_world')
+    checksum = get_checksum(file_path, tree_hash=True)
+    assert checksum.startswith(TREE_CHECKSUM_PREFIX)
+    assert checksum != get_checksum(file_path)
+    assert checksum == get_checksum(file_path, tree_hash=True, tree_hash_workers=1)
+
+    with file_path.open('w') as file:
+        file.write('hello_worle')
+    assert get_checksum(file_path, tree_hash=True) != checksum
+
+
+def test_get_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeline.filesystem, 'FINGERPRINT_BLOCK_SIZE', 2)
+    file_path = tmp_path / 'test.txt'
+    file_path.write_text('0123456789')
+    fingerprint = get_fingerprint(file_path, 10)
+    assert fingerprint.startswith(FINGERPRINT_PREFIX)
+
+    # Changes in the sampled blocks change the fingerprint
+    for changed_content in ('x123456789', '0123x56789', '012345678x', '01234567890'):
+        file_path.write_text(changed_content)
+        assert get_fingerprint(file_path, len(changed_content)) != fingerprint
+
+    # Changes outside of the sampled blocks don't
+    file_path.write_text('01x3456789')
+    assert get_fingerprint(file_path, 10) == fingerprint
@@ -0,0 +1,209 @@
+from datetime import datetime
+from pathlib import Path
+from timeline.database import create_database, get_connection, get_file_failures, get_processor_versions
+from timeline.file_processors.registry import FileProcessor, FileProcessorRegistry
+from timeline.file_processors.text import process_markdown, process_text
+from timeline.generate import process_timeline_files, reset_outdated_files
+from timeline.models import EntryType, TimelineEntry, TimelineFile
+import pytest
+import sqlite3
+import time
+import timeline.generate
+
+
+@pytest.fixture
+def input_path(tmp_path) -> Path:
+    input_path = tmp_path / 'input'
+    for index in range(20):
+        directory = input_path / f'2023-07-{index % 5 + 1:02d}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'notes-{index}.txt').write_text(f'Note {index}\n' * index)
+        (directory / f'diary-{index}.md').write_text(f'# Day {index}\n\nIt was a *good* day.')
+    (input_path / 'empty.txt').touch()
+    return input_path
+
+
+def process_files(input_path: Path, output_path: Path, **kwargs) -> dict[str, list[tuple]]:
+    output_path.mkdir()
+    connection = get_connection(output_path / 'timeline.db')
+    cursor = connection.cursor()
+    create_database(cursor)
+    process_timeline_files(cursor, [input_path], {'*'}, set(), output_path / 'metadata', **kwargs)
+    tables = {
+        'timeline_entries': cursor.execute('SELECT * FROM timeline_entries ORDER BY entry_id').fetchall(),
+        'entry_days': cursor.execute('SELECT day, entry_id FROM entry_days ORDER BY day, entry_id').fetchall(),
+    }
+    connection.close()
+    return tables
+
+
+def test_process_timeline_files_with_workers(input_path, tmp_path):
+    # The worker processes give the same result as processing the files in this process
+    serial_tables = process_files(input_path, tmp_path / 'serial', workers=1, file_timeout=None)
+    worker_tables = process_files(input_path, tmp_path / 'workers', workers=2)
+    assert len(serial_tables['timeline_entries']) == 41
+    assert worker_tables == serial_tables
+
+
+def get_entry(file: TimelineFile, index: int) -> TimelineEntry:
+    return TimelineEntry(
+        file_path=file.file_path,
+        checksum=file.checksum,
+        entry_type=EntryType.GEOLOCATION,
+        date_start=datetime(2023, 7, 1, 12, index).astimezone(),
+        date_end=None,
+        data={'index': index},
+    )
+
+
+def process_corrupt_database(file: TimelineFile, metadata_root: Path):
+    yield get_entry(file, 0)
+    raise sqlite3.DatabaseError('file is not a database')
+
+
+def process_slowly(file: TimelineFile, metadata_root: Path):
+    yield get_entry(file, 0)
+    time.sleep(5)
+    yield get_entry(file, 1)
+
+
+def test_process_timeline_files_streamed_failures(tmp_path, monkeypatch):
+    # The files of processors with streams_entries are processed in this process, with the same deadline
+    registry = FileProcessorRegistry([
+        FileProcessor(process_corrupt_database, extensions=['.sqlitedb'], streams_entries=True),
+        FileProcessor(process_slowly, extensions=['.slow'], streams_entries=True),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    monkeypatch.setattr(timeline.generate, 'get_file_processors', lambda: (registry, []))
+
+    input_path = tmp_path / 'input'
+    input_path.mkdir()
+    (input_path / 'calendar.sqlitedb').write_text('Not a database')
+    (input_path / 'locations.slow').write_text('Slow')
+    (input_path / 'notes.txt').write_text('Notes')
+
+    connection = get_connection(tmp_path / 'timeline.db')
+    cursor = connection.cursor()
+    create_database(cursor)
+    process_timeline_files(cursor, [input_path], {'*'}, set(), tmp_path / 'metadata', workers=1, file_timeout=0.5)
+
+    assert not connection.in_transaction
+    assert {failure.file_path.name: failure.error.partition(':')[0] for failure in get_file_failures(cursor)} == {
+        'calendar.sqlitedb': 'sqlite3.DatabaseError',
+        'locations.slow': 'timeline.workers.ProcessingTimeout',
+    }
+    assert cursor.execute('SELECT file_path FROM timeline_entries').fetchall() == [(str(input_path / 'notes.txt'),)]
+    connection.close()
+
+
+def process_diary(file: TimelineFile, metadata_root: Path):
+    yield get_entry(file, 0)
+
+
+@pytest.fixture
+def processed_cursor(input_path, tmp_path, monkeypatch):
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    monkeypatch.setattr(timeline.generate, 'get_file_processors', lambda: (registry, []))
+    connection = get_connection(tmp_path / 'timeline.db')
+    cursor = connection.cursor()
+    create_database(cursor)
+    process_timeline_files(cursor, [input_path], {'*'}, set(), tmp_path / 'metadata')
+    yield cursor
+    connection.close()
+
+
+def get_unprocessed_extensions(cursor) -> dict[str, int]:
+    unprocessed_files = cursor.execute('SELECT file_path FROM timeline_files WHERE date_processed IS NULL')
+    extensions = [Path(file_path).suffix for file_path, in unprocessed_files]
+    return {extension: extensions.count(extension) for extension in extensions}
+
+
+def test_reset_outdated_files(processed_cursor):
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    assert reset_outdated_files(processed_cursor, registry) == 0
+
+    # A new version of a processor
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt'], version=2),
+    ])
+    assert reset_outdated_files(processed_cursor, registry) == 21
+    assert get_unprocessed_extensions(processed_cursor) == {'.txt': 21}
+    assert get_processor_versions(processed_cursor) == {'process_markdown': 1, 'process_text': 2}
+
+
+def test_reset_outdated_files_removed_processor(processed_cursor):
+    # A processor that is no longer registered, for example because ffmpeg is not installed
+    registry = FileProcessorRegistry([FileProcessor(process_text, extensions=['.txt'])])
+    assert reset_outdated_files(processed_cursor, registry) == 0
+    assert get_unprocessed_extensions(processed_cursor) == {}
+
+
+def test_reset_outdated_files_new_processor(processed_cursor):
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_diary, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    assert reset_outdated_files(processed_cursor, registry) == 20
+    assert get_unprocessed_extensions(processed_cursor) == {'.md': 20}
+
+
+def test_reset_outdated_files_reprocess(processed_cursor):
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    assert reset_outdated_files(processed_cursor, registry, reprocess=['process_markdown', 'process_pdf']) == 20
+    assert get_unprocessed_extensions(processed_cursor) == {'.md': 20}
+
+
+def test_reset_outdated_files_legacy_files(processed_cursor):
+    # Files processed before processor versions were saved
+    processed_cursor.execute('UPDATE timeline_files SET processor_versions = NULL')
+    processed_cursor.execute('DELETE FROM processor_versions')
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    assert reset_outdated_files(processed_cursor, registry) == 0
+    assert processed_cursor.execute(
+        "SELECT processor_versions FROM timeline_files WHERE file_path LIKE '%.md'"
+    ).fetchone() == ('{"process_markdown": 1}',)
+
+    # A processor registered later applies to the legacy files
+    registry = FileProcessorRegistry([
+        FileProcessor(process_markdown, extensions=['.md']),
+        FileProcessor(process_diary, extensions=['.md']),
+        FileProcessor(process_text, extensions=['.txt']),
+    ])
+    assert reset_outdated_files(processed_cursor, registry) == 20
+    assert get_unprocessed_extensions(processed_cursor) == {'.md': 20}
+
+
+class RecordingWorkerPool(timeline.generate.WorkerPool):
+    max_pending = 0
+
+    def submit(self, *args):
+        super().submit(*args)
+        RecordingWorkerPool.max_pending = max(RecordingWorkerPool.max_pending, len(self.pending))
+
+
+def test_process_timeline_files_without_processor(tmp_path, monkeypatch):
+    # Files without processors don't wait for the worker processes
+    monkeypatch.setattr(timeline.generate, 'WorkerPool', RecordingWorkerPool)
+    input_path = tmp_path / 'input'
+    input_path.mkdir()
+    for index in range(10):
+        (input_path / f'{index}-notes.txt').write_text(f'Note {index}')
+        (input_path / f'{index}-sidecar.json').write_text('{}')
+
+    tables = process_files(input_path, tmp_path / 'output', workers=4)
+    assert len(tables['timeline_entries']) == 10
+    assert RecordingWorkerPool.max_pending == 10
@@ -0,0 +1,74 @@
+from pathlib import Path
+from timeline.progress import ProgressReporter, format_duration
+import io
+import logging
+import timeline.progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_format_duration():
+    assert format_duration(5) == "5s"
+    assert format_duration(125) == "2m05s"
+    assert format_duration(3 * 3600 + 5 * 60 + 10) == "3h05m"
+
+
+def test_progress(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(timeline.progress.time, "monotonic", clock)
+    reporter = ProgressReporter(total_files=10, total_bytes=1000, mode="none")
+
+    clock.now += 2
+    reporter.file_done(Path("/a.jpg"), 100, "process_image", 1)
+    reporter.file_done(Path("/b.jpg"), 100, "process_image", 1)
+    reporter.file_done(Path("/c.md"), 50, "process_markdown", 0.1)
+    reporter.file_skipped(100)
+
+    progress = reporter.get_progress()
+    assert progress["files"] == 3
+    assert progress["total_files"] == 9
+    assert progress["files_per_second"] == 1.5
+    assert progress["bytes_per_second"] == 125
+    assert progress["eta"] == 4
+    assert progress["types"]["process_image"]["files_per_second"] == 1
+    assert progress["types"]["process_markdown"]["average_time"] == 0.1
+
+
+def test_progress_slow_file(monkeypatch, caplog):
+    reporter = ProgressReporter(total_files=10, total_bytes=1000, mode="none", slow_file_seconds=5)
+    with caplog.at_level(logging.WARNING):
+        reporter.file_done(Path("/a.jpg"), 100, "process_image", 1)
+        reporter.file_done(Path("/b.jpg"), 100, "process_image", 9)  # Not 10 times slower than average
+        reporter.file_done(Path("/c.jpg"), 100, "process_image", 60)
+        reporter.file_done(Path("/d.md"), 100, "process_markdown", 4)  # Not slow enough
+    assert [record.getMessage().split(" took")[0] for record in caplog.records] == ["Slow file: /c.jpg"]
+
+
+def test_progress_log(monkeypatch, caplog):
+    clock = FakeClock()
+    monkeypatch.setattr(timeline.progress.time, "monotonic", clock)
+    reporter = ProgressReporter(total_files=4, total_bytes=400, mode="log", interval=10)
+    with caplog.at_level(logging.INFO):
+        clock.now += 5
+        reporter.file_done(Path("/a.jpg"), 100, "process_image", 1)
+        assert not caplog.records
+        clock.now += 5
+        reporter.file_done(Path("/b.jpg"), 100, "process_image", 1)
+    assert caplog.records[0].getMessage().startswith("Processed 2/4 files (50.0%)")
+    assert caplog.records[0].progress["eta"] == 10
+
+
+def test_progress_tty():
+    stream = io.StringIO()
+    reporter = ProgressReporter(total_files=2, total_bytes=200, mode="tty", stream=stream)
+    reporter.file_done(Path("/a.jpg"), 100, "process_image", 1)
+    reporter.file_done(Path("/b.jpg"), 100, "process_image", 1)
+    reporter.finish()
+    assert stream.getvalue().endswith("\n")
+    assert "\r\033[KProcessed 2/2 files (100.0%)" in stream.getvalue()
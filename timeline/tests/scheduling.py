@@ -0,0 +1,64 @@
+from datetime import datetime
+from pathlib import Path
+from timeline.file_processors.registry import FileProcessor, FileProcessorRegistry
+from timeline.models import TimelineFile
+from timeline.scheduling import schedule_files
+import pytest
+
+
+def process_video(file, metadata_root):
+    pass
+
+
+def process_image(file, metadata_root):
+    pass
+
+
+def process_text(file, metadata_root):
+    pass
+
+
+registry = FileProcessorRegistry([
+    FileProcessor(process_video, extensions=['.mp4']),
+    FileProcessor(process_image, extensions=['.jpg']),
+    FileProcessor(process_text, extensions=['.txt']),
+])
+
+
+def timeline_file(file_name: str, size: int, year: int) -> TimelineFile:
+    return TimelineFile(
+        file_path=Path('/files') / file_name,
+        checksum=None,
+        date_added=datetime(2024, 1, 1).astimezone(),
+        file_mtime=datetime(year, 1, 1).astimezone(),
+        size=size,
+    )
+
+
+files = [
+    timeline_file('old.mp4', 500_000_000, 2015),
+    timeline_file('big.jpg', 20_000_000, 2020),
+    timeline_file('new.mp4', 10_000_000, 2023),
+    timeline_file('notes.txt', 1_000, 2016),
+    timeline_file('small.jpg', 1_000_000, 2022),
+]
+
+
+def file_names(files: list[TimelineFile]) -> list[str]:
+    return [file.file_path.name for file in files]
+
+
+@pytest.mark.parametrize('policies, expected', [
+    (['table'], ['old.mp4', 'big.jpg', 'new.mp4', 'notes.txt', 'small.jpg']),
+    (['cheap-first'], ['notes.txt', 'small.jpg', 'big.jpg', 'new.mp4', 'old.mp4']),
+    (['newest-first'], ['new.mp4', 'small.jpg', 'big.jpg', 'notes.txt', 'old.mp4']),
+    (['videos-last'], ['big.jpg', 'notes.txt', 'small.jpg', 'old.mp4', 'new.mp4']),
+    (['videos-last', 'newest-first'], ['small.jpg', 'big.jpg', 'notes.txt', 'new.mp4', 'old.mp4']),
+])
+def test_schedule_files(policies, expected):
+    assert file_names(schedule_files(files, policies, registry)) == expected
+
+
+def test_schedule_files_unknown_policy():
+    with pytest.raises(ValueError):
+        schedule_files(files, ['random'], registry)
@@ -0,0 +1,34 @@
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+
+heavy_modules = ['PIL', 'fitz', 'gpxpy', 'icalendar', 'markdown', 'pillow_heif', 'reverse_geocode', 'timezonefinder']
+
+
+def test_processor_dependencies_are_not_imported():
+    # The processors import their dependencies when they are first called
+    imported_modules = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            'import sys, timeline.generate; timeline.generate.get_file_processors(); print(" ".join(sys.modules))',
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    assert [module for module in heavy_modules if module in imported_modules] == []
+
+
+def test_startup_time():
+    # It took over 1.5s when all processors were imported on startup
+    command = [sys.executable, str(Path(__file__).parents[1] / 'bin' / 'timeline'), '--help']
+    subprocess.run(command, capture_output=True, check=True)  # Warm up the bytecode cache
+    durations = []
+    for _ in range(3):
+        start_time = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        durations.append(time.perf_counter() - start_time)
+    assert min(durations) < 1
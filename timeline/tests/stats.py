@@ -0,0 +1,66 @@
+from timeline.stats import Measurement, RunStats, format_run_history, measure
+import pstats
+import time
+import tracemalloc
+
+
+def test_measure():
+    measurement = Measurement(files=1)
+    with measure(measurement):
+        time.sleep(0.01)
+    with measure(measurement):
+        time.sleep(0.01)
+    assert measurement.wall_time >= 0.02
+    assert measurement.cpu_time < measurement.wall_time
+    assert measurement.files == 1
+
+
+def test_run_stats():
+    run_stats = RunStats()
+    with run_stats.measure("scan") as measurement:
+        measurement.files += 2
+    with run_stats.measure("scan") as measurement:
+        measurement.files += 3
+    run_stats.add_processor_measurements({"process_image": Measurement(files=1, bytes_read=100, entries=1)})
+    run_stats.add_processor_measurements({"process_image": Measurement(files=1, bytes_read=50, entries=2)})
+
+    report = run_stats.to_json_dict()
+    assert report["phases"]["scan"]["files"] == 5
+    assert report["processors"]["process_image"] == {
+        "wall_time": 0,
+        "cpu_time": 0,
+        "files": 2,
+        "bytes_read": 150,
+        "entries": 3,
+    }
+
+
+def test_format_run_history():
+    first_run = RunStats()
+    with first_run.measure("scan"):
+        pass
+    first_run.add_processor_measurements({"process_image": Measurement(wall_time=2, files=4)})
+    second_run = RunStats()
+    with second_run.measure("hash"):
+        pass
+
+    table = format_run_history([first_run.to_json_dict(), second_run.to_json_dict()])
+    lines = table.splitlines()
+    assert lines[0].split() == ["Date", "Duration", "scan", "hash"]
+    assert lines[1].split()[-2:] == ["0.0s", "-"]
+    assert lines[2].split()[-2:] == ["-", "0.0s"]
+    assert lines[5].split() == ["process_image", "4", "0.0", "0", "2.0s", "0.0s", "500ms"]
+
+
+def test_run_stats_profile(tmp_path):
+    run_stats = RunStats(profile_path=tmp_path, trace_memory=True)
+    with run_stats.measure("scan"):
+        with run_stats.measure("hash"):  # Part of the scan profile
+            data = [str(number) for number in range(1000)]
+    assert data
+    assert (tmp_path / "scan.pstats").exists()
+    assert (tmp_path / "scan.tracemalloc").exists()
+    assert not (tmp_path / "hash.pstats").exists()
+    assert pstats.Stats(str(tmp_path / "scan.pstats")).total_calls > 0
+    assert tracemalloc.Snapshot.load(str(tmp_path / "scan.tracemalloc")).traces
+    assert not tracemalloc.is_tracing()
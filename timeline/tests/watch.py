@@ -0,0 +1,112 @@
+from pathlib import Path
+from timeline.generate import watch_input_paths
+from timeline.watch import InotifyWatcher, PollingWatcher
+import pytest
+import sys
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watcher_factory(request):
+    if request.param == 'inotify':
+        if not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        return InotifyWatcher
+    return lambda *args: PollingWatcher(*args, poll_interval=0)
+
+
+def test_watcher_no_changes(tmp_path, watcher_factory):
+    (tmp_path / 'hello.txt').touch()
+    watcher = watcher_factory([tmp_path], {'*'}, set())
+    assert watcher.wait_for_changes(0.1) == set()
+
+
+def test_watcher_file_changes(tmp_path, watcher_factory):
+    (tmp_path / 'hello.txt').touch()
+    (tmp_path / 'goodbye.txt').touch()
+    watcher = watcher_factory([tmp_path], {'*'}, set())
+
+    (tmp_path / 'new.txt').write_text('New file')
+    (tmp_path / 'hello.txt').write_text('Modified file')
+    (tmp_path / 'goodbye.txt').unlink()
+
+    assert watcher.wait_for_changes(1) == {
+        tmp_path / 'new.txt',
+        tmp_path / 'hello.txt',
+        tmp_path / 'goodbye.txt',
+    }
+
+
+def test_watcher_file_edited_in_place(tmp_path, watcher_factory):
+    (tmp_path / 'diary.md').write_text('Monday')
+    watcher = watcher_factory([tmp_path], {'*'}, set())
+
+    directory_mtime = tmp_path.stat().st_mtime_ns
+    with (tmp_path / 'diary.md').open('a') as diary:
+        diary.write('\nTuesday')
+    assert tmp_path.stat().st_mtime_ns == directory_mtime
+
+    assert watcher.wait_for_changes(1) == {tmp_path / 'diary.md'}
+
+
+def test_watcher_new_directory(tmp_path, watcher_factory):
+    watcher = watcher_factory([tmp_path], {'*'}, set())
+
+    (tmp_path / 'new').mkdir()
+    watcher.wait_for_changes(1)
+    (tmp_path / 'new' / 'file.txt').write_text('New file')
+
+    assert Path(tmp_path / 'new' / 'file.txt') in watcher.wait_for_changes(1)
+
+
+def test_inotify_watcher_ignored_directories(tmp_path):
+    if not sys.platform.startswith('linux'):
+        pytest.skip('inotify is only available on Linux')
+    (tmp_path / '.git').mkdir()
+    watcher = InotifyWatcher([tmp_path], {'*'}, {'.git/*'})
+
+    (tmp_path / '.git' / 'index').write_text('Ignored')
+    assert watcher.wait_for_changes(0.1) == set()
+
+
+class StopWatching(BaseException):
+    pass
+
+
+class FakeWatcher:
+    def __init__(self, changes: list[set[Path]]):
+        self.changes = changes
+
+    def wait_for_changes(self, timeout: float) -> set[Path]:
+        if not self.changes:
+            raise StopWatching
+        return self.changes.pop(0)
+
+
+def test_watch_input_paths_update_fails():
+    updates = []
+
+    def update_timeline(changed_paths):
+        updates.append(changed_paths)
+        if len(updates) == 1:
+            raise FileNotFoundError('The file was removed')
+
+    # The first update fails. Its paths are updated again with the next change.
+    watcher = FakeWatcher([{Path('/a')}, set(), {Path('/b')}, set()])
+    with pytest.raises(StopWatching):
+        watch_input_paths(watcher, update_timeline, debounce_seconds=0, rescan_interval=3600)
+    assert updates == [{Path('/a')}, {Path('/a'), Path('/b')}]
+
+
+def test_watch_input_paths_rescan_fails():
+    updates = []
+
+    def update_timeline(changed_paths):
+        updates.append(changed_paths)
+        if len(updates) == 1:
+            raise PermissionError('The file is not readable')
+
+    # The rescan fails. It's done again with the next change.
+    watcher = FakeWatcher([set(), {Path('/b')}, set()])
+    with pytest.raises(StopWatching):
+        watch_input_paths(watcher, update_timeline, debounce_seconds=0, rescan_interval=0)
+    assert updates == [None, None]
@@ -0,0 +1,116 @@
+from concurrent.futures.process import BrokenProcessPool
+from timeline.workers import ProcessingTimeout, WorkerPool
+import os
+import signal
+import time
+import pytest
+
+
+def square(value):
+    return value * value
+
+
+def fail(value):
+    raise ValueError(f"Bad value: {value}")
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def sleep_without_deadline(seconds):
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)  # Like a C extension that never returns
+    time.sleep(seconds)
+
+
+def sleep_and_ignore_errors(seconds):
+    try:
+        time.sleep(seconds)
+    except Exception:  # Like a processor that logs the errors of ffmpeg and carries on
+        pass
+    return "done"
+
+
+def crash(value):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def get_results(pool: WorkerPool) -> list:
+    results = []
+    while pool.pending:
+        key, result, exception = pool.get_next_result()
+        results.append((key, result, type(exception) if exception else None))
+    return results
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(workers=2, timeout=0.5)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_pool_results_in_order(pool):
+    for value in range(5):
+        pool.submit(value, sleep if value == 0 else square, 0.1 if value == 0 else value)
+    pool.submit(5, fail, 5)
+    assert get_results(pool) == [
+        (0, None, None), (1, 1, None), (2, 4, None), (3, 9, None), (4, 16, None), (5, None, ValueError)
+    ]
+
+
+def test_worker_pool_timeout(pool):
+    pool.submit("slow", sleep, 5)
+    pool.submit("ignores errors", sleep_and_ignore_errors, 5)
+    pool.submit("stuck", sleep_without_deadline, 5)
+    pool.submit("fast", square, 3)
+    assert get_results(pool) == [
+        ("slow", None, ProcessingTimeout),
+        ("ignores errors", None, ProcessingTimeout),
+        ("stuck", None, ProcessingTimeout),
+        ("fast", 9, None),
+    ]
+
+
+def test_worker_pool_crash(pool):
+    pool.submit(1, square, 1)
+    pool.submit(2, crash, 2)
+    pool.submit(3, square, 3)
+    pool.submit(4, square, 4)
+    assert get_results(pool) == [(1, 1, None), (2, None, BrokenProcessPool), (3, 9, None), (4, 16, None)]
+
+    # After the crash, the workers are used normally again
+    pool.submit(5, square, 5)
+    assert get_results(pool) == [(5, 25, None)]
+
+
+def test_worker_pool_parallel_after_crash(pool):
+    pool.submit(1, crash, 1)
+    pool.submit(2, square, 2)
+    pool.submit(3, square, 3)
+    key, result, exception = pool.get_next_result()
+    assert (key, result, type(exception)) == (1, None, BrokenProcessPool)
+
+    # The calls submitted after the crash don't wait for the calls that are made again one at a time
+    for value in range(4, 10):
+        pool.submit(value, sleep, 0.3)
+    start_time = time.monotonic()
+    assert get_results(pool) == [(2, 4, None), (3, 9, None)] + [(value, None, None) for value in range(4, 10)]
+    assert time.monotonic() - start_time < 6 * 0.3
+
+
+class UnpicklableError(Exception):
+    def __init__(self, message, original_exception):
+        super().__init__(message)
+
+
+def fail_with_unpicklable_error(value):
+    raise UnpicklableError(f"Bad value: {value}", None)
+
+
+def test_worker_pool_unpicklable_error(pool):
+    pool.submit(1, fail_with_unpicklable_error, 1)
+    pool.submit(2, square, 2)
+    key, result, exception = pool.get_next_result()
+    assert str(exception).endswith("UnpicklableError: Bad value: 1")
+    assert get_results(pool) == [(2, 4, None)]
@@ -0,0 +1,187 @@
+"""
+Watches the input paths for file changes
+"""
+from pathlib import Path
+from timeline.filesystem import compile_ignored_directory_rules, walk_files
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# See /usr/include/linux/inotify.h
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+watch_mask = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+inotify_event = struct.Struct("iIII")  # wd, mask, cookie, len, followed by the file name
+
+
+class InotifyWatcher:
+    """
+    Watches the input paths with Linux's inotify API. Each directory is watched separately.
+    """
+
+    def __init__(self, paths: list[Path], includerules: set, ignorerules: set):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not initialize inotify")
+
+        self.paths = paths
+        self.ignored_directory_regex = compile_ignored_directory_rules(ignorerules)
+        self.watched_directories: dict[int, Path] = {}
+        for path in paths:
+            self.watch_directory(path)
+
+    def is_ignored(self, directory_path: str) -> bool:
+        return bool(
+            self.ignored_directory_regex
+            and self.ignored_directory_regex.match(directory_path + "/")
+        )
+
+    def watch_directory(self, path: Path):
+        for directory_path, subdirectories, files in os.walk(path):
+            subdirectories[:] = [
+                d
+                for d in subdirectories
+                if not self.is_ignored(os.path.join(directory_path, d))
+            ]
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory_path), watch_mask
+            )
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    logger.warning(
+                        f"Cannot watch {directory_path}: too many watched directories. "
+                        "Increase fs.inotify.max_user_watches with sysctl."
+                    )
+                continue
+            self.watched_directories[wd] = Path(directory_path)
+
+    def unwatch_directory(self, path: Path):
+        for wd, directory_path in list(self.watched_directories.items()):
+            if directory_path == path or directory_path.is_relative_to(path):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watched_directories[wd]
+
+    def wait_for_changes(self, timeout: float) -> set[Path]:
+        """
+        Wait until files change, or until the timeout (in seconds) is over. Returns the paths that changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        data = os.read(self.fd, 64 * 1024)
+        changed_paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_length = inotify_event.unpack_from(data, offset)
+            offset += inotify_event.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # Some events were lost. Everything could have changed.
+                changed_paths.update(self.paths)
+                continue
+
+            if mask & IN_IGNORED:
+                self.watched_directories.pop(wd, None)
+                continue
+
+            directory_path = self.watched_directories.get(wd)
+            if directory_path is None:
+                continue
+
+            changed_path = directory_path / name if name else directory_path
+            if mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    self.unwatch_directory(changed_path)
+                elif mask & (IN_CREATE | IN_MOVED_TO) and not self.is_ignored(str(changed_path)):
+                    self.watch_directory(changed_path)
+            changed_paths.add(changed_path)
+
+        return changed_paths
+
+
+class PollingWatcher:
+    """
+    Watches the input paths by scanning them periodically. Every file is stat'ed, because editing a file does not
+    change the mtime of its directory.
+    """
+
+    def __init__(
+        self,
+        paths: list[Path],
+        includerules: set,
+        ignorerules: set,
+        poll_interval: float = 60,
+    ):
+        self.paths = paths
+        self.includerules = includerules
+        self.ignorerules = ignorerules
+        self.poll_interval = poll_interval
+        self.files = self.get_files()
+
+    def get_files(self) -> dict[Path, tuple[int, float]]:
+        return {
+            file_path: (size, mtime)
+            for file_path, size, mtime, device, inode in walk_files(self.paths, self.includerules, self.ignorerules)
+        }
+
+    def wait_for_changes(self, timeout: float) -> set[Path]:
+        """
+        Wait until files change, or until the timeout (in seconds) is over. Returns the paths that changed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(min(self.poll_interval, deadline - time.monotonic()), 0))
+            files = self.get_files()
+            changed_paths = {
+                file_path
+                for file_path in files.keys() | self.files.keys()
+                if files.get(file_path) != self.files.get(file_path)
+            }
+            self.files = files
+            if changed_paths or time.monotonic() >= deadline:
+                return changed_paths
+
+
+def get_watcher(paths: list[Path], includerules: set, ignorerules: set):
+    try:
+        return InotifyWatcher(paths, includerules, ignorerules)
+    except (OSError, AttributeError):
+        logger.info("inotify is not available. Polling the input paths for changes instead.")
+        return PollingWatcher(paths, includerules, ignorerules)
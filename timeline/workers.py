@@ -0,0 +1,147 @@
+"""
+Runs the file processors in worker processes, with a deadline for each file
+"""
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+import pickle
+import signal
+import traceback
+
+
+class ProcessingTimeout(BaseException):
+    """
+    Raised when a file takes too long to process. It's not an Exception, so that the processors that catch all
+    exceptions don't catch it.
+    """
+    pass
+
+
+class ProcessingError(Exception):
+    """
+    Replaces exceptions that can't be sent back from a worker process.
+    """
+    pass
+
+
+@contextmanager
+def deadline(timeout: float | None):
+    """
+    Raises ProcessingTimeout in the main thread if the block takes more than timeout seconds.
+
+    This only interrupts Python code. Subprocesses started with subprocess.run are killed, but a C extension that
+    never returns is not interrupted.
+    """
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        def on_timeout(signal_number, frame):
+            raise ProcessingTimeout(f"Processing took more than {timeout:.0f}s")
+
+        previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        yield
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def call_with_deadline(timeout: float | None, function: Callable, *args):
+    """
+    Calls function in a worker process. If it takes more than timeout seconds, ProcessingTimeout is raised. See
+    deadline. WorkerPool stops the workers that don't return.
+    """
+    try:
+        with deadline(timeout):
+            return function(*args)
+    except Exception as exception:
+        # Some exceptions can't be unpickled, and that would stop the worker pool
+        try:
+            pickle.loads(pickle.dumps(exception))
+        except Exception:
+            raise ProcessingError("".join(traceback.format_exception_only(exception)).strip()) from None
+        raise
+
+
+class WorkerPool:
+    """
+    Calls functions in worker processes, and returns their results in the order they were submitted.
+
+    A call that takes more than timeout seconds fails with ProcessingTimeout. If a worker is stuck for twice as long,
+    or if a worker crashes, the workers are replaced. If more than one call was running when a worker crashed, those
+    calls are then made again one at a time, to find which one crashed it. The calls submitted after the crash run
+    in parallel as usual.
+    """
+
+    def __init__(self, workers: int, timeout: float | None = None):
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        # (key, function, args, future) tuples. The future is None if the call must be made again, one at a time.
+        self.pending: deque[tuple[Any, Callable, tuple, Future | None]] = deque()
+
+    def keys(self) -> list:
+        return [key for key, _, _, _ in self.pending]
+
+    def submit(self, key: Any, function: Callable, *args):
+        future = self.executor.submit(call_with_deadline, self.timeout, function, *args)
+        self.pending.append((key, function, args, future))
+
+    def is_full(self) -> bool:
+        return len(self.pending) >= self.workers * 4
+
+    def get_next_result(self) -> tuple[Any, Any, BaseException | None]:
+        """
+        Waits for the oldest call, and returns its (key, result, exception) tuple. If the call failed, the result
+        is None.
+        """
+        key, function, args, future = self.pending[0]
+        if future is None:
+            future = self.executor.submit(call_with_deadline, self.timeout, function, *args)
+            self.pending[0] = (key, function, args, future)
+
+        # The oldest call is already running, because the calls are started in order. The calls that must be made
+        # one at a time are started when they are the oldest.
+        done, _ = wait([future], timeout=self.timeout * 2 if self.timeout else None)
+        if not done:
+            self.pending.popleft()
+            self.restart()
+            return key, None, ProcessingTimeout(
+                f"Processing took more than {self.timeout * 2:.0f}s. The worker process was stopped."
+            )
+
+        try:
+            result = future.result()
+        except BrokenProcessPool as exception:
+            running_calls = sum(1 for _, _, _, future in self.pending if future is not None)
+            if running_calls > 1:
+                # Any of the running calls could have crashed the worker
+                self.restart()
+                return self.get_next_result()
+            self.pending.popleft()
+            self.restart()
+            return key, None, exception
+        except (Exception, ProcessingTimeout) as exception:
+            self.pending.popleft()
+            return key, None, exception
+
+        self.pending.popleft()
+        return key, result, None
+
+    def restart(self):
+        """
+        Replace the workers. The calls that were pending are made again, one at a time.
+        """
+        for process in list((self.executor._processes or {}).values()):
+            process.kill()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = deque((key, function, args, None) for key, function, args, _ in self.pending)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)